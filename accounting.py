@@ -0,0 +1,170 @@
+"""
+Token usage and cost accounting.
+
+lib.py reports the `usage` of every completion and embedding call here. Calls
+made while serving an HTTP request (or a turn on /ws/chat) are collected on
+that request's context and attributed to its endpoint, user and conversation; the middleware hands
+them to a sink (main.save_usage_events) once the response has been sent, so
+accounting never adds latency to the request itself.
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import token_counts
+
+# USD per million tokens: (prompt, cached prompt, completion)
+PRICING_PER_MILLION = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+}
+
+
+class UsageEvent:
+    __slots__ = ("created_at", "stage", "model", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_nano_usd")
+
+    def __init__(self, stage: str, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int):
+        self.created_at = int(time.time())
+        self.stage = stage
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+        self.cost_nano_usd = cost_nano_usd(model, prompt_tokens, completion_tokens, cached_tokens)
+
+
+class UsageContext:
+    """Attribution for the calls made while handling one request."""
+
+    def __init__(self, endpoint: str | None = None, user_id: str | None = None, conversation_id: int | None = None, sink=None):
+        self.endpoint = endpoint
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.events: list[UsageEvent] = []
+        # Where the events go once the request is done
+        self.sink = sink
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def close(self) -> list[UsageEvent]:
+        """The events to flush to the sink; any added from now on are flushed by add()."""
+        with self._lock:
+            self._closed = True
+            return self.events
+
+    def add(self, events: list[UsageEvent]):
+        """
+        Attribute events collected elsewhere to this request: kept with its
+        own while it is open, handed to its sink separately once it has been
+        flushed.
+        """
+        with self._lock:
+            if not self._closed:
+                self.events.extend(events)
+                return
+        if events and self.sink is not None:
+            late = UsageContext(self.endpoint, self.user_id, self.conversation_id)
+            late.events = list(events)
+            self.sink(late)
+
+
+_current: contextvars.ContextVar[UsageContext | None] = contextvars.ContextVar("usage_context", default=None)
+
+
+def cost_nano_usd(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> int:
+    """
+    Cost of one call in billionths of a dollar (0 for unknown models). Fine
+    enough that every listed price is a whole number per token, so a short
+    embedding call isn't rounded down to nothing.
+    """
+    prompt_price, cached_price, completion_price = PRICING_PER_MILLION.get(model, (0.0, 0.0, 0.0))
+    uncached = max(0, prompt_tokens - cached_tokens)
+    # price per million tokens * 1000 == nano-dollars per token
+    return round((uncached * prompt_price + cached_tokens * cached_price + completion_tokens * completion_price) * 1000)
+
+
+def record_call(stage: str, model: str, usage):
+    """Attach the usage of one upstream call to the current request, if any."""
+    context = _current.get()
+    if context is None or usage is None:
+        return
+    context.add([UsageEvent(stage, model, *token_counts(usage))])
+
+
+@contextlib.contextmanager
+def separate_usage():
+    """
+    Collect the calls made inside the block on their own context, so their
+    usage can be inspected, then hand them on to the enclosing request for
+    attribution as usual; to its sink directly if the block outlasted the
+    request (a discarded speculation finishing late).
+    """
+    parent = _current.get()
+    context = UsageContext()
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            parent.add(context.events)
+
+
+@contextlib.asynccontextmanager
+async def collecting_usage(endpoint: str, sink):
+    """
+    Collect the calls made inside the block as one request to `endpoint`, and pass
+    them to `sink(context)` afterwards, as UsageMiddleware does for HTTP requests.
+    """
+    context = UsageContext(endpoint=endpoint, sink=sink)
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        if context.close():
+            await run_in_threadpool(sink, context)
+
+
+def set_attribution(user_id: str | None = None, conversation_id: int | None = None):
+    """Set who the current request's calls should be billed to."""
+    context = _current.get()
+    if context is None:
+        return
+    if user_id is not None:
+        context.user_id = user_id
+    if conversation_id is not None:
+        context.conversation_id = conversation_id
+
+
+class UsageMiddleware:
+    """
+    ASGI middleware that opens a usage context for every HTTP request and
+    passes the collected events to `sink(context)` after the response.
+    """
+
+    def __init__(self, app, sink):
+        self.app = app
+        self.sink = sink
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = UsageContext(sink=self.sink)
+        token = _current.set(context)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            # Set before closing, so calls finishing after the flush are attributed to it too
+            route = scope.get("route")
+            context.endpoint = getattr(route, "path", None) or scope["path"]
+            if context.close():
+                await run_in_threadpool(self.sink, context)
@@ -0,0 +1,270 @@
+"""
+Admission control for LLM-bound work.
+
+There are two layers of limits:
+
+- Per user: AdmissionMiddleware lets each user run at most
+  CHEFING_USER_CONCURRENCY LLM-bound requests (/api/chat, /api/profile,
+  /api/feedback, and turns on /ws/chat through `admitted`) at once. Up to CHEFING_USER_QUEUE more wait, without using
+  a worker thread, for at most CHEFING_ADMISSION_TIMEOUT seconds.
+- Per upstream model: lib's upstream calls take a slot from a global cap per
+  model (CHEFING_MODEL_CONCURRENCY, or e.g. CHEFING_MODEL_CONCURRENCY_GPT_4O
+  for one model). Up to CHEFING_MODEL_QUEUE calls wait, until the request's
+  deadline (CHEFING_REQUEST_DEADLINE seconds after it was admitted).
+
+A request that would overflow a queue, or would wait past its deadline, gets
+429 with a Retry-After estimated from recent slot hold times. A burst is
+therefore turned away early, instead of every call going upstream at once,
+hitting rate limits together and timing out. Calls made outside an HTTP
+request (batch.py) have no deadline: they wait for a model slot and are
+never shed.
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import math
+import os
+import re
+import threading
+import time
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED, ADMISSION_WAIT
+
+USER_CONCURRENCY = int(os.environ.get("CHEFING_USER_CONCURRENCY", "2"))
+USER_QUEUE = int(os.environ.get("CHEFING_USER_QUEUE", "4"))
+ADMISSION_TIMEOUT = float(os.environ.get("CHEFING_ADMISSION_TIMEOUT", "10"))
+MODEL_CONCURRENCY = int(os.environ.get("CHEFING_MODEL_CONCURRENCY", "16"))
+MODEL_QUEUE = int(os.environ.get("CHEFING_MODEL_QUEUE", "64"))
+REQUEST_DEADLINE = float(os.environ.get("CHEFING_REQUEST_DEADLINE", "60"))
+
+# Smoothing for the average time a slot is held, used to estimate Retry-After
+HOLD_TIME_ALPHA = 0.2
+INITIAL_HOLD_SECONDS = 2.0
+
+# time.monotonic() by which the current request must have its upstream calls started
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("admission_deadline", default=None)
+
+
+class Overloaded(HTTPException):
+    """Too much work queued: 429 with a Retry-After hint."""
+
+    def __init__(self, limiter: str, retry_after: float):
+        super().__init__(
+            status_code=429,
+            detail=f"Too many requests in progress ({limiter}), please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class _Slots:
+    """Bookkeeping shared by the async and thread limiters."""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.active = 0
+        self.hold_seconds = INITIAL_HOLD_SECONDS
+
+    def retry_after(self, waiting: int) -> float:
+        # Time for everyone ahead to get a slot and for one slot to free up
+        return self.hold_seconds * (waiting // self.limit + 1)
+
+    def held(self, seconds: float):
+        self.hold_seconds += HOLD_TIME_ALPHA * (seconds - self.hold_seconds)
+
+    def shed(self, reason: str, waited: float, waiting: int):
+        ADMISSION_SHED.inc(self.name, reason)
+        ADMISSION_WAIT.observe(self.name, "shed", value=waited)
+        raise Overloaded(self.name, self.retry_after(waiting))
+
+    def gauges(self, waiting: int):
+        ADMISSION_QUEUE_DEPTH.set(self.name, value=waiting)
+        ADMISSION_IN_FLIGHT.set(self.name, value=self.active)
+
+
+class AsyncLimiter(_Slots):
+    """Concurrency cap with a bounded FIFO queue, for coroutines on one event loop."""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        super().__init__(name, limit, max_queue)
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+
+    async def acquire(self, timeout: float):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.gauges(0)
+            ADMISSION_WAIT.observe(self.name, "admitted", value=0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed("queue_full", 0.0, len(self._waiters))
+
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.gauges(len(self._waiters))
+        try:
+            # release() hands the slot straight to the first waiter, so `active` is already counted
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            # Unless the slot arrived just as the wait timed out
+            if not (waiter.done() and not waiter.cancelled()):
+                self.shed("deadline", time.monotonic() - started, len(self._waiters))
+        except asyncio.CancelledError:
+            # The client went away while queued; pass on a slot it was just handed
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self.gauges(len(self._waiters))
+        ADMISSION_WAIT.observe(self.name, "admitted", value=time.monotonic() - started)
+
+    def release(self, held_seconds: float | None = None):
+        if held_seconds is not None:
+            self.held(held_seconds)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.gauges(len(self._waiters))
+                return
+        self.active -= 1
+        self.gauges(len(self._waiters))
+
+
+class ThreadLimiter(_Slots):
+    """Concurrency cap with a bounded queue, for blocking calls made from worker threads."""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        super().__init__(name, limit, max_queue)
+        self._condition = threading.Condition()
+        self._waiting = 0
+
+    def acquire(self, deadline: float | None):
+        with self._condition:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                self.gauges(0)
+                ADMISSION_WAIT.observe(self.name, "admitted", value=0.0)
+                return
+            if deadline is not None and self._waiting >= self.max_queue:
+                self.shed("queue_full", 0.0, self._waiting)
+
+            started = time.monotonic()
+            self._waiting += 1
+            self.gauges(self._waiting)
+            try:
+                while self.active >= self.limit:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.shed("deadline", time.monotonic() - started, self._waiting)
+                    self._condition.wait(remaining)
+                self.active += 1
+            finally:
+                self._waiting -= 1
+                self.gauges(self._waiting)
+            ADMISSION_WAIT.observe(self.name, "admitted", value=time.monotonic() - started)
+
+    def release(self, held_seconds: float):
+        with self._condition:
+            self.held(held_seconds)
+            self.active -= 1
+            self.gauges(self._waiting)
+            self._condition.notify()
+
+
+_model_limiters: dict[str, ThreadLimiter] = {}
+_model_limiters_lock = threading.Lock()
+
+
+def model_concurrency(model: str) -> int:
+    """In-flight cap for one upstream model, e.g. CHEFING_MODEL_CONCURRENCY_GPT_4O for gpt-4o."""
+    override = os.environ.get("CHEFING_MODEL_CONCURRENCY_" + re.sub(r"\W", "_", model).upper())
+    return int(override) if override else MODEL_CONCURRENCY
+
+
+def model_limiter(model: str) -> ThreadLimiter:
+    with _model_limiters_lock:
+        limiter = _model_limiters.get(model)
+        if limiter is None:
+            limiter = _model_limiters[model] = ThreadLimiter(f"model:{model}", model_concurrency(model), MODEL_QUEUE)
+        return limiter
+
+
+def call_upstream(model: str, fn):
+    """Run `fn()` (one upstream call to `model`) within the model's in-flight cap."""
+    limiter = model_limiter(model)
+    limiter.acquire(_deadline.get())
+    started = time.monotonic()
+    try:
+        return fn()
+    finally:
+        limiter.release(time.monotonic() - started)
+
+
+_user_limiters: dict[str, AsyncLimiter] = {}
+
+
+def user_limiter(user: str) -> AsyncLimiter:
+    limiter = _user_limiters.get(user)
+    if limiter is None:
+        # Per-user state; all users share the "user" metric labels
+        limiter = _user_limiters[user] = AsyncLimiter("user", USER_CONCURRENCY, USER_QUEUE)
+    return limiter
+
+
+@contextlib.asynccontextmanager
+async def admitted(user: str):
+    """
+    Hold one of the user's slots for work that isn't an HTTP request (a WebSocket
+    chat turn), with the same deadline for its upstream calls. Raises Overloaded.
+    """
+    limiter = user_limiter(user)
+    await limiter.acquire(ADMISSION_TIMEOUT)
+    started = time.monotonic()
+    token = _deadline.set(started + REQUEST_DEADLINE)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+        limiter.release(time.monotonic() - started)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits POSTs to `paths` under a per-user concurrency
+    cap, and sets the deadline by which their upstream calls must start.
+    `user_of(scope)` names the user a request belongs to.
+    """
+
+    def __init__(self, app, paths: set[str], user_of):
+        self.app = app
+        self.paths = paths
+        self.user_of = user_of
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = user_limiter(self.user_of(scope))
+        try:
+            await limiter.acquire(ADMISSION_TIMEOUT)
+        except Overloaded as e:
+            await JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        token = _deadline.set(started + REQUEST_DEADLINE)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+            limiter.release(time.monotonic() - started)
@@ -0,0 +1,204 @@
+"""
+Cold storage for idle conversations.
+
+Every chat turn keeps its full response (recipe JSON) in the chat table, so
+the table only grows, and scans of it and the page cache get worse with it.
+archive_idle() moves the messages of conversations not updated for
+`idle_days` into chat_archive, as one compressed blob per conversation:
+zstd if the `zstandard` package is installed, zlib otherwise. The codec is
+stored with each blob, so archives written with either can be read. The
+job runs ARCHIVE_BATCH conversations per transaction through the single
+writer (db_writer.py), so it never holds the write lock for long. After
+each batch, the pages it freed are handed back to the file system with
+`PRAGMA incremental_vacuum`.
+
+Archived conversations still list with their message count. Their
+messages are decompressed when /api/conversations/{id}/messages asks for
+them. Posting a new message to one restores it into the chat table first,
+with its original message ids. While archived, its messages are left out of
+search, /api/history and the per-message full-text index.
+
+New databases are created with auto_vacuum=INCREMENTAL (see migrations.py).
+An older database keeps its freed pages for reuse until converted once with
+`python -m archive database.db --convert`, which runs a full VACUUM.
+
+Run the job with `python -m archive database.db --idle-days 30`, or set
+CHEFING_ARCHIVE_IDLE_DAYS to have the server run it every
+CHEFING_ARCHIVE_INTERVAL_HOURS (default 24).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import zlib
+
+import db_writer
+from fastjson import dumps, loads
+from metrics import ARCHIVED_CONVERSATIONS
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used instead
+    zstandard = None
+
+_idle_days = os.environ.get("CHEFING_ARCHIVE_IDLE_DAYS")
+IDLE_DAYS = float(_idle_days) if _idle_days else None
+INTERVAL_HOURS = float(os.environ.get("CHEFING_ARCHIVE_INTERVAL_HOURS", "24"))
+# Conversations moved per write transaction
+ARCHIVE_BATCH = 50
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 9
+
+logger = logging.getLogger("chefing.archive")
+
+
+def compress(data: bytes) -> tuple[str, bytes]:
+    """(codec, compressed bytes), with the best codec available."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("this conversation was archived with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"unknown archive codec {codec!r}")
+
+
+def load(conn: sqlite3.Connection, conversation_id: int) -> list[tuple] | None:
+    """
+    An archived conversation's messages as (id, message, response, has_image,
+    image_path, created_at) rows in id order, or None if it isn't archived.
+    """
+    row = conn.execute("SELECT codec, data FROM chat_archive WHERE conversation_id = ?", (conversation_id,)).fetchone()
+    if row is None:
+        return None
+    return [tuple(message) for message in loads(decompress(row[0], row[1]))]
+
+
+def restore(conn: sqlite3.Connection, conversation_id: int) -> bool:
+    """Move an archived conversation's messages back into chat. Run on the writer; returns whether it was archived."""
+    messages = load(conn, conversation_id)
+    if messages is None:
+        return False
+    user_id = conn.execute("SELECT user_id FROM chat_archive WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+    conn.executemany(
+        """
+        INSERT INTO chat (id, conversation_id, user_id, message, response, has_image, image_path, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(message_id, conversation_id, user_id, *rest) for message_id, *rest in messages],
+    )
+    conn.execute("DELETE FROM chat_archive WHERE conversation_id = ?", (conversation_id,))
+    ARCHIVED_CONVERSATIONS.inc("restored")
+    return True
+
+
+def restore_if_archived(db_path: str, conversation_id: int) -> bool:
+    """Restore the conversation if it is archived (one indexed read when it isn't)."""
+    conn = db_writer.connect(db_path)
+    try:
+        archived = conn.execute("SELECT 1 FROM chat_archive WHERE conversation_id = ?", (conversation_id,)).fetchone()
+    finally:
+        conn.close()
+    if not archived:
+        return False
+    return db_writer.write(db_path, lambda conn: restore(conn, conversation_id))
+
+
+def _archive_batch(conn: sqlite3.Connection, idle_days: float, limit: int) -> dict:
+    stats = {"conversations": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    conversations = conn.execute(
+        """
+        SELECT id, user_id FROM conversations
+        WHERE updated_at < datetime('now', ?)
+          AND NOT EXISTS (SELECT 1 FROM chat_archive WHERE conversation_id = conversations.id)
+          AND EXISTS (SELECT 1 FROM chat WHERE conversation_id = conversations.id)
+        ORDER BY updated_at
+        LIMIT ?
+        """,
+        (f"-{idle_days} days", limit),
+    ).fetchall()
+    for conversation_id, user_id in conversations:
+        messages = conn.execute(
+            """
+            SELECT id, message, response, has_image, image_path, created_at
+            FROM chat WHERE conversation_id = ? ORDER BY id
+            """,
+            (conversation_id,),
+        ).fetchall()
+        raw = dumps([list(message) for message in messages])
+        codec, data = compress(raw)
+        conn.execute(
+            "INSERT INTO chat_archive (conversation_id, user_id, messages, codec, data) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, user_id, len(messages), codec, data),
+        )
+        conn.execute("DELETE FROM chat WHERE conversation_id = ?", (conversation_id,))
+        ARCHIVED_CONVERSATIONS.inc("archived")
+        stats["conversations"] += 1
+        stats["messages"] += len(messages)
+        stats["raw_bytes"] += len(raw)
+        stats["stored_bytes"] += len(data)
+    # Give this batch's free pages back to the file system (a no-op without incremental auto-vacuum)
+    conn.execute("PRAGMA incremental_vacuum").fetchall()
+    return stats
+
+
+def archive_idle(db_path: str, idle_days: float, batch: int = ARCHIVE_BATCH) -> dict:
+    """Archive every conversation idle for more than `idle_days`, `batch` per transaction. Returns totals."""
+    totals = {"conversations": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    while True:
+        stats = db_writer.write(db_path, lambda conn: _archive_batch(conn, idle_days, batch))
+        for key, value in stats.items():
+            totals[key] += value
+        if stats["conversations"] < batch:
+            return totals
+
+
+async def run_periodically(db_path: str, idle_days: float, interval_hours: float = INTERVAL_HOURS):
+    """Run archive_idle now and then every `interval_hours`, until cancelled."""
+    while True:
+        try:
+            totals = await asyncio.to_thread(archive_idle, db_path, idle_days)
+            if totals["conversations"]:
+                logger.info("Archived %d conversations (%d messages)", totals["conversations"], totals["messages"])
+        except Exception:
+            logger.exception("Archiving idle conversations failed")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+def convert_to_incremental(db_path: str):
+    """Switch an existing database to incremental auto-vacuum; rewrites the whole file once."""
+    conn = db_writer.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move idle conversations into compressed cold storage.")
+    parser.add_argument("db_path")
+    parser.add_argument("--idle-days", type=float, default=IDLE_DAYS or 30)
+    parser.add_argument("--convert", action="store_true", help="First switch the database to incremental auto-vacuum (full VACUUM)")
+    args = parser.parse_args()
+
+    from migrations import migrate
+
+    migrate(args.db_path)
+    if args.convert:
+        convert_to_incremental(args.db_path)
+    totals = archive_idle(args.db_path, args.idle_days)
+    db_writer.close_all()
+    ratio = totals["raw_bytes"] / totals["stored_bytes"] if totals["stored_bytes"] else 0
+    print(
+        f"Archived {totals['conversations']} conversations ({totals['messages']} messages), "
+        f"{totals['raw_bytes']} bytes compressed to {totals['stored_bytes']} ({ratio:.1f}x, {compress(b'')[0]})"
+    )
@@ -0,0 +1,286 @@
+"""
+Offline batch recipe generation from a JSONL file.
+
+Each input line is one recipe request:
+
+    {"id": "r1", "user_input": "A quick vegan dinner", "instructions": [], "preferences": [],
+     "restrictions": ["peanut allergy"], "situation": [], "fridge_image": "uploads/fridge.jpeg"}
+
+`id` is optional (the line number is used otherwise) and `fridge_image` switches the
+request to generate_recipe_from_fridge. Each output line is
+{"id": ..., "status": "ok", "recipe": {...}} or {"id": ..., "status": "error", "error": "..."}.
+
+Usage:
+    # bounded worker pool against the regular API; re-running resumes where it stopped
+    python batch.py run requests.jsonl results.jsonl --concurrency 8 --rpm 300
+
+    # the provider's asynchronous Batch API (cheaper, results within 24h)
+    python batch.py submit requests.jsonl --state batch_state.json
+    python batch.py collect results.jsonl --state batch_state.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+
+import openai
+
+import lib
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def read_requests(path: str):
+    """Stream (id, request) pairs from a JSONL file without loading it all."""
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            request = json.loads(line)
+            yield str(request.get("id", line_number)), request
+
+
+def completed_ids(output_path: str) -> set[str]:
+    """Ids that already have a successful result; these are skipped on resume."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+
+def _arguments(request: dict) -> tuple:
+    return (
+        request["user_input"],
+        request.get("instructions", []),
+        request.get("preferences", []),
+        request.get("restrictions", []),
+        request.get("situation", []),
+    )
+
+
+def generate(request: dict):
+    if request.get("fridge_image"):
+        return lib.generate_recipe_from_fridge(request["fridge_image"], *_arguments(request))
+    return lib.generate_recipe(*_arguments(request))
+
+
+class RateLimiter:
+    """
+    Shared pacing for all workers: an optional requests-per-minute cap, plus a
+    global pause whenever the API answers with a rate limit error.
+    """
+
+    def __init__(self, rpm: float | None):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_slot, self.paused_until)
+            self.next_slot = start + self.interval
+        delay = start - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def _retry_after(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int, rpm: float | None, max_retries: int):
+    done = completed_ids(output_path)
+    limiter = RateLimiter(rpm)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    started = time.monotonic()
+
+    with open(output_path, "a") as out:
+
+        def write(record: dict):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                request_id, request = item
+                for attempt in range(max_retries + 1):
+                    await limiter.acquire()
+                    try:
+                        recipe = await asyncio.to_thread(generate, request)
+                    except RETRYABLE_ERRORS as e:
+                        if attempt == max_retries:
+                            write({"id": request_id, "status": "error", "error": str(e)})
+                            counts["error"] += 1
+                            break
+                        wait = _retry_after(e, attempt)
+                        if isinstance(e, openai.RateLimitError):
+                            # Back every worker off, not just this one
+                            limiter.pause(wait)
+                        await asyncio.sleep(wait)
+                    except Exception as e:
+                        write({"id": request_id, "status": "error", "error": str(e)})
+                        counts["error"] += 1
+                        break
+                    else:
+                        if recipe:
+                            write({"id": request_id, "status": "ok", "recipe": recipe.get("recipe", recipe)})
+                            counts["ok"] += 1
+                        else:
+                            write({"id": request_id, "status": "error", "error": "empty response"})
+                            counts["error"] += 1
+                        break
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for request_id, request in read_requests(input_path):
+            if request_id in done:
+                counts["skipped"] += 1
+                continue
+            await queue.put((request_id, request))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Done in {elapsed:.1f}s: {counts['ok']} ok, {counts['error']} failed, "
+        f"{counts['skipped']} already completed",
+        file=sys.stderr,
+    )
+    return counts
+
+
+def submit_batch(input_path: str, state_path: str, completion_window: str = "24h") -> str:
+    """Write a Batch API input file from the requests, upload it and start the batch."""
+    batch_input = io.BytesIO()
+    count = 0
+    for request_id, request in read_requests(input_path):
+        if request.get("fridge_image"):
+            body = lib.build_recipe_from_fridge_request(request["fridge_image"], *_arguments(request))
+        else:
+            body = lib.build_recipe_request(*_arguments(request))
+        line = {"custom_id": request_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+        batch_input.write((json.dumps(line) + "\n").encode("utf-8"))
+        count += 1
+
+    batch_input.name = os.path.basename(input_path)
+    batch_input.seek(0)
+    uploaded = lib.get_client().files.create(file=batch_input, purpose="batch")
+    batch = lib.get_client().batches.create(
+        input_file_id=uploaded.id,
+        endpoint="/v1/chat/completions",
+        completion_window=completion_window,
+        metadata={"source": os.path.basename(input_path)},
+    )
+    with open(state_path, "w") as f:
+        json.dump({"batch_id": batch.id, "input_file_id": uploaded.id, "requests": count}, f)
+    print(f"Submitted batch {batch.id} with {count} requests", file=sys.stderr)
+    return batch.id
+
+
+def collect_batch(output_path: str, state_path: str) -> bool:
+    """Write the results of a finished batch as JSONL. Returns False if it is still running."""
+    with open(state_path) as f:
+        state = json.load(f)
+    batch = lib.get_client().batches.retrieve(state["batch_id"])
+    counts = batch.request_counts
+    print(
+        f"Batch {batch.id}: {batch.status} "
+        f"({counts.completed if counts else 0}/{counts.total if counts else state['requests']} completed)",
+        file=sys.stderr,
+    )
+    if batch.status not in ("completed", "failed", "expired", "cancelled"):
+        return False
+
+    done = completed_ids(output_path)
+    with open(output_path, "a") as out:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = lib.get_client().files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                request_id = result["custom_id"]
+                if request_id in done:
+                    continue
+                response = result.get("response") or {}
+                if response.get("status_code") == 200:
+                    message = response["body"]["choices"][0]["message"]["content"]
+                    recipe = json.loads(message) if message else None
+                    record = {"id": request_id, "status": "ok", "recipe": recipe.get("recipe", recipe)} if recipe else {
+                        "id": request_id, "status": "error", "error": "empty response"
+                    }
+                else:
+                    record = {"id": request_id, "status": "error", "error": json.dumps(result.get("error") or response.get("body"))}
+                out.write(json.dumps(record) + "\n")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate recipes in bulk from a JSONL file.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Generate with a bounded pool of concurrent workers")
+    run.add_argument("input")
+    run.add_argument("output")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--rpm", type=float, default=None, help="Maximum requests per minute across all workers")
+    run.add_argument("--max-retries", type=int, default=5)
+
+    submit = sub.add_parser("submit", help="Submit the requests to the provider's Batch API")
+    submit.add_argument("input")
+    submit.add_argument("--state", default="batch_state.json")
+
+    collect = sub.add_parser("collect", help="Write the results of a submitted batch once it finishes")
+    collect.add_argument("output")
+    collect.add_argument("--state", default="batch_state.json")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run_batch(args.input, args.output, args.concurrency, args.rpm, args.max_retries))
+    elif args.command == "submit":
+        submit_batch(args.input, args.state)
+    elif args.command == "collect":
+        if not collect_batch(args.output, args.state):
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
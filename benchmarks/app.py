@@ -0,0 +1,278 @@
+"""
+End-to-end load test for the FastAPI app against a mocked LLM backend.
+
+Every scenario is driven in-process through httpx's ASGI transport, so the
+numbers include routing, request parsing, the lib.py pipeline and SQLite,
+but not the network or the real OpenAI API. Results are written as JSON and
+can be compared against a previous run to spot regressions between commits.
+Admission control is opened up to --concurrency, so every request is served;
+latencies are of successful responses, with 429s counted on their own.
+
+Usage:
+    python -m benchmarks.app --sizes small,medium --concurrency 8 --requests 200
+    python -m benchmarks.app --compare benchmarks/results/<previous>.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fake_llm import FakeOpenAI
+from benchmarks.seed import SIZES, create_seeded_database
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+FRIDGE_IMAGE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads", "fridge.jpeg")
+
+SCENARIOS = [
+    "chat_text",
+    "chat_recipe",
+    "chat_fridge",
+    "feedback",
+    "conversations_list",
+    "conversations_create",
+    "conversation_messages",
+    "history",
+    "feedback_history",
+    "search",
+]
+
+FEEDBACK_RECIPE = {
+    "name": "Chickpea Curry",
+    "ingredients": ["chickpeas", "coconut milk", "curry paste", "rice"],
+    "steps": ["Simmer the chickpeas in the curry sauce for 15 minutes", "Serve over rice"],
+}
+
+
+def _load_app(concurrency: int):
+    """Import main with its database and uploads pointed at a scratch directory."""
+    scratch = tempfile.mkdtemp(prefix="chefing-bench-")
+    os.environ["CHEFING_DB_PATH"] = os.path.join(scratch, "boot.db")
+    os.environ["CHEFING_UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    # All requests come from one user: let admission control (admission.py) take every worker at once
+    for name in ("CHEFING_USER_CONCURRENCY", "CHEFING_USER_QUEUE"):
+        os.environ[name] = str(max(concurrency, int(os.environ.get(name, "0"))))
+    import lib
+    import main
+
+    # ASGITransport does not run lifespan hooks; the schema comes from create_seeded_database
+    os.makedirs(main.UPLOAD_DIR, exist_ok=True)
+    return lib, main, scratch
+
+
+def _request_for(scenario: str, rng: random.Random, conversation_ids: list[int], image_bytes: bytes):
+    conv_id = rng.choice(conversation_ids)
+    if scenario == "chat_text":
+        return "POST", "/api/chat", {"data": {"user_message": "I like spicy food", "conversation_id": str(conv_id)}}
+    if scenario == "chat_recipe":
+        return "POST", "/api/chat", {"data": {"user_message": "Make me a recipe for dinner", "conversation_id": str(conv_id)}}
+    if scenario == "chat_fridge":
+        return "POST", "/api/chat", {
+            "data": {"user_message": "What can I cook with this?", "conversation_id": str(conv_id)},
+            "files": {"fridge_image": ("fridge.jpeg", image_bytes, "image/jpeg")},
+        }
+    if scenario == "feedback":
+        return "POST", "/api/feedback", {
+            "json": {"made_status": "made", "rating": rng.randint(1, 10), "comments": "Tasty", "recipe": FEEDBACK_RECIPE}
+        }
+    if scenario == "conversations_list":
+        return "GET", "/api/conversations", {}
+    if scenario == "conversations_create":
+        return "POST", "/api/conversations", {}
+    if scenario == "conversation_messages":
+        return "GET", f"/api/conversations/{conv_id}/messages", {}
+    if scenario == "history":
+        return "GET", "/api/history", {}
+    if scenario == "feedback_history":
+        return "GET", "/api/feedback/history", {}
+    if scenario == "search":
+        return "GET", "/api/search", {"params": {"q": rng.choice(["curry", "salmon teriyaki", "too salty", "risot"])}}
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def _run_scenario(app, scenario: str, total: int, concurrency: int, conversation_ids: list[int], image_bytes: bytes, seed: int) -> dict:
+    import httpx
+
+    rng = random.Random(seed)
+    requests = [_request_for(scenario, rng, conversation_ids, image_bytes) for _ in range(total)]
+    latencies = []
+    errors = rejected = 0
+    cursor = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def worker():
+            nonlocal cursor, errors, rejected
+            while cursor < len(requests):
+                method, url, kwargs = requests[cursor]
+                cursor += 1
+                start = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                # Rejections and failures return early, so they are kept out of the latencies
+                if response.status_code == 429:
+                    rejected += 1
+                elif response.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ms = np.array(latencies) * 1000
+    stat = (lambda fn: round(float(fn(ms)), 3)) if len(ms) else (lambda fn: None)
+    return {
+        "requests": total,
+        "errors": errors,
+        "rejected": rejected,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": stat(np.mean),
+        "p50_ms": stat(lambda a: np.percentile(a, 50)),
+        "p95_ms": stat(lambda a: np.percentile(a, 95)),
+        "p99_ms": stat(lambda a: np.percentile(a, 99)),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    sizes: list[str],
+    scenarios: list[str],
+    concurrency: int,
+    total: int,
+    latency_ms: float,
+    embedding_latency_ms: float,
+    seed: int,
+    cassette_path: str | None = None,
+    replay_latency: float = 1.0,
+) -> dict:
+    lib, main, scratch = _load_app(concurrency)
+    if cassette_path:
+        import cassette
+
+        lib.set_client(cassette.ReplayClient(cassette_path, latency_scale=replay_latency))
+    else:
+        lib.set_client(FakeOpenAI(
+            latency_ms={"completion": latency_ms, "embedding": embedding_latency_ms}, seed=seed
+        ))
+    with open(FRIDGE_IMAGE, "rb") as f:
+        image_bytes = f.read()
+
+    results = {}
+    for size in sizes:
+        db_path = os.path.join(scratch, f"{size}.db")
+        info = create_seeded_database(db_path, size, seed)
+        main.DB_PATH = db_path
+        results[size] = {}
+        for scenario in scenarios:
+            stats = asyncio.run(
+                _run_scenario(main.app, scenario, total, concurrency, info["conversation_ids"], image_bytes, seed)
+            )
+            results[size][scenario] = stats
+            print(
+                f"{size:>7} {scenario:<22} {stats['throughput_rps']:>9} rps  "
+                f"p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms  "
+                f"p99 {stats['p99_ms']:>9} ms  errors {stats['errors']}  429s {stats['rejected']}"
+            )
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "config": {
+                "sizes": sizes,
+                "scenarios": scenarios,
+                "concurrency": concurrency,
+                "requests": total,
+                "latency_ms": latency_ms,
+                "embedding_latency_ms": embedding_latency_ms,
+                "seed": seed,
+                "cassette": cassette_path,
+                "replay_latency": replay_latency if cassette_path else None,
+            },
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict):
+    """Print per-endpoint p50/p95/throughput changes relative to a baseline run."""
+    print(f"\nComparison against {baseline['meta'].get('git_commit')} ({baseline['meta']['timestamp']})")
+    for size, scenarios in current["results"].items():
+        for scenario, stats in scenarios.items():
+            before = baseline["results"].get(size, {}).get(scenario)
+            if not before:
+                continue
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "throughput_rps"):
+                if before[key] and stats[key] is not None:
+                    change = (stats[key] - before[key]) / before[key] * 100
+                    deltas.append(f"{key} {change:+6.1f}%")
+            if stats.get("rejected") or before.get("rejected"):
+                deltas.append(f"429s {before.get('rejected', 0)} -> {stats['rejected']}")
+            print(f"{size:>7} {scenario:<22} " + "  ".join(deltas))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load-test the Chefing API against a mocked LLM.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated database sizes ({', '.join(SIZES)})")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated latency per completion call")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0, help="Simulated latency per embedding call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cassette", help="Replay LLM calls from this cassette (see cassette.py) instead of the mock")
+    parser.add_argument("--replay-latency", type=float, default=1.0, help="Scale applied to the cassette's recorded latencies")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        [s for s in args.sizes.split(",") if s],
+        [s for s in args.scenarios.split(",") if s],
+        args.concurrency,
+        args.requests,
+        args.latency_ms,
+        args.embedding_latency_ms,
+        args.seed,
+        args.cassette,
+        args.replay_latency,
+    )
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['meta']['git_commit'] or 'nogit'}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,120 @@
+"""
+Cold-storage archival on a large seeded database.
+
+Seeds a database (benchmarks.seed), keeps a share of its conversations
+recently updated and lets the rest go idle, then runs archive.archive_idle.
+Reports how long the job took, the compression ratio, the database file
+size before and after (once freed pages are returned and the WAL is
+checkpointed), the time of a full scan of the chat table, and the latency
+of /api/conversations/{id}/messages for hot vs. archived conversations.
+
+Usage:
+    python -m benchmarks.archive --size large --active-share 0.2
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+
+from benchmarks.seed import create_seeded_database
+
+
+def _file_mb(path: str) -> float:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return round(os.path.getsize(path) / 1e6, 1)
+
+
+def _scan_ms(path: str) -> float:
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    conn.execute("SELECT COUNT(*) FROM chat WHERE response LIKE '%salmon%'").fetchone()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return round(elapsed * 1000, 1)
+
+
+def _latency_ms(client, conversation_ids: list[int], requests: int, rng: random.Random) -> float:
+    timings = []
+    for _ in range(requests):
+        conversation_id = rng.choice(conversation_ids)
+        started = time.perf_counter()
+        client.get(f"/api/conversations/{conversation_id}/messages").raise_for_status()
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 2)
+
+
+def run(size: str, active_share: float, idle_days: float, requests: int, seed: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="chefing-archive-"), "archive.db")
+    os.environ["CHEFING_DB_PATH"] = path
+    import archive
+    import db_writer
+    import main
+
+    conversation_ids = create_seeded_database(path, size, seed)["conversation_ids"]
+    rng = random.Random(seed)
+    active = rng.sample(conversation_ids, int(len(conversation_ids) * active_share))
+    conn = sqlite3.connect(path)
+    conn.executemany("UPDATE conversations SET updated_at = CURRENT_TIMESTAMP WHERE id = ?", [(i,) for i in active])
+    conn.commit()
+    conn.close()
+    idle = sorted(set(conversation_ids) - set(active))
+
+    before = {"file_mb": _file_mb(path), "scan_ms": _scan_ms(path)}
+    started = time.perf_counter()
+    totals = archive.archive_idle(path, idle_days)
+    seconds = time.perf_counter() - started
+    db_writer.close_all()
+    after = {"file_mb": _file_mb(path), "scan_ms": _scan_ms(path)}
+
+    with TestClient(main.app) as client:
+        latency = {
+            "hot_ms": _latency_ms(client, active, requests, rng) if active else None,
+            "archived_ms": _latency_ms(client, idle, requests, rng) if idle else None,
+        }
+    return {
+        "conversations": len(conversation_ids),
+        "archived": totals,
+        "seconds": round(seconds, 2),
+        "compression_ratio": round(totals["raw_bytes"] / totals["stored_bytes"], 1) if totals["stored_bytes"] else None,
+        "codec": archive.compress(b"")[0],
+        "before": before,
+        "after": after,
+        "messages_p50": latency,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure archival of idle conversations.")
+    parser.add_argument("--size", default="large", help="benchmarks.seed preset")
+    parser.add_argument("--active-share", type=float, default=0.2, help="Share of conversations kept recently updated")
+    parser.add_argument("--idle-days", type=float, default=30)
+    parser.add_argument("--requests", type=int, default=200, help="Message-list requests per kind")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    r = run(args.size, args.active_share, args.idle_days, args.requests, args.seed)
+    archived = r["archived"]
+    print(
+        f"archived {archived['conversations']} of {r['conversations']} conversations ({archived['messages']} messages) "
+        f"in {r['seconds']} s, {r['compression_ratio']}x with {r['codec']}"
+    )
+    print(f"database file   {r['before']['file_mb']} MB -> {r['after']['file_mb']} MB")
+    print(f"chat table scan {r['before']['scan_ms']} ms -> {r['after']['scan_ms']} ms")
+    print(f"messages p50    hot {r['messages_p50']['hot_ms']} ms, archived {r['messages_p50']['archived_ms']} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": r}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,77 @@
+"""
+When a chat turn's first feedback reaches the client: POST /api/chat vs /ws/chat.
+
+Sends the same recipe and information messages both ways against the mocked
+LLM backend. POST /api/chat answers once, at the end. On /ws/chat the
+timeline shows when the stage events arrive, the first recipe token, and
+done. Runs in-process, so it doesn't count the connection setup the socket
+also saves.
+
+Usage:
+    python -m benchmarks.chat_socket --turns 20 --latency-ms 800
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+MESSAGES = ["Suggest a dinner recipe with chickpeas", "I have a small kitchen and like spicy food"]
+
+
+def _p50(samples: list[float]) -> float:
+    return round(float(np.percentile(samples, 50)) * 1000, 1) if samples else float("nan")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20, help="turns per message kind and transport")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="simulated completion latency")
+    parser.add_argument("--embedding-latency-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="chefing-ws-")
+    os.environ["CHEFING_DB_PATH"] = os.path.join(scratch, "chat.db")
+    os.environ["CHEFING_UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    from fastapi.testclient import TestClient
+
+    import lib
+    import main
+    from benchmarks.fake_llm import FakeOpenAI
+
+    lib.set_client(FakeOpenAI(latency_ms={"completion": args.latency_ms, "embedding": args.embedding_latency_ms}))
+
+    with TestClient(main.app) as client:
+        print(f"{'message':<46}{'transport':<11}{'first event':>13}{'intent':>9}{'first token':>13}{'done':>9}  (p50 ms)")
+        for text in MESSAGES:
+            http = []
+            for turn in range(args.turns):
+                started = time.perf_counter()
+                client.post("/api/chat", data={"user_message": f"{text} #{turn}"}).raise_for_status()
+                http.append(time.perf_counter() - started)
+            print(f"{text:<46}{'http':<11}{'':>13}{'':>9}{'':>13}{_p50(http):>9}")
+
+            timeline = {"first event": [], "intent": [], "first token": [], "done": []}
+            with client.websocket_connect("/ws/chat") as ws:
+                for turn in range(args.turns):
+                    seen = {}
+                    started = time.perf_counter()
+                    ws.send_json({"type": "message", "text": f"{text} #{turn}"})
+                    while True:
+                        event = ws.receive_json()
+                        elapsed = time.perf_counter() - started
+                        if event["event"] != "accepted":
+                            seen.setdefault("first event", elapsed)
+                        if event["event"] == "token":
+                            seen.setdefault("first token", elapsed)
+                        elif event["event"] in ("intent", "done"):
+                            seen[event["event"]] = elapsed
+                        if event["event"] in ("done", "error", "cancelled"):
+                            break
+                    for name, samples in timeline.items():
+                        if name in seen:
+                            samples.append(seen[name])
+            cells = [f"{_p50(timeline[name]):>{width}}" for name, width in (("first event", 13), ("intent", 9), ("first token", 13), ("done", 9))]
+            print(f"{'':<46}{'websocket':<11}{''.join(cells)}")
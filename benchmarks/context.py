@@ -0,0 +1,150 @@
+"""
+Profile context packing vs. the old fixed top-5 per category.
+
+Builds synthetic profiles of several sizes whose item embeddings have a
+planted similarity to the query: most items are unrelated, a few are
+relevant, and about one in ten is critical (an allergy or diet). Each
+profile goes through lib.select_profile_context, and the script reports the
+estimated tokens it packs, what top-5 per category plus every critical item
+would have packed, how many of the relevant items each keeps, and that
+every critical item survives.
+
+Usage:
+    python -m benchmarks.context --profiles 200
+"""
+
+import argparse
+import json
+import random
+import statistics
+
+import numpy as np
+
+import lib
+from benchmarks.fake_llm import EMBEDDING_DIM
+from embeddings import quantize
+
+ITEMS = {
+    "instructions": ["keep the steps short", "give metric measurements", "mention prep time up front", "suggest make-ahead options", "explain techniques for a beginner"],
+    "preferences": ["likes spicy food", "prefers quick meals under 30 minutes", "loves Mediterranean flavors", "enjoys one-pot dinners", "not a fan of mushrooms", "likes crunchy textures"],
+    "restrictions": ["no pork", "low sodium", "avoids deep frying"],
+    "situation": ["small kitchen with two burners", "cooks for a family of four", "has a slow cooker", "busy on weeknights", "lives alone"],
+}
+CRITICAL = ["peanut allergy", "vegetarian", "gluten-free diet", "lactose intolerant", "allergic to shellfish"]
+# Planted similarity of relevant and unrelated items to the query
+RELEVANT = (0.35, 0.6)
+UNRELATED = (0.0, 0.18)
+
+
+class _PlantedStore:
+    """Embedding store holding precomputed vectors, standing in for EmbeddingStore."""
+
+    def __init__(self, vectors: dict[str, np.ndarray]):
+        self.blobs = {text: quantize(vector) for text, vector in vectors.items()}
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, bytes]:
+        return {text: self.blobs[text] for text in texts if text in self.blobs}
+
+    def put_many(self, model: str, items: dict) -> dict[str, bytes]:
+        raise AssertionError("every item is precomputed")
+
+
+def _profile(rng: random.Random, np_rng, size: int, relevant_share: float):
+    query = np_rng.standard_normal(EMBEDDING_DIM)
+    query /= np.linalg.norm(query)
+    profile = {category: [] for category in ITEMS}
+    vectors, relevant, critical = {}, set(), set()
+    for n in range(size):
+        if rng.random() < 0.1:
+            category, item = "restrictions", f"{rng.choice(CRITICAL)} ({n})"
+            critical.add(item)
+        else:
+            category = rng.choice(list(ITEMS))
+            item = f"{rng.choice(ITEMS[category])} ({n})"
+        is_relevant = rng.random() < relevant_share
+        similarity = rng.uniform(*(RELEVANT if is_relevant else UNRELATED))
+        noise = np_rng.standard_normal(EMBEDDING_DIM)
+        noise -= noise.dot(query) * query
+        noise /= np.linalg.norm(noise)
+        vectors[item] = similarity * query + np.sqrt(1 - similarity**2) * noise
+        if is_relevant:
+            relevant.add(item)
+        profile[category].append(item)
+    return query, profile, vectors, relevant, critical
+
+
+def run(profiles: int, sizes: list[int], relevant_share: float, budget: int, min_similarity: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    results = {}
+    for size in sizes:
+        packed, baseline, recall, baseline_recall, critical_kept = [], [], [], [], []
+        for _ in range(profiles):
+            query, profile, vectors, relevant, critical = _profile(rng, np_rng, size, relevant_share)
+            context = lib.select_profile_context(
+                "what should I cook tonight?",
+                profile["instructions"],
+                profile["preferences"],
+                profile["restrictions"],
+                profile["situation"],
+                budget_tokens=budget,
+                min_similarity=min_similarity,
+                embedding_store=_PlantedStore(vectors),
+                query_embedding=query,
+                critical=critical,
+            )
+            chosen = {item for category in lib.PROFILE_CONTEXT_CATEGORIES for item in context[category]}
+            old = lib.update_profile_with_similarity(
+                "what should I cook tonight?",
+                profile["instructions"],
+                profile["preferences"],
+                profile["restrictions"],
+                profile["situation"],
+                embedding_store=_PlantedStore(vectors),
+                query_embedding=query,
+                critical=critical,
+            )
+            old_chosen = {item for items in old.values() for item in items}
+            packed.append(context["tokens"]["packed"])
+            baseline.append(context["tokens"]["baseline"])
+            if relevant:
+                recall.append(len(chosen & relevant) / len(relevant))
+                baseline_recall.append(len(old_chosen & relevant) / len(relevant))
+            critical_kept.append(critical <= chosen)
+        results[size] = {
+            "packed_tokens": round(statistics.mean(packed), 1),
+            "baseline_tokens": round(statistics.mean(baseline), 1),
+            "saved_pct": round(100 * (1 - sum(packed) / max(1, sum(baseline))), 1),
+            "relevant_recall": round(statistics.mean(recall), 3) if recall else None,
+            "baseline_relevant_recall": round(statistics.mean(baseline_recall), 3) if baseline_recall else None,
+            "critical_kept": all(critical_kept),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate token-budgeted profile context packing.")
+    parser.add_argument("--profiles", type=int, default=200, help="Profiles per size")
+    parser.add_argument("--sizes", default="8,20,50,100", help="Comma-separated profile item counts")
+    parser.add_argument("--relevant-share", type=float, default=0.15)
+    parser.add_argument("--budget", type=int, default=200)
+    parser.add_argument("--min-similarity", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(args.profiles, sizes, args.relevant_share, args.budget, args.min_similarity, args.seed)
+    print(f"{'items':>6}{'packed':>9}{'top-5':>9}{'saved':>8}{'recall':>9}{'top-5 rec':>11}{'critical':>10}")
+    for size, r in results.items():
+        print(
+            f"{size:>6}{r['packed_tokens']:>9}{r['baseline_tokens']:>9}{r['saved_pct']:>7}%"
+            f"{r['relevant_recall']:>9}{r['baseline_relevant_recall']:>11}{'all' if r['critical_kept'] else 'LOST':>10}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
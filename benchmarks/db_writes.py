@@ -0,0 +1,170 @@
+"""
+Multi-process write stress test.
+
+Starts several processes, standing in for uvicorn workers, each with several
+threads standing in for concurrent requests, all writing to one SQLite file.
+Every thread stores chat turns (a conversation row and a chat row) and
+every few turns merges a new item into the shared user profile. The script
+reports throughput, failed writes, chat rows missing from the database, and
+profile items lost to concurrent merges.
+
+Two modes are compared:
+- queue: main.py's write path. Writes go through each process's single
+  writer (db_writer.py) in WAL mode, and profile merges re-read the
+  profile and compare its version inside the write transaction.
+- direct: the previous write path. Each write opens its own connection
+  and commits, with SQLite's default 5 s lock timeout and rollback journal.
+  The profile is read, modified and written back with INSERT OR REPLACE.
+
+Usage:
+    python -m benchmarks.db_writes --processes 4 --threads 8 --turns 100
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+USER_ID = "demo-user"
+CATEGORY = "long_term_preferences"
+
+
+def _store_turn(conn, worker: str, n: int):
+    c = conn.cursor()
+    c.execute("INSERT INTO conversations (user_id, title, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)", (USER_ID, worker))
+    c.execute(
+        "INSERT INTO chat (conversation_id, user_id, message, response) VALUES (?, ?, ?, ?)",
+        (c.lastrowid, USER_ID, f"{worker} message {n}", json.dumps({"parsed_info": {}})),
+    )
+
+
+def _direct_merge(path: str, item: str):
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute(f"SELECT {CATEGORY} FROM user_profile WHERE user_id = ?", (USER_ID,)).fetchone()
+        items = json.loads(row[0]) if row else []
+        conn.execute(
+            f"INSERT OR REPLACE INTO user_profile (user_id, {CATEGORY}, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (USER_ID, json.dumps(items + [item])),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _direct_turn(path: str, worker: str, n: int):
+    conn = sqlite3.connect(path)
+    try:
+        _store_turn(conn, worker, n)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _worker(path: str, mode: str, process: int, threads: int, turns: int, merge_every: int, results):
+    os.environ["CHEFING_DB_PATH"] = path
+    import main
+
+    stored = {"turns": 0, "merges": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def run(thread: int):
+        worker = f"p{process}t{thread}"
+        for n in range(turns):
+            try:
+                if mode == "queue":
+                    main.write(lambda conn: _store_turn(conn, worker, n))
+                else:
+                    _direct_turn(path, worker, n)
+                with lock:
+                    stored["turns"] += 1
+                if n % merge_every == 0:
+                    item = f"{worker} item {n}"
+                    if mode == "queue":
+                        _, version = main.load_user_profile(USER_ID)
+                        main.merge_user_profile(USER_ID, {CATEGORY: [item]}, version)
+                    else:
+                        _direct_merge(path, item)
+                    with lock:
+                        stored["merges"] += 1
+            except Exception:
+                with lock:
+                    stored["errors"] += 1
+
+    pool = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    import db_writer
+    db_writer.close_all()
+    results.put(stored)
+
+
+def run(mode: str, processes: int, threads: int, turns: int, merge_every: int) -> dict:
+    from migrations import migrate
+
+    path = os.path.join(tempfile.mkdtemp(prefix="chefing-writes-"), "writes.db")
+    migrate(path)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_worker, args=(path, mode, process, threads, turns, merge_every, results))
+        for process in range(processes)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    stored = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(path)
+    chat_rows = conn.execute("SELECT COUNT(*) FROM chat").fetchone()[0]
+    row = conn.execute(f"SELECT {CATEGORY} FROM user_profile WHERE user_id = ?", (USER_ID,)).fetchone()
+    conn.close()
+    profile_items = len(json.loads(row[0])) if row else 0
+
+    turns_stored = sum(s["turns"] for s in stored)
+    merges = sum(s["merges"] for s in stored)
+    return {
+        "seconds": round(elapsed, 2),
+        "turns_per_second": round(turns_stored / elapsed, 1),
+        "attempted_turns": processes * threads * turns,
+        "errors": sum(s["errors"] for s in stored),
+        "missing_chat_rows": turns_stored - chat_rows,
+        "merges": merges,
+        "lost_profile_updates": merges - profile_items,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent writes from several processes.")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="Writing threads per process")
+    parser.add_argument("--turns", type=int, default=100, help="Chat turns stored per thread")
+    parser.add_argument("--merge-every", type=int, default=5, help="Merge a profile item every N turns")
+    parser.add_argument("--modes", default="direct,queue")
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'mode':>8}{'seconds':>9}{'turns/s':>9}{'errors':>8}{'missing':>9}{'merges':>8}{'lost':>6}")
+    for mode in args.modes.split(","):
+        r = results[mode] = run(mode, args.processes, args.threads, args.turns, args.merge_every)
+        print(
+            f"{mode:>8}{r['seconds']:>9}{r['turns_per_second']:>9}{r['errors']:>8}"
+            f"{r['missing_chat_rows']:>9}{r['merges']:>8}{r['lost_profile_updates']:>6}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Recall, memory and speed of quantized embeddings versus full precision.
+
+Builds a clustered synthetic corpus of 1536-dim embeddings (so nearest
+neighbours are meaningful, as with real text embeddings), takes exact top-k
+neighbours under float64 cosine similarity as ground truth, and measures for
+each storage format:
+
+- bytes per stored vector
+- recall@k of the top-k under the quantized scores
+- time to score one query against the whole corpus
+
+The baseline is the current path: a Python loop calling lib.cosine_similarity
+on float64 arrays.
+
+Usage:
+    python -m benchmarks.embeddings --corpus 20000 --queries 100 --k 10
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embeddings import EmbeddingMatrix, quantize
+
+DIM = 1536
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    # Same as lib.cosine_similarity; duplicated so the benchmark does not need an API client
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def make_corpus(n: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((clusters, DIM))
+    assignments = rng.integers(0, clusters, n)
+    return centers[assignments] + 0.6 * rng.standard_normal((n, DIM))
+
+
+def _time_per_query(fn, queries: np.ndarray) -> float:
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def run(corpus_size: int, n_queries: int, k: int, seed: int, loop_size: int) -> dict:
+    rng = np.random.default_rng(seed)
+    corpus = make_corpus(corpus_size, max(1, corpus_size // 50), rng)
+    queries = corpus[rng.integers(0, corpus_size, n_queries)] + 0.3 * rng.standard_normal((n_queries, DIM))
+
+    unit = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    truth = [set(np.argsort(unit @ (q / np.linalg.norm(q)))[-k:]) for q in queries]
+
+    results = {}
+
+    # Current path: per-item cosine_similarity over float64 arrays (timed on a profile-sized slice)
+    loop_items = [np.array(v) for v in corpus[:loop_size]]
+    loop_ms = _time_per_query(lambda q: [cosine_similarity(q, v) for v in loop_items], queries[:20])
+    results["float64_loop"] = {
+        "bytes_per_vector": corpus.itemsize * DIM,
+        "recall_at_k": 1.0,
+        "ms_per_query": round(loop_ms * corpus_size / loop_size, 3),
+        "note": f"extrapolated from {loop_size} items",
+    }
+
+    # Full precision, vectorized
+    full_ms = _time_per_query(lambda q: unit @ (q / np.linalg.norm(q)), queries)
+    results["float64_matrix"] = {
+        "bytes_per_vector": corpus.itemsize * DIM,
+        "recall_at_k": 1.0,
+        "ms_per_query": round(full_ms, 3),
+    }
+
+    for fmt in ("float16", "int8"):
+        blobs = [quantize(v, fmt) for v in corpus]
+        matrix = EmbeddingMatrix.from_blobs(blobs)
+        hits = 0
+        for q, expected in zip(queries, truth):
+            hits += len(set(matrix.top_k(q, k)) & expected)
+        ms = _time_per_query(matrix.scores, queries)
+        results[fmt] = {
+            "bytes_per_vector": len(blobs[0]),
+            "recall_at_k": round(hits / (k * n_queries), 4),
+            "ms_per_query": round(ms, 3),
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized embedding storage.")
+    parser.add_argument("--corpus", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--loop-size", type=int, default=1000, help="Items scored by the per-item loop baseline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.corpus, args.queries, args.k, args.seed, args.loop_size)
+    print(f"{'format':<16}{'bytes/vec':>10}{f'recall@{args.k}':>12}{'ms/query':>12}")
+    for fmt, stats in results.items():
+        print(f"{fmt:<16}{stats['bytes_per_vector']:>10}{stats['recall_at_k']:>12}{stats['ms_per_query']:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+A deterministic stand-in for the OpenAI client used by lib.py.
+
+It answers every prompt shape the backend sends (recipes, parsed info,
+profile deltas, titles, conversation summaries, yes/no intent checks and
+embeddings) with canned but well-formed payloads, streamed in small chunks
+when asked to, and sleeps for a configurable amount of time so the
+benchmarks exercise realistic upstream latency without touching the network.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+# Default simulated upstream latency in milliseconds, per call kind
+DEFAULT_LATENCY_MS = {
+    "completion": 0.0,
+    "embedding": 0.0,
+}
+
+RECIPE_WORDS = ("recipe", "make", "cook", "hungry", "dinner", "lunch", "breakfast", "suggest")
+
+
+def _usage(prompt_text: str, completion_text: str = "") -> SimpleNamespace:
+    prompt_tokens = max(1, len(prompt_text) // 4)
+    completion_tokens = len(completion_text) // 4
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _message_text(messages: list[dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(c["text"] for c in content if c.get("type") == "text")
+    return "\n".join(parts)
+
+
+def _fake_payload(schema_name: str, rng: random.Random) -> dict:
+    if schema_name == "recipe_response":
+        dish = rng.choice(["Chickpea Curry", "Lemon Pasta", "Veggie Stir Fry", "Tomato Soup"])
+        return {
+            "recipe": {
+                "name": dish,
+                "ingredients": [f"ingredient {i}" for i in range(rng.randint(5, 12))],
+                "steps": [f"Do step {i} carefully for a few minutes" for i in range(rng.randint(4, 10))],
+            }
+        }
+    if schema_name == "parsed_user_info":
+        return {
+            "new_instructions": [],
+            "new_preferences": [rng.choice(["likes spicy food", "prefers quick meals"])],
+            "new_restrictions": [],
+            "new_situation": [],
+        }
+    if schema_name == "long_term_delta":
+        return {
+            "new_long_term_instructions": [],
+            "new_long_term_preferences": [],
+            "new_long_term_restrictions": [],
+            "new_long_term_situation": [],
+        }
+    if schema_name in ("long_term_profile", "long_term_update"):
+        return {
+            "long_term_instructions": ["keep instructions short"],
+            "long_term_preferences": ["likes spicy food"],
+            "long_term_restrictions": ["peanut allergy"],
+            "long_term_situation": ["small kitchen"],
+        }
+    return {}
+
+
+class _Completions:
+    def __init__(self, owner: "FakeOpenAI"):
+        self._owner = owner
+
+    def create(self, *, model: str, messages: list[dict], response_format: dict | None = None, stream: bool = False, **kwargs):
+        owner = self._owner
+        # A streamed answer starts after a third of the latency and spends the rest arriving
+        delay_ms = owner._delay_ms("completion")
+        time.sleep((delay_ms / 3 if stream else delay_ms) / 1000)
+        rng = owner._rng()
+        prompt_text = _message_text(messages)
+
+        if response_format is not None:
+            schema_name = response_format["json_schema"]["name"]
+            content = json.dumps(_fake_payload(schema_name, rng))
+        elif "'yes' or 'no'" in prompt_text:
+            user_text = _message_text(messages[1:]).rsplit("User message:", 1)[-1].split("\n", 1)[0].lower()
+            content = "yes" if any(word in user_text for word in RECIPE_WORDS) else "no"
+        elif "running summary" in prompt_text:
+            dishes = ", ".join(rng.sample(["chickpea curry", "lemon pasta", "veggie stir fry", "tomato soup", "shakshuka"], 3))
+            content = (
+                f"The user is planning weeknight dinners and has been offered {dishes}. "
+                "They prefer quick meals under 30 minutes, have a small kitchen, and liked the spicier options. "
+            ) * 3
+        else:
+            content = "Quick Weeknight Dinner"
+
+        with owner._lock:
+            owner.calls["completion"] += 1
+        if stream:
+            return _stream(model, content, _usage(prompt_text, content), delay_ms * 2 / 3)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+            usage=_usage(prompt_text, content),
+        )
+
+
+def _stream(model: str, content: str, usage, duration_ms: float, piece: int = 12):
+    pieces = [content[i:i + piece] for i in range(0, len(content), piece)] or [""]
+    for text in pieces:
+        time.sleep(duration_ms / len(pieces) / 1000)
+        yield SimpleNamespace(model=model, choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=None)], usage=None)
+    yield SimpleNamespace(model=model, choices=[], usage=usage)
+
+
+class _Embeddings:
+    def __init__(self, owner: "FakeOpenAI"):
+        self._owner = owner
+
+    def create(self, *, model: str, input, **kwargs):
+        owner = self._owner
+        owner._sleep("embedding")
+        texts = [input] if isinstance(input, str) else list(input)
+        data = [
+            SimpleNamespace(index=i, embedding=fake_embedding(text).tolist())
+            for i, text in enumerate(texts)
+        ]
+        with owner._lock:
+            owner.calls["embedding"] += 1
+        return SimpleNamespace(model=model, data=data, usage=_usage(" ".join(texts)))
+
+
+class FakeOpenAI:
+    """
+    Drop-in replacement for the subset of `openai.OpenAI` that lib.py uses.
+    Latencies are in milliseconds; jitter is a fraction of the base latency.
+    """
+
+    def __init__(self, latency_ms: dict | None = None, jitter: float = 0.1, seed: int = 0):
+        self.latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.jitter = jitter
+        self.seed = seed
+        self.calls = {"completion": 0, "embedding": 0}
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.embeddings = _Embeddings(self)
+
+    def _rng(self) -> random.Random:
+        with self._lock:
+            self._counter += 1
+            return random.Random(self.seed * 1_000_003 + self._counter)
+
+    def _delay_ms(self, kind: str) -> float:
+        base = self.latency_ms.get(kind, 0.0)
+        if base <= 0:
+            return 0.0
+        spread = base * self.jitter
+        return max(0.0, base + self._rng().uniform(-spread, spread))
+
+    def _sleep(self, kind: str):
+        delay = self._delay_ms(kind)
+        if delay:
+            time.sleep(delay / 1000)
+
+
+def fake_embedding(text: str) -> np.ndarray:
+    """Unit-norm pseudo-random embedding that is stable for a given text."""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+    vec = rng.standard_normal(EMBEDDING_DIM)
+    return vec / np.linalg.norm(vec)
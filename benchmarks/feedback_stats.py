@@ -0,0 +1,103 @@
+"""
+/api/feedback/stats latency as feedback history grows, vs. aggregating recipe_feedback.
+
+For each size, fills a fresh database with that many feedback rows spread
+over a year and a few hundred recipe names, then times the stats endpoint
+next to the GROUP BY scans over recipe_feedback it replaces (totals, top
+recipes, 30-day trend). Also reports the cost of the triggers that keep the
+aggregates up to date: feedback inserts per second with and without them.
+
+Usage:
+    python -m benchmarks.feedback_stats --sizes 10000,100000,1000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+USER_ID = "demo-user"
+RECIPES = 300
+STATUSES = ("made", "not made", "plan to make")
+
+SCAN_QUERIES = (
+    """
+    SELECT COUNT(*), SUM(lower(trim(made_status)) = 'made'), AVG(rating), MIN(created_at), MAX(created_at)
+    FROM recipe_feedback WHERE user_id = ?
+    """,
+    """
+    SELECT recipe_name, COUNT(*) AS n, SUM(lower(trim(made_status)) = 'made'), AVG(rating) AS average
+    FROM recipe_feedback WHERE user_id = ?
+    GROUP BY recipe_name ORDER BY average DESC, n DESC LIMIT 5
+    """,
+    """
+    SELECT date(created_at) AS day, COUNT(*), SUM(lower(trim(made_status)) = 'made'), AVG(rating)
+    FROM recipe_feedback WHERE user_id = ? AND created_at >= datetime('now', '-29 days')
+    GROUP BY day ORDER BY day
+    """,
+)
+
+
+def _rows(count: int, rng: random.Random):
+    now = time.time()
+    for _ in range(count):
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - rng.uniform(0, 365 * 86400)))
+        yield (USER_ID, f"Recipe {rng.randrange(RECIPES)}", "{}", rng.choice(STATUSES), rng.randint(1, 10), "", created)
+
+
+def _insert(conn, count: int, seed: int) -> float:
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO recipe_feedback (user_id, recipe_name, recipe_data, made_status, rating, comments, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        _rows(count, random.Random(seed)),
+    )
+    conn.execute("COMMIT")
+    return count / (time.perf_counter() - started)
+
+
+def _p50_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(float(np.percentile(samples, 50)) * 1000, 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="chefing-feedback-stats-")
+    os.environ["CHEFING_DB_PATH"] = os.path.join(scratch, "stats.db")
+    os.environ["CHEFING_UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    from fastapi.testclient import TestClient
+
+    import main
+    from migrations import migrate
+
+    print(f"{'feedback rows':>14}{'inserts/s':>12}{'no triggers':>13}{'stats ms':>10}{'scan ms':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        rates = {}
+        for triggers in (True, False):
+            path = os.path.join(scratch, f"stats-{size}-{triggers}.db")
+            migrate(path)
+            conn = sqlite3.connect(path, isolation_level=None)
+            if not triggers:
+                for name in ("feedback_stats_insert", "feedback_stats_delete", "feedback_stats_update"):
+                    conn.execute(f"DROP TRIGGER {name}")
+            rates[triggers] = _insert(conn, size, seed=size)
+            if triggers:
+                main.DB_PATH = path
+                with TestClient(main.app) as client:
+                    stats_ms = _p50_ms(lambda: client.get("/api/feedback/stats").raise_for_status(), args.repeat)
+                scan_ms = _p50_ms(lambda: [conn.execute(query, (USER_ID,)).fetchall() for query in SCAN_QUERIES], args.repeat)
+            conn.close()
+        print(f"{size:>14}{rates[True]:>12.0f}{rates[False]:>13.0f}{stats_ms:>10}{scan_ms:>10}")
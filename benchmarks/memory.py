@@ -0,0 +1,99 @@
+"""
+Prompt size per turn as a conversation grows.
+
+Drives one long conversation through /api/chat against the fake LLM,
+alternating recipe requests with messages that only share information, and
+records the estimated prompt tokens of each turn's main generation call
+(generate_recipe or parse_new_user_information). For comparison it also
+reports what the same call would cost with the full history pasted in,
+and how many summary calls were made.
+
+Usage:
+    python -m benchmarks.memory --turns 60
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from fastapi.testclient import TestClient
+
+import lib
+from benchmarks.fake_llm import FakeOpenAI, _message_text
+
+MESSAGES = (
+    "Can you suggest a quick dinner with the chickpeas and spinach I have?",
+    "I have a small kitchen with only two burners, and I'm cooking for two.",
+    "What should I make for lunch tomorrow? Something I can pack.",
+    "That was great, but I'd like it a bit spicier next time.",
+)
+MAIN_SCHEMAS = ("recipe_response", "parsed_user_info")
+
+
+def run(turns: int, report_every: int) -> dict:
+    scratch = tempfile.mkdtemp(prefix="chefing-memory-")
+    os.environ["CHEFING_DB_PATH"] = os.path.join(scratch, "memory.db")
+    os.environ["CHEFING_UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    import main
+    import memory
+
+    fake = FakeOpenAI()
+    create = fake.chat.completions.create
+    prompts = {"main": [], "summaries": 0}
+
+    def recording_create(**kwargs):
+        response_format = kwargs.get("response_format")
+        if response_format and response_format["json_schema"]["name"] in MAIN_SCHEMAS:
+            prompts["main"].append(lib.estimate_tokens(_message_text(kwargs["messages"])))
+        elif "running summary" in _message_text(kwargs["messages"]):
+            prompts["summaries"] += 1
+        return create(**kwargs)
+
+    fake.chat.completions.create = recording_create
+    lib.set_client(fake)
+
+    rows = []
+    history_tokens = 0
+    with TestClient(main.app) as client:
+        conversation_id = None
+        for turn in range(1, turns + 1):
+            message = MESSAGES[(turn - 1) % len(MESSAGES)]
+            data = {"user_message": message}
+            if conversation_id:
+                data["conversation_id"] = str(conversation_id)
+            response = client.post("/api/chat", data=data)
+            response.raise_for_status()
+            if conversation_id is None:
+                conversation_id = client.get("/api/conversations").json()[0]["id"]
+            prompt = prompts["main"][-1]
+            if turn == 1 or turn % report_every == 0:
+                rows.append({
+                    "turn": turn,
+                    "prompt_tokens": prompt,
+                    "full_history_tokens": prompt + history_tokens,
+                    "summary_calls": prompts["summaries"],
+                })
+            history_tokens += lib.estimate_tokens(memory.format_turn(message, json.dumps(response.json())))
+    return {"memory_tokens": memory.MEMORY_TOKENS, "memory_turns": memory.MEMORY_TURNS, "turns": rows}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure prompt size per turn with conversation memory.")
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--report-every", type=int, default=10)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.turns, args.report_every)
+    print(f"memory budget {results['memory_tokens']} tokens, {results['memory_turns']} verbatim turns")
+    print(f"{'turn':>6}{'prompt':>10}{'full hist':>12}{'summaries':>11}  (estimated tokens)")
+    for row in results["turns"]:
+        print(f"{row['turn']:>6}{row['prompt_tokens']:>10}{row['full_history_tokens']:>12}{row['summary_calls']:>11}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
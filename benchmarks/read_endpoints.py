@@ -0,0 +1,114 @@
+"""
+CPU cost of the read endpoints that return stored JSON.
+
+Seeds conversations of 1,000 messages each (60% of them carrying a recipe
+response) and 1,000 feedback rows, then requests full pages from
+/api/conversations/{id}/messages, /api/history and /api/feedback/history
+one at a time through the ASGI app. Reports process CPU time and wall time
+per request, plus the response size.
+
+Usage:
+    python -m benchmarks.read_endpoints --messages 1000 --requests 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from benchmarks.seed import USER_ID, _recipe, _response
+
+
+def _seed(path: str, conversations: int, messages: int, feedback: int, seed: int) -> list[int]:
+    import main
+
+    main.DB_PATH = path
+    main.init_db()
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    ids = []
+    for n in range(conversations):
+        c.execute("INSERT INTO conversations (user_id, title) VALUES (?, ?)", (USER_ID, f"Conversation {n}"))
+        conv_id = c.lastrowid
+        ids.append(conv_id)
+        c.executemany(
+            "INSERT INTO chat (conversation_id, user_id, message, response, has_image, image_path, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (conv_id, USER_ID, f"Message {i}: what should I cook tonight?", json.dumps(_response(rng)), 0, None,
+                 f"2025-11-{1 + i // 100:02d} 12:{(i // 60) % 60:02d}:{i % 60:02d}")
+                for i in range(messages)
+            ],
+        )
+    c.executemany(
+        "INSERT INTO recipe_feedback (user_id, recipe_name, recipe_data, made_status, rating, comments) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (USER_ID, recipe["name"], json.dumps(recipe), "made", rng.randint(1, 10), "Loved it")
+            for recipe in (_recipe(rng) for _ in range(feedback))
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return ids
+
+
+async def _measure(app, url: str, requests: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    cpu, wall, size = [], [], 0
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get(url)  # warm up
+        for _ in range(requests):
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            response = await client.get(url)
+            cpu.append(time.process_time() - cpu_start)
+            wall.append(time.perf_counter() - wall_start)
+            response.raise_for_status()
+            size = len(response.content)
+    return {
+        "cpu_ms": round(statistics.median(cpu) * 1000, 2),
+        "wall_p50_ms": round(statistics.median(wall) * 1000, 2),
+        "bytes": size,
+    }
+
+
+def run(conversations: int, messages: int, requests: int, seed: int) -> dict:
+    scratch = tempfile.mkdtemp(prefix="chefing-read-")
+    ids = _seed(os.path.join(scratch, "read.db"), conversations, messages, messages, seed)
+
+    import main
+
+    urls = {
+        "conversation_messages": f"/api/conversations/{ids[0]}/messages?limit={messages}",
+        "history": f"/api/history?limit={messages}",
+        "feedback_history": f"/api/feedback/history?limit={messages}",
+    }
+    return {name: asyncio.run(_measure(main.app, url, requests)) for name, url in urls.items()}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark CPU per request of the stored-JSON read endpoints.")
+    parser.add_argument("--conversations", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=1000, help="Messages per conversation (and page size)")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.conversations, args.messages, args.requests, args.seed)
+    print(f"{'endpoint':<24}{'cpu ms':>10}{'wall p50':>10}{'bytes':>10}")
+    for name, stats in results.items():
+        print(f"{name:<24}{stats['cpu_ms']:>10}{stats['wall_p50_ms']:>10}{stats['bytes']:>10}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,118 @@
+"""
+Query latency and recall of the recipe ANN index.
+
+Fills an IVFIndex with a clustered synthetic corpus, trains it, and compares
+its top-k against exact search over the same quantized vectors. The same is
+done for filtered search, where only a random --allowed-share of the corpus
+may be returned (as when one user's well-rated recipes are looked up). Also
+reports the latency of an exact flat scan and of a save/load round trip.
+
+Usage:
+    python -m benchmarks.recipe_index --corpus 100000 --queries 200 --nprobe 4 --allowed-share 0.01
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.embeddings import make_corpus
+from embeddings import EmbeddingMatrix
+from recipe_index import IVFIndex
+
+
+def _percentiles(samples: list[float]) -> dict:
+    ms = np.array(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+    }
+
+
+def run(corpus_size: int, n_queries: int, k: int, nprobe: int, seed: int, allowed_share: float) -> dict:
+    rng = np.random.default_rng(seed)
+    corpus = make_corpus(corpus_size, max(1, corpus_size // 50), rng)
+    queries = corpus[rng.integers(0, corpus_size, n_queries)] + 0.3 * rng.standard_normal(corpus.shape[1] * n_queries).reshape(n_queries, -1)
+
+    matrix = EmbeddingMatrix.from_vectors(corpus)
+    del corpus
+    ids = np.arange(1, corpus_size + 1)
+
+    index = IVFIndex(nprobe=nprobe)
+    start = time.perf_counter()
+    index.add(ids, matrix)
+    index.train()
+    build_s = time.perf_counter() - start
+
+    # Timed in separate passes so the flat scans don't evict the index from cache
+    ann_times, flat_times, found = [], [], []
+    for q in queries:
+        start = time.perf_counter()
+        found.append(index.search(q, k)[0])
+        ann_times.append(time.perf_counter() - start)
+
+    hits = 0
+    for q, approximate in zip(queries, found):
+        start = time.perf_counter()
+        exact = ids[matrix.top_k(q, k)]
+        flat_times.append(time.perf_counter() - start)
+        hits += len(set(approximate.tolist()) & set(exact.tolist()))
+
+    allowed_rows = np.sort(rng.choice(corpus_size, max(k, int(corpus_size * allowed_share)), replace=False))
+    allowed, allowed_matrix = ids[allowed_rows], EmbeddingMatrix(matrix.codes[allowed_rows], matrix.scales[allowed_rows])
+    filtered_times, filtered_hits = [], 0
+    for q in queries:
+        start = time.perf_counter()
+        approximate = index.search(q, k, allowed=allowed)[0]
+        filtered_times.append(time.perf_counter() - start)
+        exact = allowed[allowed_matrix.top_k(q, k)]
+        filtered_hits += len(set(approximate.tolist()) & set(exact.tolist()))
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "index.npz")
+        start = time.perf_counter()
+        index.save(path)
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        IVFIndex.load(path)
+        load_s = time.perf_counter() - start
+
+    return {
+        "corpus": corpus_size,
+        "lists": len(index.centroids),
+        "nprobe": nprobe,
+        "build_s": round(build_s, 2),
+        "save_s": round(save_s, 3),
+        "load_s": round(load_s, 3),
+        f"recall_at_{k}": round(hits / (k * n_queries), 4),
+        "ann": _percentiles(ann_times),
+        "allowed": len(allowed),
+        f"filtered_recall_at_{k}": round(filtered_hits / (k * n_queries), 4),
+        "filtered_ann": _percentiles(filtered_times),
+        "flat": _percentiles(flat_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recipe ANN index.")
+    parser.add_argument("--corpus", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allowed-share", type=float, default=0.01, help="share of the corpus a filtered search may return")
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.corpus, args.queries, args.k, args.nprobe, args.seed, args.allowed_share)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Retrieval quality of embedding, hybrid and lexical (BM25) ranking.
+
+A hand-labelled set: one profile of 31 items and 24 stored recipes, plus
+chat messages each labelled with the profile items or recipes relevant to
+it. Messages are tagged "lexical" when they share words with what they
+should find ("dinner for two" -> "cooks dinner for two") and "semantic"
+when they don't ("steak dinner" -> "vegetarian"). For each mode the script
+ranks profile items with lib.item_relevance and recipes with
+RecipeLibrary.similar, and reports recall@k, mean reciprocal rank of the
+first relevant result, and ranking time per message (including embedding
+the message, for the modes that do).
+
+Embeddings come from lib's client: the real API (OPENAI_API_KEY), or a
+cassette recorded from it (CHEFING_CASSETTE_REPLAY, see cassette.py). With
+--embedder local, a hashed character-trigram embedding stands in instead
+so the script runs offline; it only captures spelling overlap, not
+meaning, so the embedding and hybrid rows are then no guide to the real
+model's semantic recall.
+
+Usage:
+    python -m benchmarks.retrieval --embedder api
+    python -m benchmarks.retrieval --embedder local --weights 0.2,0.3,0.5
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+PROFILE = {
+    "instructions": [
+        "keep the steps short",
+        "give metric measurements",
+        "mention prep time up front",
+        "explain techniques for a beginner",
+        "suggest make-ahead options",
+        "list ingredients in the order they are used",
+    ],
+    "preferences": [
+        "likes spicy food",
+        "loves Thai curries",
+        "prefers quick meals under 30 minutes",
+        "enjoys one-pot dinners",
+        "not a fan of mushrooms",
+        "likes crunchy textures",
+        "loves fresh herbs like cilantro and basil",
+        "prefers brown rice over white rice",
+        "enjoys baking bread on weekends",
+        "likes Mediterranean flavors",
+        "dislikes overly sweet desserts",
+    ],
+    "restrictions": [
+        "no nuts",
+        "peanut allergy",
+        "vegetarian",
+        "low sodium",
+        "avoids deep frying",
+        "lactose intolerant",
+    ],
+    "situation": [
+        "cooks dinner for two",
+        "small kitchen with two burners",
+        "has a slow cooker",
+        "busy on weeknights",
+        "has an air fryer",
+        "shops at the farmers market on Saturdays",
+        "meal preps lunches for the work week",
+        "has a toddler who eats the same meals",
+    ],
+}
+
+# (message, relevant profile items, kind)
+PROFILE_QUERIES = [
+    ("dinner for two tonight", ["cooks dinner for two"], "lexical"),
+    ("something spicy please", ["likes spicy food"], "lexical"),
+    ("a Thai curry", ["loves Thai curries", "likes spicy food"], "lexical"),
+    ("no nuts in the sauce", ["no nuts", "peanut allergy"], "lexical"),
+    ("slow cooker recipe for the weekend", ["has a slow cooker"], "lexical"),
+    ("air fryer snacks", ["has an air fryer", "avoids deep frying"], "lexical"),
+    ("what bread can I bake this weekend", ["enjoys baking bread on weekends"], "lexical"),
+    ("quick weeknight meal", ["prefers quick meals under 30 minutes", "busy on weeknights"], "lexical"),
+    ("brown rice bowl", ["prefers brown rice over white rice"], "lexical"),
+    ("one-pot pasta", ["enjoys one-pot dinners"], "lexical"),
+    ("mushroom risotto", ["not a fan of mushrooms"], "lexical"),
+    ("lunches to prep for the week", ["meal preps lunches for the work week"], "lexical"),
+    ("pad thai with peanuts", ["peanut allergy", "no nuts", "loves Thai curries"], "lexical"),
+    ("a dessert for the weekend", ["dislikes overly sweet desserts"], "lexical"),
+    ("something my kid will eat too", ["has a toddler who eats the same meals"], "semantic"),
+    ("cheesy pasta bake", ["lactose intolerant"], "semantic"),
+    ("fried chicken", ["avoids deep frying", "vegetarian", "has an air fryer"], "semantic"),
+    ("steak dinner", ["vegetarian"], "semantic"),
+    ("salty ramen", ["low sodium"], "semantic"),
+    ("a pesto pasta", ["no nuts", "loves fresh herbs like cilantro and basil"], "semantic"),
+    ("Greek salad", ["likes Mediterranean flavors"], "semantic"),
+    ("how do I sear a steak, I'm new to cooking", ["explain techniques for a beginner", "vegetarian"], "semantic"),
+    ("a milkshake", ["lactose intolerant"], "semantic"),
+    ("can I cook this ahead on Sunday", ["suggest make-ahead options", "meal preps lunches for the work week"], "semantic"),
+]
+
+# (name, ingredients, the request it answered)
+RECIPES = [
+    ("Chickpea Curry", ["chickpeas", "coconut milk", "curry paste", "rice"], "something warming with chickpeas"),
+    ("Thai Green Curry", ["green curry paste", "tofu", "coconut milk", "basil", "jasmine rice"], "a thai curry please"),
+    ("Lemon Garlic Pasta", ["spaghetti", "lemon", "garlic", "parmesan", "parsley"], "quick pasta for dinner"),
+    ("Mushroom Risotto", ["arborio rice", "mushrooms", "vegetable stock", "white wine", "parmesan"], "creamy rice dish"),
+    ("Black Bean Tacos", ["black beans", "tortillas", "avocado", "lime", "cilantro"], "taco night"),
+    ("Shakshuka", ["eggs", "tomatoes", "peppers", "cumin", "paprika"], "eggs for brunch"),
+    ("Vegetable Stir Fry", ["broccoli", "bell pepper", "soy sauce", "ginger", "brown rice"], "fast veggie dinner"),
+    ("Tomato Basil Soup", ["tomatoes", "basil", "onion", "vegetable stock"], "a warm soup"),
+    ("Greek Salad", ["cucumber", "tomatoes", "feta", "olives", "red onion"], "fresh salad for lunch"),
+    ("Falafel Wraps", ["chickpeas", "parsley", "tahini", "flatbread", "cucumber"], "mediterranean wraps"),
+    ("Slow Cooker Lentil Stew", ["lentils", "carrots", "celery", "tomatoes", "cumin"], "dump and go slow cooker meal"),
+    ("Air Fryer Tofu Bites", ["tofu", "cornstarch", "soy sauce", "sesame"], "crispy snack without deep frying"),
+    ("Banana Bread", ["bananas", "flour", "eggs", "baking soda", "butter"], "baking project for the weekend"),
+    ("Sourdough Loaf", ["flour", "sourdough starter", "salt", "water"], "homemade bread"),
+    ("Pesto Gnocchi", ["gnocchi", "basil", "pine nuts", "parmesan", "olive oil"], "pesto dinner"),
+    ("Peanut Noodles", ["rice noodles", "peanut butter", "soy sauce", "lime", "scallions"], "cold noodles"),
+    ("Butternut Squash Soup", ["butternut squash", "onion", "nutmeg", "vegetable stock"], "autumn soup"),
+    ("Spinach Lasagna", ["lasagna sheets", "spinach", "ricotta", "mozzarella", "tomato sauce"], "cheesy baked pasta"),
+    ("Overnight Oats", ["oats", "almond milk", "chia seeds", "berries"], "make-ahead breakfast"),
+    ("Veggie Fried Rice", ["rice", "eggs", "peas", "carrots", "soy sauce"], "use up leftover rice"),
+    ("Caprese Sandwich", ["mozzarella", "tomato", "basil", "ciabatta"], "simple lunch sandwich"),
+    ("Sweet Potato Chili", ["sweet potatoes", "black beans", "chili powder", "tomatoes"], "hearty one-pot chili"),
+    ("Mango Sorbet", ["mango", "lime", "sugar"], "light dessert"),
+    ("Ratatouille", ["eggplant", "zucchini", "tomatoes", "peppers", "herbs de provence"], "french vegetable dish"),
+]
+
+RECIPE_QUERIES = [
+    ("a thai curry with tofu", ["Thai Green Curry", "Chickpea Curry"], "lexical"),
+    ("something with chickpeas", ["Chickpea Curry", "Falafel Wraps"], "lexical"),
+    ("slow cooker stew", ["Slow Cooker Lentil Stew"], "lexical"),
+    ("homemade bread", ["Sourdough Loaf", "Banana Bread"], "lexical"),
+    ("soup with tomatoes", ["Tomato Basil Soup"], "lexical"),
+    ("black bean dinner", ["Black Bean Tacos", "Sweet Potato Chili"], "lexical"),
+    ("fried rice", ["Veggie Fried Rice"], "lexical"),
+    ("something with mushrooms", ["Mushroom Risotto"], "lexical"),
+    ("something crispy for a snack", ["Air Fryer Tofu Bites"], "lexical"),
+    ("a mediterranean lunch", ["Greek Salad", "Falafel Wraps"], "semantic"),
+    ("cozy fall dinner", ["Butternut Squash Soup", "Sweet Potato Chili", "Slow Cooker Lentil Stew"], "semantic"),
+    ("breakfast I can prepare the night before", ["Overnight Oats"], "semantic"),
+    ("italian comfort food", ["Spinach Lasagna", "Mushroom Risotto", "Pesto Gnocchi", "Lemon Garlic Pasta"], "semantic"),
+    ("a frozen treat", ["Mango Sorbet"], "semantic"),
+    ("eggs baked in spicy tomato sauce", ["Shakshuka"], "semantic"),
+    ("provencal vegetable stew", ["Ratatouille"], "semantic"),
+]
+
+TRIGRAM_DIM = 1536
+
+
+class _TrigramEmbeddings:
+    """Offline stand-in for the embeddings API: hashed character trigrams of each text."""
+
+    def create(self, *, model: str, input, **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        data = [SimpleNamespace(index=i, embedding=self._embed(text).tolist()) for i, text in enumerate(texts)]
+        return SimpleNamespace(model=model, data=data, usage=SimpleNamespace(prompt_tokens=0, total_tokens=0))
+
+    @staticmethod
+    def _embed(text: str) -> np.ndarray:
+        vector = np.zeros(TRIGRAM_DIM, dtype=np.float32)
+        for word in text.lower().split():
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                bucket = int.from_bytes(hashlib.blake2b(padded[i:i + 3].encode(), digest_size=4).digest(), "little")
+                vector[bucket % TRIGRAM_DIM] += 1.0
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class _MemoryStore:
+    """Embedding store kept in memory, so profile items are embedded once per run."""
+
+    def __init__(self):
+        self.blobs = {}
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, bytes]:
+        return {text: self.blobs[text] for text in texts if text in self.blobs}
+
+    def put_many(self, model: str, items: dict) -> dict[str, bytes]:
+        from embeddings import quantize
+
+        blobs = {text: quantize(vector) for text, vector in items.items()}
+        self.blobs.update(blobs)
+        return blobs
+
+
+def _score(ranked: list, relevant: list, k: int) -> tuple[float, float]:
+    """(recall@k, reciprocal rank of the first relevant result)."""
+    found = len(set(ranked[:k]) & set(relevant)) / len(relevant)
+    rank = next((position for position, item in enumerate(ranked, 1) if item in relevant), None)
+    return found, 1 / rank if rank else 0.0
+
+
+def _summarize(rows: list[tuple[str, float, float, float]]) -> dict:
+    summary = {}
+    for kind in ("lexical", "semantic", "all"):
+        selected = [row for row in rows if kind in ("all", row[0])]
+        summary[kind] = {
+            "recall": round(statistics.mean(row[1] for row in selected), 3),
+            "mrr": round(statistics.mean(row[2] for row in selected), 3),
+        }
+    summary["ms_per_query"] = round(statistics.mean(row[3] for row in rows), 3)
+    return summary
+
+
+def _profile_run(lib, lexical, retrieval: str, store, k: int) -> dict:
+    items = list(dict.fromkeys(item for category in PROFILE.values() for item in category))
+    index = lexical.BM25Index()
+    for item in items:
+        index.add(item, item)
+    rows = []
+    for message, relevant, kind in PROFILE_QUERIES:
+        started = time.perf_counter()
+        relevance = lib.item_relevance(message, items, retrieval, store, lexical_index=index)
+        elapsed = (time.perf_counter() - started) * 1000
+        ranked = [items[i] for i in np.argsort(-relevance, kind="stable")]
+        rows.append((kind, *_score(ranked, relevant, k), elapsed))
+    return _summarize(rows)
+
+
+def _recipe_run(lib, library, retrieval: str, k: int) -> dict:
+    rows = []
+    for message, relevant, kind in RECIPE_QUERIES:
+        started = time.perf_counter()
+        query_embedding = lib.embed_query(message) if retrieval != "lexical" else None
+        hits = library.similar(query_embedding, "demo-user", k=k, min_rating=0, query_text=message, retrieval=retrieval)
+        elapsed = (time.perf_counter() - started) * 1000
+        rows.append((kind, *_score([hit["name"] for hit in hits], relevant, k), elapsed))
+    return _summarize(rows)
+
+
+def _recipe_library(lib, lexical_on: bool):
+    from migrations import migrate
+    from recipe_index import RecipeLibrary
+
+    path = os.path.join(tempfile.mkdtemp(prefix="chefing-retrieval-"), "recipes.db")
+    migrate(path)
+    texts = [f"{request}: {name} ({', '.join(ingredients)})" for name, ingredients, request in RECIPES]
+    blobs = lib.embed_texts(texts, stage="embed_recipes")
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        """
+        INSERT INTO recipes (user_id, name, request, recipe_data, embedding, rating_sum, rating_count)
+        VALUES ('demo-user', ?, ?, ?, ?, 10, 1)
+        """,
+        [
+            (name, request, json.dumps({"name": name, "ingredients": ingredients, "steps": []}), blobs[text])
+            for (name, ingredients, request), text in zip(RECIPES, texts)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return RecipeLibrary(path, lexical=lexical_on)
+
+
+def run(embedder: str, weights: list[float], profile_k: int, recipe_k: int) -> dict:
+    import lexical
+    import lib
+    import recipe_index
+
+    if embedder == "local":
+        lib.set_client(SimpleNamespace(embeddings=_TrigramEmbeddings()))
+    store = _MemoryStore()
+    library = _recipe_library(lib, lexical_on=True)
+
+    results = {}
+    modes = [("embedding", None), *(("hybrid", weight) for weight in weights), ("lexical", None)]
+    for retrieval, weight in modes:
+        if weight is not None:
+            lib.LEXICAL_WEIGHT = recipe_index.LEXICAL_WEIGHT = weight
+        name = f"hybrid w={weight}" if weight is not None else retrieval
+        results[name] = {
+            "profile": _profile_run(lib, lexical, retrieval, store, profile_k),
+            "recipes": _recipe_run(lib, library, retrieval, recipe_k),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding, hybrid and BM25 retrieval on a labelled set.")
+    parser.add_argument("--embedder", choices=["api", "local"], default="api", help="lib's client (API or cassette), or an offline trigram stand-in")
+    parser.add_argument("--weights", default="0.3", help="Comma-separated BM25 weights to try in hybrid mode")
+    parser.add_argument("--profile-k", type=int, default=5)
+    parser.add_argument("--recipe-k", type=int, default=3)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.embedder, [float(w) for w in args.weights.split(",") if w], args.profile_k, args.recipe_k)
+    print(f"profile items: recall@{args.profile_k} / MRR;  recipes: recall@{args.recipe_k} / MRR  ({args.embedder} embeddings)")
+    print(f"{'':<16}{'lexical msgs':>16}{'semantic msgs':>16}{'all':>16}{'ms':>7}   {'lexical msgs':>14}{'semantic msgs':>16}{'all':>16}{'ms':>7}")
+    for name, r in results.items():
+        cells = []
+        for part in ("profile", "recipes"):
+            p = r[part]
+            cells.append(
+                "".join(f"{p[kind]['recall']:>9.2f} /{p[kind]['mrr']:>5.2f}" for kind in ("lexical", "semantic", "all"))
+                + f"{p['ms_per_query']:>7.2f}"
+            )
+        print(f"{name:<16}" + "   ".join(cells))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
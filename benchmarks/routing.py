@@ -0,0 +1,89 @@
+"""
+Latency of a cheap stage through a slowdown of its primary model, with and without SLO fallback.
+
+Runs detect_recipe_request against the mocked LLM backend in three phases:
+the primary model healthy, then slowed down (its latency times --slowdown),
+then healthy again. The fallback model keeps its own latency throughout.
+With routing on, the stage's SLO sits between the primary's healthy and
+slowed-down latency; with it off the stage has no SLO. Reports p50/p95 per
+phase, the share of calls the fallback answered, and the quality-check pass
+rate per model. Latencies are scaled down, and the routing window with
+them, so the run takes about a minute: each phase lasts --phase-seconds,
+calls one after another, with a --window-seconds routing window.
+
+Usage:
+    python -m benchmarks.routing --phase-seconds 10 --window-seconds 3 --slowdown 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import lib
+import routing
+from benchmarks.fake_llm import FakeOpenAI
+
+STAGE = "detect_recipe_request"
+PRIMARY = "gpt-4o"
+FALLBACK = "gpt-4o-mini"
+MESSAGES = ["I'm hungry for dinner", "I like spicy food", "What should I make?", "I'm allergic to peanuts"]
+
+
+def _run(phase_seconds: float, primary_ms: float, fallback_ms: float, slowdown: float, slo: bool) -> list[dict]:
+    fake = FakeOpenAI(latency_ms={"completion": 0.0})
+    create = fake.chat.completions.create
+    state = {"slow": False, "fallbacks": 0}
+
+    def timed_create(**kwargs):
+        state["fallbacks"] += kwargs["model"] == FALLBACK
+        ms = fallback_ms if kwargs["model"] == FALLBACK else primary_ms * (slowdown if state["slow"] else 1)
+        time.sleep(ms / 1000)
+        return create(**kwargs)
+
+    fake.chat.completions.create = timed_create
+    lib.set_client(fake)
+    route = routing.Route(PRIMARY, max_tokens=10, timeout=10.0, fallback=FALLBACK,
+                          slo_ms=primary_ms * (1 + slowdown) / 2 if slo else None)
+    lib.router = routing.Router({STAGE: route})
+
+    rows = []
+    for phase in ("healthy", "slow", "recovered"):
+        state["slow"] = phase == "slow"
+        state["fallbacks"] = 0
+        samples = []
+        end = time.perf_counter() + phase_seconds
+        while time.perf_counter() < end:
+            started = time.perf_counter()
+            # Distinct messages, so request coalescing doesn't share calls
+            lib.detect_recipe_request(f"{MESSAGES[len(samples) % len(MESSAGES)]} ({phase} {len(samples)})")
+            samples.append((time.perf_counter() - started) * 1000)
+        rows.append({
+            "phase": phase,
+            "p50_ms": round(float(np.percentile(samples, 50)), 1),
+            "p95_ms": round(float(np.percentile(samples, 95)), 1),
+            "calls": len(samples),
+            "fallback_share": round(state["fallbacks"] / len(samples), 2),
+        })
+    stats = lib.router.stats()["stages"][STAGE]["models"]
+    for row in rows:
+        row["quality"] = {model: s["quality_pass_rate"] for model, s in stats.items()}
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--phase-seconds", type=float, default=10.0)
+    parser.add_argument("--window-seconds", type=float, default=3.0)
+    parser.add_argument("--primary-ms", type=float, default=20.0)
+    parser.add_argument("--fallback-ms", type=float, default=10.0)
+    parser.add_argument("--slowdown", type=float, default=8.0)
+    args = parser.parse_args()
+
+    routing.WINDOW_SECONDS = args.window_seconds
+
+    print(f"{'routing':<10}{'phase':<11}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'fallback':>10}")
+    for label, slo in (("off", False), ("slo", True)):
+        for row in _run(args.phase_seconds, args.primary_ms, args.fallback_ms, args.slowdown, slo):
+            print(f"{label:<10}{row['phase']:<11}{row['calls']:>7}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['fallback_share']:>10}")
+    print(f"quality pass rate: {row['quality']}")
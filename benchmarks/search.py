@@ -0,0 +1,104 @@
+"""
+Latency of /api/search on a seeded database.
+
+Seeds a database (the large preset has 100k chat rows and 5k feedback rows),
+then times the search endpoint for a mix of rare, common, prefix and
+multi-word queries, next to the LIKE scan over chat.message and chat.response
+that searching would otherwise need.
+
+Usage:
+    python -m benchmarks.search --size large --repeat 20
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.seed import create_seeded_database
+
+QUERIES = ["curry", "shaksh", "salmon teriyaki", "too salty", "garlic", "cook minutes", "microwave"]
+
+
+def _percentiles(samples: list[float]) -> dict:
+    ms = np.array(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def _like_scan(conn, query: str, limit: int):
+    # Every word must appear somewhere in the message or the raw response JSON
+    words = query.split()
+    clause = " AND ".join("(message LIKE ? OR response LIKE ?)" for _ in words)
+    params = [p for word in words for p in (f"%{word}%", f"%{word}%")]
+    return conn.execute(
+        f"SELECT id, message, response FROM chat WHERE user_id = ? AND {clause} ORDER BY created_at DESC LIMIT ?",
+        ("demo-user", *params, limit),
+    ).fetchall()
+
+
+def run(size: str, repeat: int, limit: int, seed: int) -> dict:
+    scratch = tempfile.mkdtemp(prefix="chefing-search-")
+    path = os.path.join(scratch, "search.db")
+    start = time.perf_counter()
+    create_seeded_database(path, size, seed)
+    seed_s = time.perf_counter() - start
+
+    import sqlite3
+
+    import main
+
+    main.DB_PATH = path
+    results = {"size": size, "seed_s": round(seed_s, 2), "queries": {}}
+    conn = sqlite3.connect(path)
+    try:
+        for query in QUERIES:
+            fts_times, like_times = [], []
+            body = {}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = main.search(query, limit=limit)
+                fts_times.append(time.perf_counter() - start)
+                body = json.loads(response.body)
+
+                start = time.perf_counter()
+                _like_scan(conn, query, limit)
+                like_times.append(time.perf_counter() - start)
+            matches = f"{body['total']}" if body["total_is_exact"] else f"{body['total']}+"
+            results["queries"][query] = {"matches": matches, "fts": _percentiles(fts_times), "like": _percentiles(like_times)}
+    finally:
+        conn.close()
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark full-text search.")
+    parser.add_argument("--size", default="large", choices=["small", "medium", "large"])
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per query")
+    parser.add_argument("--limit", type=int, default=20, help="Page size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.size, args.repeat, args.limit, args.seed)
+    print(f"Seeded {args.size} database in {results['seed_s']}s")
+    print(f"{'query':<18}{'matches':>9}{'fts p50':>10}{'fts p99':>10}{'like p50':>10}{'like p99':>10}")
+    for query, stats in results["queries"].items():
+        print(
+            f"{query:<18}{stats['matches']:>9}{stats['fts']['p50_ms']:>10}{stats['fts']['p99_ms']:>10}"
+            f"{stats['like']['p50_ms']:>10}{stats['like']['p99_ms']:>10}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
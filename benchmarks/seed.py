@@ -0,0 +1,211 @@
+"""
+Deterministic SQLite seeding for benchmarks.
+
+Each preset size fills the conversations, chat, user_profile and
+recipe_feedback tables with realistic-looking rows so read endpoints and
+database-bound stages can be measured at different data volumes.
+
+Usage:
+    python -m benchmarks.seed bench.db --size medium
+"""
+
+import argparse
+import datetime
+import json
+import random
+import sqlite3
+
+SIZES = {
+    "small": {"conversations": 20, "messages": 10, "feedback": 20, "profile_items": 5},
+    "medium": {"conversations": 500, "messages": 20, "feedback": 500, "profile_items": 20},
+    "large": {"conversations": 5000, "messages": 20, "feedback": 5000, "profile_items": 50},
+}
+
+USER_ID = "demo-user"
+
+DISHES = [
+    "Chickpea Curry", "Lemon Garlic Pasta", "Veggie Stir Fry", "Tomato Basil Soup",
+    "Black Bean Tacos", "Mushroom Risotto", "Teriyaki Salmon", "Shakshuka",
+    "Pad Thai", "Greek Salad", "Butternut Squash Soup", "Chicken Fajitas",
+]
+INGREDIENTS = [
+    "chickpeas", "garlic", "onion", "olive oil", "lemon", "pasta", "tomatoes",
+    "basil", "rice", "soy sauce", "ginger", "bell pepper", "spinach", "eggs",
+    "feta", "black beans", "tortillas", "salmon", "mushrooms", "parmesan",
+]
+MESSAGES = [
+    "I'm hungry for dinner, what should I make?",
+    "Can you suggest something quick with what I have?",
+    "I'm allergic to peanuts",
+    "I like spicy food",
+    "Make me a recipe for two people",
+    "I only have a microwave this week",
+    "Something comforting for a rainy day please",
+    "I'm trying to eat more fiber",
+]
+PROFILE_ITEMS = {
+    "long_term_instructions": ["keep steps short", "explain techniques", "suggest substitutions"],
+    "long_term_preferences": ["likes spicy food", "prefers quick meals", "enjoys Asian cuisine"],
+    "long_term_restrictions": ["peanut allergy", "vegetarian", "lactose intolerant"],
+    "long_term_situation": ["small kitchen", "cooks for two", "no oven"],
+}
+
+
+def _recipe(rng: random.Random) -> dict:
+    return {
+        "name": rng.choice(DISHES),
+        "ingredients": rng.sample(INGREDIENTS, rng.randint(5, 10)),
+        "steps": [
+            f"Cook the {rng.choice(INGREDIENTS)} for {rng.randint(2, 15)} minutes, stirring occasionally"
+            for _ in range(rng.randint(4, 9))
+        ],
+    }
+
+
+def _response(rng: random.Random) -> dict:
+    if rng.random() < 0.6:
+        return {"recipe": _recipe(rng)}
+    return {
+        "parsed_info": {
+            "new_instructions": [],
+            "new_preferences": [rng.choice(PROFILE_ITEMS["long_term_preferences"])],
+            "new_restrictions": [],
+            "new_situation": [],
+        },
+        "long_term_updates": {},
+    }
+
+
+def _timestamp(rng: random.Random, now: datetime.datetime, max_days: int = 90) -> str:
+    moment = now - datetime.timedelta(seconds=rng.randint(0, max_days * 86400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def seed_database(conn: sqlite3.Connection, size: str = "small", seed: int = 0) -> dict:
+    """
+    Fill an already-initialized database with a preset amount of data.
+    Returns the ids of the seeded conversations for use by load drivers.
+    """
+    spec = SIZES[size]
+    rng = random.Random(seed)
+    now = datetime.datetime(2025, 12, 1)
+    c = conn.cursor()
+
+    conversation_ids = []
+    for _ in range(spec["conversations"]):
+        created = _timestamp(rng, now)
+        c.execute(
+            "INSERT INTO conversations (user_id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (USER_ID, f"{rng.choice(DISHES)} ideas", created, created),
+        )
+        conversation_ids.append(c.lastrowid)
+
+    rows = []
+    for conv_id in conversation_ids:
+        for _ in range(spec["messages"]):
+            has_image = rng.random() < 0.1
+            rows.append(
+                (
+                    conv_id,
+                    USER_ID,
+                    rng.choice(MESSAGES),
+                    json.dumps(_response(rng)),
+                    1 if has_image else 0,
+                    "uploads/fridge.jpeg" if has_image else None,
+                    _timestamp(rng, now),
+                )
+            )
+        if len(rows) >= 10_000:
+            c.executemany(
+                """
+                INSERT INTO chat (conversation_id, user_id, message, response, has_image, image_path, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            rows = []
+    if rows:
+        c.executemany(
+            """
+            INSERT INTO chat (conversation_id, user_id, message, response, has_image, image_path, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+
+    feedback_rows = []
+    for _ in range(spec["feedback"]):
+        recipe = _recipe(rng)
+        feedback_rows.append(
+            (
+                USER_ID,
+                recipe["name"],
+                json.dumps(recipe),
+                rng.choice(["made", "not made", "plan to make"]),
+                rng.randint(1, 10),
+                rng.choice(["Loved it", "Too salty", "Took longer than expected", ""]),
+                _timestamp(rng, now),
+            )
+        )
+    c.executemany(
+        """
+        INSERT INTO recipe_feedback (user_id, recipe_name, recipe_data, made_status, rating, comments, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        feedback_rows,
+    )
+
+    profile = {
+        category: [f"{rng.choice(items)} ({n})" for n in range(spec["profile_items"])]
+        for category, items in PROFILE_ITEMS.items()
+    }
+    c.execute(
+        """
+        INSERT OR REPLACE INTO user_profile
+        (user_id, long_term_instructions, long_term_preferences,
+         long_term_restrictions, long_term_situation)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (
+            USER_ID,
+            json.dumps(profile["long_term_instructions"]),
+            json.dumps(profile["long_term_preferences"]),
+            json.dumps(profile["long_term_restrictions"]),
+            json.dumps(profile["long_term_situation"]),
+        ),
+    )
+    conn.commit()
+    return {"conversation_ids": conversation_ids}
+
+
+def create_seeded_database(path: str, size: str = "small", seed: int = 0) -> dict:
+    """Create the schema at `path` using the app's own init_db and seed it."""
+    import main
+
+    previous = main.DB_PATH
+    main.DB_PATH = path
+    try:
+        main.init_db()
+    finally:
+        main.DB_PATH = previous
+
+    conn = sqlite3.connect(path)
+    try:
+        return seed_database(conn, size, seed)
+    finally:
+        conn.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Seed a Chefing SQLite database for benchmarks.")
+    parser.add_argument("path", help="Database file to create or extend")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    info = create_seeded_database(args.path, args.size, args.seed)
+    print(f"Seeded {args.path} ({args.size}) with {len(info['conversation_ids'])} conversations")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,99 @@
+"""
+Cold-start time of the API.
+
+Each run is a fresh Python process that imports main, starts the app (running
+its lifespan hooks, if any) and serves one request. Runs alternate between a
+new empty database and one that has already been set up, so both first boot
+and worker restarts are measured. The HTTP client used for the request is
+imported outside the timed sections.
+
+Usage:
+    python -m benchmarks.startup --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+import httpx
+
+async def boot():
+    began = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            requested = time.perf_counter()
+            status = (await client.get("/api/conversations")).status_code
+            answered = time.perf_counter()
+    return started - began, answered - requested, status
+
+startup, first_request, status = asyncio.run(boot())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": startup * 1000,
+    "first_request_ms": first_request * 1000,
+    "total_ms": (imported - start + startup + first_request) * 1000,
+    "status": status,
+}))
+"""
+
+
+def _run_once(db_path: str, upload_dir: str) -> dict:
+    env = dict(os.environ, CHEFING_DB_PATH=db_path, CHEFING_UPLOAD_DIR=upload_dir, PYTHONPATH=ROOT)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs: int) -> dict:
+    results = {"fresh_db": [], "existing_db": []}
+    with tempfile.TemporaryDirectory(prefix="chefing-startup-") as scratch:
+        upload_dir = os.path.join(scratch, "uploads")
+        for i in range(runs):
+            db_path = os.path.join(scratch, f"fresh-{i}.db")
+            results["fresh_db"].append(_run_once(db_path, upload_dir))
+            # Same database again, now that the schema exists
+            results["existing_db"].append(_run_once(db_path, upload_dir))
+
+    summary = {}
+    for case, samples in results.items():
+        summary[case] = {
+            key: round(statistics.median(sample[key] for sample in samples), 1)
+            for key in ("import_ms", "startup_ms", "first_request_ms", "total_ms")
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API cold-start time.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    summary = run(args.runs)
+    print(f"{'case':<14}{'import':>10}{'startup':>10}{'1st req':>10}{'total':>10}  (median ms)")
+    for case, stats in summary.items():
+        print(
+            f"{case:<14}{stats['import_ms']:>10}{stats['startup_ms']:>10}"
+            f"{stats['first_request_ms']:>10}{stats['total_ms']:>10}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
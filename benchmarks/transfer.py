@@ -0,0 +1,171 @@
+"""
+NDJSON export and import throughput at scale.
+
+Seeds a database with --rows chat messages (spread over conversations of
+--messages each) plus one feedback row per 100 messages, then:
+- exports it with transfer.export_lines (what /api/export streams) to a file,
+- imports that file into a new database with transfer.Importer,
+- for comparison, builds the same export the way the list endpoints would,
+  with every row fetched and encoded in memory before anything is sent.
+
+Reports rows per second and the growth in the process's peak RSS for each
+step. The streaming export runs before the in-memory one because peak RSS
+only ever grows.
+
+Usage:
+    python -m benchmarks.transfer --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.seed import USER_ID, _recipe, _response
+
+# Distinct stored responses and recipes to pick from, so seeding isn't bound by json.dumps
+POOL = 200
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _seed(path: str, rows: int, messages: int, seed: int):
+    from migrations import migrate
+
+    migrate(path)
+    rng = random.Random(seed)
+    responses = [json.dumps(_response(rng)) for _ in range(POOL)]
+    recipes = [json.dumps(_recipe(rng)) for _ in range(POOL)]
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO user_profile (user_id, long_term_preferences) VALUES (?, ?)",
+        (USER_ID, json.dumps(["likes spicy food", "prefers quick meals"])),
+    )
+    conversations = -(-rows // messages)
+    conn.executemany(
+        "INSERT INTO conversations (id, user_id, title) VALUES (?, ?, ?)",
+        ((n + 1, USER_ID, f"Conversation {n}") for n in range(conversations)),
+    )
+    conn.executemany(
+        "INSERT INTO chat (conversation_id, user_id, message, response) VALUES (?, ?, ?, ?)",
+        ((n // messages + 1, USER_ID, f"message {n}", responses[n % POOL]) for n in range(rows)),
+    )
+    conn.executemany(
+        "INSERT INTO recipe_feedback (user_id, recipe_name, recipe_data, made_status, rating, comments) VALUES (?, ?, ?, ?, ?, ?)",
+        ((USER_ID, f"Recipe {n}", recipes[n % POOL], "made", n % 10, "tasty") for n in range(rows // 100)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _in_memory_export(path: str) -> int:
+    """Every row fetched and encoded before any of it is sent, as a list endpoint would."""
+    from fastjson import dumps
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    body = {
+        "conversations": [dict(row) for row in conn.execute("SELECT * FROM conversations WHERE user_id = ?", (USER_ID,))],
+        "messages": [
+            {**dict(row), "response": json.loads(row["response"])}
+            for row in conn.execute("SELECT * FROM chat WHERE user_id = ?", (USER_ID,))
+        ],
+        "feedback": [
+            {**dict(row), "recipe_data": json.loads(row["recipe_data"])}
+            for row in conn.execute("SELECT * FROM recipe_feedback WHERE user_id = ?", (USER_ID,))
+        ],
+    }
+    conn.close()
+    return len(dumps(body))
+
+
+def run(rows: int, messages: int, seed: int) -> dict:
+    import db_writer
+    import main
+    import transfer
+
+    scratch = tempfile.mkdtemp(prefix="chefing-transfer-")
+    source = os.path.join(scratch, "source.db")
+    started = time.perf_counter()
+    _seed(source, rows, messages, seed)
+    seeded = time.perf_counter() - started
+
+    export_path = os.path.join(scratch, "export.ndjson")
+    rss = _peak_rss_mb()
+    started = time.perf_counter()
+    with open(export_path, "wb") as f:
+        for chunk in transfer.export_lines(source, USER_ID):
+            f.write(chunk)
+    export_seconds = time.perf_counter() - started
+    export_rss = _peak_rss_mb() - rss
+    with open(export_path, "rb") as f:
+        records = sum(1 for _ in f) - 1
+
+    target = os.path.join(scratch, "target.db")
+    from migrations import migrate
+
+    migrate(target)
+    db_writer.enable_wal(target)
+    importer = transfer.Importer(target, USER_ID, lambda c, user_id, profile: main._store_profile(c, user_id, profile, None))
+    rss = _peak_rss_mb()
+    started = time.perf_counter()
+    with open(export_path, "rb") as f:
+        for batch in transfer.read_lines(f):
+            importer.write(batch)
+    import_seconds = time.perf_counter() - started
+    import_rss = _peak_rss_mb() - rss
+    db_writer.close_all()
+
+    rss = _peak_rss_mb()
+    started = time.perf_counter()
+    in_memory_bytes = _in_memory_export(source)
+    in_memory_seconds = time.perf_counter() - started
+    in_memory_rss = _peak_rss_mb() - rss
+
+    return {
+        "records": records,
+        "seed_seconds": round(seeded, 1),
+        "export_mb": round(os.path.getsize(export_path) / 1e6, 1),
+        "export": {"seconds": round(export_seconds, 2), "records_per_second": round(records / export_seconds), "peak_rss_growth_mb": round(export_rss, 1)},
+        "import": {
+            "seconds": round(import_seconds, 2),
+            "records_per_second": round(records / import_seconds),
+            "peak_rss_growth_mb": round(import_rss, 1),
+            "counts": importer.counts,
+        },
+        "in_memory_export": {
+            "seconds": round(in_memory_seconds, 2),
+            "records_per_second": round(records / in_memory_seconds),
+            "peak_rss_growth_mb": round(in_memory_rss, 1),
+            "body_mb": round(in_memory_bytes / 1e6, 1),
+        },
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure NDJSON export and import throughput.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Chat messages to seed")
+    parser.add_argument("--messages", type=int, default=100, help="Messages per conversation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.messages, args.seed)
+    print(f"{results['records']} records, {results['export_mb']} MB of NDJSON (seeded in {results['seed_seconds']} s)")
+    print(f"{'':>18}{'seconds':>9}{'records/s':>11}{'peak RSS +MB':>14}")
+    for step in ("export", "import", "in_memory_export"):
+        r = results[step]
+        print(f"{step:>18}{r['seconds']:>9}{r['records_per_second']:>11}{r['peak_rss_growth_mb']:>14}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
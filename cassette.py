@@ -0,0 +1,279 @@
+"""
+Record and replay of LLM traffic.
+
+With CHEFING_CASSETTE_RECORD=path, lib.get_client() wraps the OpenAI client
+in a RecordingClient, which appends every completion and embedding call,
+with its response and how long it took, to a cassette: gzipped NDJSON, one
+header line and then one entry per call. Embeddings are stored as base64
+float32, and image data URIs are left out of the stored request (they still
+count towards its match key).
+
+Each recording starts a new file, replacing an earlier cassette at the same
+path. With several server processes, put `{pid}` in the path
+(traffic-{pid}.ndjson.gz) so each records its own; cassettes concatenated
+with `cat` read as one.
+
+With CHEFING_CASSETTE_REPLAY=path, lib uses a ReplayClient instead, which
+needs no API key or network. It answers each call with the recorded
+response of a call with the same arguments, and raises CassetteMiss for one
+that was never recorded. Arguments match on the same hash request
+coalescing uses (singleflight.canonical_key), with the time stamped into
+prompts masked out, so a cassette recorded yesterday still matches.
+Identical calls recorded several times are answered in recorded order, the
+last one repeating. CHEFING_CASSETTE_LATENCY_SCALE makes each replayed call
+take its recorded latency times the scale (default 0, answer at once).
+Streamed completions are recorded whole once the stream ends, and replayed
+in one piece.
+
+Summarize a cassette with `python -m cassette info traffic.ndjson.gz`.
+"""
+
+import argparse
+import atexit
+import base64
+import gzip
+import json
+import os
+import re
+import statistics
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+
+from singleflight import canonical_key
+
+RECORD = os.environ.get("CHEFING_CASSETTE_RECORD")
+REPLAY = os.environ.get("CHEFING_CASSETTE_REPLAY")
+LATENCY_SCALE = float(os.environ.get("CHEFING_CASSETTE_LATENCY_SCALE", "0"))
+
+FORMAT = 1
+# str() of lib.prompt_time(), e.g. "2026-10-19 13:12:00-04:00"
+_PROMPT_TIME = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}")
+_DATA_URI = re.compile(r"^data:[^;,]+;base64,")
+
+
+class CassetteMiss(KeyError):
+    """A call the cassette has no recording for."""
+
+
+def _map_strings(value, fn):
+    if isinstance(value, str):
+        return fn(value)
+    if isinstance(value, dict):
+        return {k: _map_strings(v, fn) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_map_strings(v, fn) for v in value]
+    return value
+
+
+def _mask_time(text: str) -> str:
+    return _PROMPT_TIME.sub("<time>", text)
+
+
+def _elide_data_uri(text: str) -> str:
+    if _DATA_URI.match(text):
+        return f"<data uri, {len(text)} chars>"
+    return text
+
+
+# How a call is delivered, not what it asks for: a call recorded streamed replays unstreamed and vice versa
+TRANSPORT_ARGUMENTS = frozenset({"timeout", "stream", "stream_options"})
+
+
+def match_key(kind: str, arguments: dict) -> str:
+    """The key a call is recorded and looked up under."""
+    arguments = {k: v for k, v in arguments.items() if k not in TRANSPORT_ARGUMENTS}
+    return canonical_key(kind, _map_strings(arguments, _mask_time))
+
+
+def _plain(obj):
+    """A response object (an OpenAI model or SimpleNamespaces) as JSON-ready data."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, SimpleNamespace):
+        return {k: _plain(v) for k, v in vars(obj).items()}
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_namespace(v) for v in value]
+    return value
+
+
+def _pack_embeddings(response: dict) -> dict:
+    for item in response.get("data") or []:
+        vector = np.asarray(item["embedding"], dtype="<f4")
+        item["embedding"] = {"f32": base64.b64encode(vector.tobytes()).decode("ascii")}
+    return response
+
+
+def _unpack_embeddings(response: dict) -> dict:
+    data = [
+        {**item, "embedding": np.frombuffer(base64.b64decode(item["embedding"]["f32"]), dtype="<f4").tolist()}
+        for item in response.get("data") or []
+    ]
+    return {**response, "data": data}
+
+
+def read_entries(path: str):
+    """
+    Yield a cassette's entries. A cassette cut off mid-write (a killed process)
+    ends at its last whole entry; the headers of cassettes concatenated after
+    the first are skipped.
+    """
+    with gzip.open(path, "rb") as f:
+        try:
+            header = json.loads(f.readline() or b"null")
+            if not isinstance(header, dict) or header.get("type") != "cassette" or header.get("format") != FORMAT:
+                raise ValueError(f"{path} is not a format {FORMAT} cassette")
+            for line in f:
+                if line.endswith(b"\n"):
+                    entry = json.loads(line)
+                    if entry.get("type") != "cassette":
+                        yield entry
+        except (EOFError, zlib.error):
+            return
+
+
+class _Endpoint:
+    """Stands in for client.chat.completions or client.embeddings."""
+
+    def __init__(self, create):
+        self.create = create
+
+
+class RecordingClient:
+    """Wraps an OpenAI client, recording each completion and embedding call to a new cassette at `path`."""
+
+    def __init__(self, inner, path: str):
+        self._inner = inner
+        self._lock = threading.Lock()
+        self._file = gzip.open(path.replace("{pid}", str(os.getpid())), "wb")
+        self._write({"type": "cassette", "format": FORMAT, "recorded_at": int(time.time())})
+        self.chat = SimpleNamespace(completions=_Endpoint(self._completion))
+        self.embeddings = _Endpoint(self._embedding)
+        atexit.register(self.close)
+
+    def __getattr__(self, name):
+        # Files, batches and the rest go straight to the real client
+        return getattr(self._inner, name)
+
+    def _write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def _record(self, kind: str, kwargs: dict, create):
+        started = time.perf_counter()
+        response = create(**kwargs)
+        if kwargs.get("stream"):
+            return self._record_stream(kind, kwargs, response, started)
+        self._append(kind, kwargs, _plain(response), started)
+        return response
+
+    def _record_stream(self, kind: str, kwargs: dict, stream, started: float):
+        # Passed on chunk by chunk, and stored as the whole response once the stream ends
+        chunks = []
+        for chunk in stream:
+            chunks.append(_plain(chunk))
+            yield chunk
+        content = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks if c.get("choices"))
+        usage = next((c["usage"] for c in reversed(chunks) if c.get("usage")), None)
+        message = {"role": "assistant", "content": content}
+        self._append(kind, kwargs, {"model": kwargs.get("model"), "choices": [{"message": message, "finish_reason": "stop"}], "usage": usage}, started)
+
+    def _append(self, kind: str, kwargs: dict, plain: dict, started: float):
+        self._write({
+            "kind": kind,
+            "key": match_key(kind, kwargs),
+            "model": kwargs.get("model"),
+            "request": _map_strings(kwargs, _elide_data_uri),
+            "response": _pack_embeddings(plain) if kind == "embedding" else plain,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    def _completion(self, **kwargs):
+        return self._record("completion", kwargs, self._inner.chat.completions.create)
+
+    def _embedding(self, **kwargs):
+        return self._record("embedding", kwargs, self._inner.embeddings.create)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayClient:
+    """Answers completion and embedding calls from a cassette; see the module docstring."""
+
+    def __init__(self, path: str, latency_scale: float = LATENCY_SCALE):
+        self.latency_scale = latency_scale
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Match key -> recordings in order, and how many of them have been served
+        self._entries: dict[str, list[dict]] = {}
+        self._served: dict[str, int] = {}
+        for entry in read_entries(path):
+            self._entries.setdefault(entry["key"], []).append(entry)
+        self.chat = SimpleNamespace(completions=_Endpoint(lambda **kwargs: self._replay("completion", kwargs)))
+        self.embeddings = _Endpoint(lambda **kwargs: self._replay("embedding", kwargs))
+
+    def _replay(self, kind: str, kwargs: dict):
+        key = match_key(kind, kwargs)
+        with self._lock:
+            recordings = self._entries.get(key)
+            if not recordings:
+                self.misses += 1
+                preview = _mask_time(json.dumps(_map_strings(kwargs, _elide_data_uri), default=str))[:300]
+                raise CassetteMiss(f"no recorded {kind} call for {kwargs.get('model')}: {preview}")
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        entry = recordings[min(served, len(recordings) - 1)]
+        if self.latency_scale:
+            time.sleep(entry["latency_ms"] / 1000 * self.latency_scale)
+        response = entry["response"]
+        return _namespace(_unpack_embeddings(response) if kind == "embedding" else response)
+
+
+def summarize(path: str) -> dict:
+    """Calls, distinct requests and latency percentiles per kind and model."""
+    groups: dict[tuple[str, str], dict] = {}
+    for entry in read_entries(path):
+        group = groups.setdefault((entry["kind"], entry["model"]), {"latencies": [], "keys": set()})
+        group["latencies"].append(entry["latency_ms"])
+        group["keys"].add(entry["key"])
+    summary = {}
+    for (kind, model), group in sorted(groups.items()):
+        latencies = sorted(group["latencies"])
+        summary[f"{kind} {model}"] = {
+            "calls": len(latencies),
+            "distinct": len(group["keys"]),
+            "p50_ms": round(statistics.median(latencies), 1),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 1),
+            "total_s": round(sum(latencies) / 1000, 1),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect LLM traffic cassettes.")
+    parser.add_argument("command", choices=["info"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    print(f"{'':<40}{'calls':>7}{'distinct':>10}{'p50 ms':>9}{'p95 ms':>9}{'total s':>9}")
+    for name, s in summarize(args.path).items():
+        print(f"{name:<40}{s['calls']:>7}{s['distinct']:>10}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['total_s']:>9}")
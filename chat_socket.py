@@ -0,0 +1,279 @@
+"""
+Chat over a WebSocket, with progress events.
+
+/ws/chat keeps one connection open for a whole conversation. Each message
+runs through the same pipeline as POST /api/chat (main.run_chat_turn), and
+the pipeline's progress is pushed to the client as it happens instead of
+one answer at the end.
+
+Client to server, one JSON object per frame ("text" is the only required
+field; "image" is a base64 data URI of a fridge photo):
+    {"type": "message", "id": "t1", "text": "...", "conversation_id": 12, "image": "data:image/jpeg;base64,..."}
+    {"type": "cancel", "id": "t1"}    (without "id": every turn)
+
+Server to client, one event per frame, each naming its turn:
+    accepted   the turn is queued ("queued": turns ahead of it)
+    context    profile items picked for the prompt, per category
+    intent     whether the message asks for a recipe ("recipe")
+    generation where the recipe comes from ("source": model, speculation, cache)
+    token      a piece of the recipe JSON as the model writes it ("text")
+    profile    long-term profile updates learned from the message
+    title      the title of a new conversation
+    done       "conversation_id" and "response", the body POST /api/chat returns
+    cancelled
+    error      "status" and "detail", as the HTTP endpoint would answer
+
+Turns run one at a time per connection, in order, and each takes one of the
+user's admission slots (see admission.py) while it runs. Work POST /api/chat
+leaves to background tasks (the memory summary) runs after the done event,
+outside the slot and without holding up the next turn. Up to
+CHEFING_WS_QUEUED_TURNS (default 4) more can wait; a message beyond that
+gets an error with status 429.
+
+A cancelled turn stops at its next stage, or mid-generation by closing the
+upstream stream. It is not stored in the conversation, though a profile
+update that already happened stays.
+
+Backpressure: events wait in a per-connection queue and are sent as fast as
+the client reads them, so the pipeline never blocks on the socket. Token
+events queued behind a slow client are merged into one, which keeps the
+queue to a few events per turn however far behind the client is
+(chefing_ws_merged_token_events_total).
+"""
+
+import asyncio
+import base64
+import binascii
+import collections
+import itertools
+import logging
+import mimetypes
+import os
+import threading
+import time
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from accounting import collecting_usage
+from admission import admitted
+from metrics import WS_CONNECTIONS, WS_MERGED_TOKENS, WS_TURN_LATENCY
+
+QUEUED_TURNS = int(os.environ.get("CHEFING_WS_QUEUED_TURNS", "4"))
+
+logger = logging.getLogger("chefing.chat_socket")
+
+
+class TurnCancelled(Exception):
+    """Raised inside a turn's pipeline once the client has cancelled it."""
+
+
+class Progress:
+    """
+    Where a chat turn reports its progress. This one ignores it all, which is
+    how POST /api/chat runs the pipeline.
+    """
+
+    # A callable here has recipe generation streamed to it
+    on_token = None
+
+    def emit(self, event: str, **data):
+        pass
+
+    def check(self):
+        """Raise TurnCancelled if the turn has been cancelled."""
+
+
+class EventQueue:
+    """Events on their way to one socket. Put from any thread, taken on the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._events: collections.deque[dict] = collections.deque()
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def put(self, event: dict):
+        with self._lock:
+            last = self._events[-1] if self._events else None
+            if event["event"] == "token" and last and last["event"] == "token" and last["turn"] == event["turn"]:
+                # The client hasn't taken the last piece yet: send both in one frame
+                last["text"] += event["text"]
+                WS_MERGED_TOKENS.inc()
+                return
+            self._events.append(event)
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self) -> dict:
+        while True:
+            with self._lock:
+                if self._events:
+                    return self._events.popleft()
+                self._ready.clear()
+            await self._ready.wait()
+
+
+class SocketTurn(Progress):
+    """One message on a socket: its progress goes to the client as events."""
+
+    def __init__(self, turn_id, message: dict, events: EventQueue):
+        self.id = turn_id
+        self.message = message
+        self.events = events
+        self.cancelled = threading.Event()
+        # Work the HTTP endpoint would leave to background tasks, run once the turn is done
+        self.deferred = []
+
+    def emit(self, event: str, **data):
+        self.events.put({"turn": self.id, "event": event, **data})
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise TurnCancelled()
+
+    def on_token(self, text: str):
+        self.check()
+        self.emit("token", text=text)
+
+    def defer(self, fn, *args):
+        self.deferred.append((fn, args))
+
+
+def decode_image(data_uri: str) -> tuple[bytes, str]:
+    """The bytes of a base64 image data URI, and a file extension for it."""
+    header, _, data = data_uri.partition(",")
+    if not header.startswith("data:image/") or not header.endswith(";base64"):
+        raise HTTPException(status_code=400, detail="image must be a base64 data URI of an image")
+    try:
+        content = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="image is not valid base64")
+    return content, mimetypes.guess_extension(header[5:-7]) or ".jpg"
+
+
+class ChatSocket:
+    """
+    One /ws/chat connection. `run_turn(turn)` runs a turn's pipeline on a worker
+    thread and returns the payload of its done event; usage is attributed to
+    `user_id` and handed to `usage_sink` after each turn, as for HTTP requests.
+    """
+
+    def __init__(self, websocket: WebSocket, run_turn, user_id: str, usage_sink):
+        self.websocket = websocket
+        self.run_turn = run_turn
+        self.user_id = user_id
+        self.usage_sink = usage_sink
+        self._ids = itertools.count(1)
+        # Turns accepted and not finished yet, the running one first
+        self._open: list[SocketTurn] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Finished turns' deferred work still running
+        self._deferred: set[asyncio.Task] = set()
+
+    async def serve(self):
+        await self.websocket.accept()
+        WS_CONNECTIONS.inc()
+        self.events = EventQueue(asyncio.get_running_loop())
+        sender = asyncio.create_task(self._send())
+        runner = asyncio.create_task(self._run())
+        try:
+            await self._receive()
+        finally:
+            WS_CONNECTIONS.dec()
+            for turn in self._open:
+                turn.cancelled.set()
+            self._queue.put_nowait(None)
+            # The running turn stops at its next stage; nobody is left to tell
+            await runner
+            sender.cancel()
+            await asyncio.gather(*self._deferred)
+
+    async def _receive(self):
+        while True:
+            try:
+                message = await self.websocket.receive_json()
+            except WebSocketDisconnect:
+                return
+            except ValueError:
+                self._error(None, 400, "messages must be JSON objects")
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "message":
+                self._accept(message)
+            elif kind == "cancel":
+                for turn in self._open:
+                    if message.get("id") is None or turn.id == message["id"]:
+                        turn.cancelled.set()
+            else:
+                self._error(message.get("id") if isinstance(message, dict) else None, 400, 'type must be "message" or "cancel"')
+
+    def _accept(self, message: dict):
+        turn_id = message.get("id") or str(next(self._ids))
+        text = message.get("text")
+        if not isinstance(text, str) or not text.strip():
+            self._error(turn_id, 400, "text is required")
+            return
+        queued = len(self._open)
+        if queued > QUEUED_TURNS:
+            self._error(turn_id, 429, "Too many turns queued on this connection, please wait for one to finish")
+            return
+        turn = SocketTurn(turn_id, message, self.events)
+        self._open.append(turn)
+        turn.emit("accepted", queued=queued)
+        self._queue.put_nowait(turn)
+
+    def _error(self, turn_id, status: int, detail, retry_after=None):
+        event = {"turn": turn_id, "event": "error", "status": status, "detail": detail}
+        if retry_after is not None:
+            event["retry_after"] = int(retry_after)
+        self.events.put(event)
+
+    async def _send(self):
+        while True:
+            event = await self.events.get()
+            try:
+                await self.websocket.send_json(event)
+            except (WebSocketDisconnect, RuntimeError):
+                # Closed under us; the receive loop notices and winds down
+                return
+
+    async def _run(self):
+        while (turn := await self._queue.get()) is not None:
+            await self._run_turn(turn)
+            self._open.remove(turn)
+
+    async def _run_turn(self, turn: SocketTurn):
+        started = time.perf_counter()
+        finished = None
+        result = "done"
+        try:
+            turn.check()
+            async with collecting_usage("/ws/chat", self.usage_sink):
+                async with admitted(self.user_id):
+                    turn.emit("done", **await run_in_threadpool(self.run_turn, turn))
+                    finished = time.perf_counter()
+                if turn.deferred:
+                    # Off the admission slot and the turn queue, as background tasks are for HTTP;
+                    # its usage still goes to this turn
+                    task = asyncio.create_task(self._run_deferred(turn.deferred))
+                    self._deferred.add(task)
+                    task.add_done_callback(self._deferred.discard)
+        except TurnCancelled:
+            result = "cancelled"
+            turn.emit("cancelled")
+        except HTTPException as e:
+            result = "error"
+            self._error(turn.id, e.status_code, e.detail, (e.headers or {}).get("Retry-After"))
+        except Exception:
+            result = "error"
+            # Details stay in the log, as for an unhandled error on POST /api/chat
+            logger.exception("A /ws/chat turn failed")
+            self._error(turn.id, 500, "Internal Server Error")
+        WS_TURN_LATENCY.observe(result, value=(finished or time.perf_counter()) - started)
+
+    async def _run_deferred(self, deferred: list):
+        for fn, args in deferred:
+            try:
+                await run_in_threadpool(fn, *args)
+            except Exception:
+                logger.exception("Deferred work for a /ws/chat turn failed")
@@ -0,0 +1,34 @@
+"""
+Critical profile items: allergies, intolerances and diets.
+
+A critical item is always included in the prompt context, however little it
+has to do with the message. The parsing stages are asked to word such items
+with one of CRITICAL_KEYWORDS, and is_critical() recognises them by it.
+Kept free of dependencies so migrations.py can flag stored items without
+importing the LLM pipeline in lib.py.
+"""
+
+import re
+
+CRITICAL_KEYWORDS = {
+    "vegan",
+    "vegetarian",
+    "pescatarian",
+    "free",
+    "intolerant",
+    "allergy",
+    "allergic",
+}
+# Listed in a fixed order: a set's order changes from process to process, and with it the prompt
+CRITICAL_KEYWORDS_TEXT = ", ".join(sorted(CRITICAL_KEYWORDS))
+
+# Whole words (and plurals) only, so "free" matches "gluten-free" but not "carefree"
+CRITICAL_PATTERN = re.compile(
+    r"\b(?:" + "|".join(sorted(map(re.escape, CRITICAL_KEYWORDS | {"allergies"}))) + r")s?\b",
+    re.IGNORECASE,
+)
+
+
+def is_critical(item: str) -> bool:
+    """Whether a profile item must always be included in the prompt context."""
+    return CRITICAL_PATTERN.search(item) is not None
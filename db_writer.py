@@ -0,0 +1,189 @@
+"""
+Single-writer queue for SQLite.
+
+Every write in the app goes through one writer thread per database and
+process. A write is a function of a connection. The writer drains whatever
+writes are queued (up to WRITE_BATCH, waiting at most WRITE_WINDOW for more
+to arrive) and runs them in one BEGIN IMMEDIATE transaction, each inside its
+own savepoint. A write that raises is rolled back on its own and its caller
+gets the exception; the rest commit together. Callers block until the batch
+has committed.
+
+Group commit means one lock acquisition and one fsync per batch instead of
+per write. With several uvicorn workers each process has its own writer;
+the database runs in WAL mode, so readers never block the writer, and the
+writers wait up to BUSY_TIMEOUT_SECONDS for each other's lock instead of
+failing with "database is locked".
+
+A write replacing a row its caller read earlier (a whole-profile update)
+can compare-and-swap on a version column and fails with Conflict if the
+row changed. The profile merge instead re-reads the profile inside the
+write's transaction and applies its additions on top, so it is rebased
+rather than retried and never conflicts.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import DB_WRITE_BATCH, DB_WRITE_LATENCY
+
+BUSY_TIMEOUT_SECONDS = float(os.environ.get("CHEFING_DB_BUSY_TIMEOUT", "30"))
+WRITE_BATCH = int(os.environ.get("CHEFING_WRITE_BATCH", "64"))
+# How long the writer waits for more writes to join a batch, once it has one
+WRITE_WINDOW = float(os.environ.get("CHEFING_WRITE_WINDOW_MS", "2")) / 1000
+
+_STOP = object()
+
+
+class Conflict(Exception):
+    """A compare-and-swap write found the row changed since it was read."""
+
+
+def connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """A connection that waits for other processes' write locks instead of failing."""
+    return sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS, **kwargs)
+
+
+def enable_wal(db_path: str):
+    """Switch the database to WAL mode (persistent), so reads and the writer don't block each other."""
+    conn = connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+
+class _Write:
+    __slots__ = ("fn", "future", "submitted")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class WriteQueue:
+    """The writer thread for one database file."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name=f"db-writer:{os.path.basename(db_path)}", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn) -> Future:
+        """Queue `fn(conn)`; the future resolves to its result once its batch has committed."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("a write cannot queue another write; do both in one function")
+        write = _Write(fn)
+        self._queue.put(write)
+        return write.future
+
+    def run(self, fn):
+        """Run `fn(conn)` in the next batch and return its result after the commit."""
+        return self.submit(fn).result()
+
+    def close(self):
+        """Commit what is queued and stop the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> tuple[list[_Write], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + WRITE_WINDOW
+        while len(batch) < WRITE_BATCH:
+            try:
+                write = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if write is _STOP:
+                return batch, True
+            batch.append(write)
+        return batch, False
+
+    def _loop(self):
+        conn = connect(self.db_path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable at each checkpoint rather than each commit; WAL stays consistent either way
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            while True:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: list[_Write]):
+        DB_WRITE_BATCH.observe(value=len(batch))
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                if not write.future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write")
+                try:
+                    result = write.fn(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    outcomes.append((write, None, e))
+                else:
+                    outcomes.append((write, result, None))
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+        except Exception as e:
+            # Lock timeout or a failed commit: nothing in the batch was written
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for write in batch:
+                if not write.future.done():
+                    if not write.future.running():
+                        write.future.set_running_or_notify_cancel()
+                    write.future.set_exception(e)
+                    DB_WRITE_LATENCY.observe("error", value=time.perf_counter() - write.submitted)
+            return
+
+        for write, result, error in outcomes:
+            DB_WRITE_LATENCY.observe("error" if error else "ok", value=time.perf_counter() - write.submitted)
+            if error is not None:
+                write.future.set_exception(error)
+            else:
+                write.future.set_result(result)
+
+
+_writers: dict[str, WriteQueue] = {}
+_writers_lock = threading.Lock()
+
+
+def writer(db_path: str) -> WriteQueue:
+    """This process's writer for `db_path`, started on first use."""
+    with _writers_lock:
+        queue_ = _writers.get(db_path)
+        if queue_ is None:
+            queue_ = _writers[db_path] = WriteQueue(db_path)
+        return queue_
+
+
+def write(db_path: str, fn):
+    """Run `fn(conn)` on the writer for `db_path` and return its result once committed."""
+    return writer(db_path).run(fn)
+
+
+def close_all():
+    """Flush and stop every writer in this process."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for queue_ in writers:
+        queue_.close()
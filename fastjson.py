@@ -0,0 +1,84 @@
+"""
+Fast JSON encoding for API responses.
+
+Uses orjson, a project dependency, and falls back to the standard library
+encoder in an install without it. encode_rows() builds a JSON array straight from database
+rows, copying columns that already hold serialized JSON (chat responses,
+recipe data) into the output verbatim instead of parsing them into Python
+objects only to encode them again.
+"""
+
+import json
+
+from fastapi.responses import JSONResponse as _JSONResponse
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # not installed; the standard library encoder is used instead
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """Compact UTF-8 JSON, the same output JSONResponse would produce."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes | str):
+    """Parse JSON; raises ValueError if it isn't."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONResponse(_JSONResponse):
+    """Drop-in for fastapi.responses.JSONResponse that renders with dumps()."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+RAW = "raw"
+BOOL = "bool"
+
+
+def _encode_raw(value) -> bytes:
+    return value.encode("utf-8") if value is not None else b"null"
+
+
+def _encode_bool(value) -> bytes:
+    return b"true" if value else b"false"
+
+
+_ENCODERS = {RAW: _encode_raw, BOOL: _encode_bool}
+
+
+def row_encoder(fields: dict[str, str | None], constants: dict | None = None):
+    """
+    A function encoding one row as a JSON object. `fields` maps each output
+    key, in the order of the row's columns, to how its value is encoded: RAW
+    for text that is already JSON, BOOL for SQLite 0/1 flags, None for
+    anything else. `constants` are members put first in every object.
+    """
+    prefixes = [dumps(key) + b":" for key in fields]
+    encoders = [_ENCODERS.get(kind, dumps) for kind in fields.values()]
+    lead = b"".join(dumps(key) + b":" + dumps(value) + b"," for key, value in (constants or {}).items())
+
+    def encode_row(row) -> bytes:
+        members = [prefix + encode(value) for prefix, encode, value in zip(prefixes, encoders, row)]
+        return b"{" + lead + b",".join(members) + b"}"
+
+    return encode_row
+
+
+def encode_rows(rows, fields: dict[str, str | None]) -> bytes:
+    """Encode rows as a JSON array of objects; see row_encoder for `fields`."""
+    encode_row = row_encoder(fields)
+    return b"[" + b",".join([encode_row(row) for row in rows]) + b"]"
+
+
+def raw_json_response(body: bytes) -> Response:
+    """A response whose body is already encoded JSON."""
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,164 @@
+"""
+Local BM25 retrieval over profile items and stored recipes.
+
+Choosing the profile context (lib.select_profile_context) and similar
+recipes (recipe_index.py) normally ranks by embedding similarity, which
+needs the message embedded upstream first. A BM25Index ranks by shared
+words instead, with no network at all. It is an in-memory inverted index
+that documents are added to and removed from one at a time, so it is kept
+up to date as profiles and recipes are written rather than rebuilt.
+
+CHEFING_RETRIEVAL picks how the chat endpoint ranks:
+- embedding (default): cosine similarity of embeddings, as before
+- hybrid: (1 - w) * cosine + w * BM25 score, w = CHEFING_LEXICAL_WEIGHT
+  (default 0.3). If embedding the message fails, the request falls back
+  to lexical instead of failing.
+- lexical: BM25 only. No embedding calls are made, so retrieval keeps
+  working when the embedding API is slow or down. Recipes saved in this
+  mode have no embedding, so the recipe cache (which needs a close
+  embedding match) is off.
+
+Scores are normalized to 0..1: the share of the query's term weight (the
+sum of its terms' idf) a document matches, so they can be mixed with
+cosine similarities and held to the same thresholds. Query terms that no
+document contains don't count.
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+RETRIEVAL = os.environ.get("CHEFING_RETRIEVAL", "embedding")
+if RETRIEVAL not in ("embedding", "hybrid", "lexical"):
+    raise ValueError(f"CHEFING_RETRIEVAL must be embedding, hybrid or lexical, not {RETRIEVAL!r}")
+LEXICAL_WEIGHT = float(os.environ.get("CHEFING_LEXICAL_WEIGHT", "0.3"))
+
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Negations ("no", "not", "without") are kept: they matter in restrictions
+STOPWORDS = frozenset(
+    """
+    a about after all also am an and any are as at be been but by can could did do does doing for from
+    get give got had has have having he her here him his how i i'm if in into is it its just let like
+    make me might more most much my need of off on once one only or other our out over please really
+    she should so some something than that the their them then there these they this those to too
+    tonight today up us very want was we were what when where which while who why will would you your
+    """.split()
+)
+
+
+def _stem(word: str) -> str:
+    # Plurals only: "nuts" matches "nut", "allergies" matches "allergy"
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    stems = (_stem(word) for word in _WORD.findall(text.lower()))
+    return [stem for stem in stems if stem not in STOPWORDS]
+
+
+class BM25Index:
+    """BM25 (Okapi) over short documents, with documents added and removed one at a time."""
+
+    def __init__(self):
+        # term -> {doc id: term frequency}; each document's length in terms, and its distinct terms
+        self.postings: dict[str, dict] = {}
+        self.lengths: dict = {}
+        self._terms: dict = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self.lengths
+
+    def add(self, doc_id, text: str):
+        """Index `text` under `doc_id`, replacing what was indexed under it before."""
+        terms = tokenize(text)
+        with self._lock:
+            self._remove(doc_id)
+            counts = Counter(terms)
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = count
+            self.lengths[doc_id] = len(terms)
+            self._terms[doc_id] = tuple(counts)
+            self.total_length += len(terms)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        length = self.lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self._terms.pop(doc_id):
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.lengths) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str) -> dict:
+        """Normalized BM25 score (0..1) of every document sharing a term with `query`."""
+        with self._lock:
+            terms = [term for term in dict.fromkeys(tokenize(query)) if term in self.postings]
+            if not terms:
+                return {}
+            average = self.total_length / len(self.lengths)
+            scores: dict = {}
+            weight = 0.0
+            for term in terms:
+                idf = self._idf(term)
+                weight += idf
+                for doc_id, tf in self.postings[term].items():
+                    norm = K1 * (1 - B + B * self.lengths[doc_id] / average) if average else K1
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        # A short document matching every term once can go slightly above its weight
+        return {doc_id: min(score / weight, 1.0) for doc_id, score in scores.items()}
+
+    def top(self, query: str, k: int, allowed=None) -> list[tuple[object, float]]:
+        """The `k` best (doc id, score) pairs, best first, among `allowed` doc ids if given."""
+        scores = self.scores(query)
+        if allowed is not None:
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_id in allowed}
+        return sorted(scores.items(), key=lambda pair: -pair[1])[:k]
+
+
+class ProfileLexicon:
+    """A BM25Index of each user's profile items, kept in step with the profile."""
+
+    def __init__(self):
+        self._indexes: dict[tuple, BM25Index] = {}
+        self._lock = threading.Lock()
+
+    def sync(self, key, items) -> BM25Index:
+        """
+        The index for `key` (e.g. database and user), after adding items it
+        doesn't have yet and removing ones no longer in `items`. Cheap when
+        nothing changed: profile writes call this too, so reads rarely have
+        anything left to do.
+        """
+        current = set(items)
+        with self._lock:
+            index = self._indexes.setdefault(key, BM25Index())
+            for item in [doc_id for doc_id in index.lengths if doc_id not in current]:
+                index.remove(item)
+            for item in current:
+                if item not in index:
+                    index.add(item, item)
+        return index
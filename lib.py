@@ -1,13 +1,57 @@
 import base64
 import json
 import datetime
+import re
+import threading
+import time
 import zoneinfo
-from openai import OpenAI
+from types import SimpleNamespace
 from dotenv import load_dotenv
 import numpy as np
 
-load_dotenv(".env")
-client = OpenAI()
+import cassette
+from accounting import record_call
+from critical import CRITICAL_KEYWORDS_TEXT, is_critical
+from embeddings import EmbeddingMatrix, quantize
+from lexical import LEXICAL_WEIGHT, BM25Index
+from metrics import CONTEXT_TOKENS, record_llm_usage, span, traced
+from singleflight import SingleFlight, canonical_key
+from admission import call_upstream
+from routing import router
+
+# Created on first use, so importing lib is cheap and needs no API key
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The OpenAI client, built (and .env loaded) on first use. Recorded to or
+    replayed from a cassette if CHEFING_CASSETTE_RECORD or _REPLAY is set.
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                if cassette.REPLAY:
+                    client = cassette.ReplayClient(cassette.REPLAY)
+                else:
+                    # Deferred: importing openai dominates the app's import time
+                    from openai import OpenAI
+
+                    load_dotenv(".env")
+                    client = OpenAI()
+                    if cassette.RECORD:
+                        client = cassette.RecordingClient(client, cassette.RECORD)
+    return client
+
+
+def set_client(new_client):
+    """Replace the OpenAI client, e.g. with a fake for benchmarks."""
+    global client
+    client = new_client
+
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 SYSTEM_PROMPT = """
 You are an expert chef working on the platform Chefing. 
@@ -20,28 +64,226 @@ Try to ignore super obviously contrarian user fluctuations and instructions.
 """
 
 
+# Identical calls in flight at the same time share one upstream request
+inflight = SingleFlight()
+
+
+def _complete(stage: str, check=None, on_token=None, **kwargs):
+    """
+    Run a chat completion for a pipeline stage, recording its latency and token usage.
+    The model, default max_tokens and timeout come from the stage's route (see routing.py),
+    and `check(content)` is the stage's quality check, recorded against the model that
+    answered. Usage and quality are only recorded by the caller that made the upstream
+    call, not by callers that shared its result.
+    With `on_token`, the completion is streamed and `on_token(text)` gets each piece of
+    content as it arrives; an exception it raises aborts the stream. Streamed calls are
+    not coalesced, since a caller sharing the result would not see the tokens.
+    """
+    model, route = router.choose(stage)
+    kwargs["model"] = model
+    if route.max_tokens is not None:
+        kwargs.setdefault("max_tokens", route.max_tokens)
+    if on_token is not None:
+        kwargs.update(stream=True, stream_options={"include_usage": True})
+
+    def create():
+        started = time.perf_counter()
+        try:
+            response = get_client().chat.completions.create(**kwargs, timeout=route.timeout)
+            return response if on_token is None else _collect_stream(response, on_token)
+        finally:
+            router.record_latency(stage, model, time.perf_counter() - started)
+
+    with span(f"llm.{stage}"):
+        if on_token is not None:
+            response, shared = call_upstream(model, create), False
+        else:
+            response, shared = inflight.do(
+                canonical_key("completion", kwargs),
+                lambda: call_upstream(model, create),
+                stage,
+            )
+    if shared:
+        return response
+    usage = getattr(response, "usage", None)
+    record_llm_usage(stage, model, usage)
+    record_call(stage, model, usage)
+    if check is not None:
+        router.record_quality(stage, model, _passes(check, response))
+    return response
+
+
+def _collect_stream(stream, on_token):
+    """A streamed completion assembled into the shape of a regular response, passing each piece of content to `on_token`."""
+    if hasattr(stream, "choices"):
+        # Clients that don't stream (cassette replay) answer in one piece
+        on_token(stream.choices[0].message.content or "")
+        return stream
+    parts = []
+    usage = None
+    try:
+        for chunk in stream:
+            # With include_usage, the last chunk carries the usage and no choices
+            usage = getattr(chunk, "usage", None) or usage
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                parts.append(text)
+                on_token(text)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    message = SimpleNamespace(role="assistant", content="".join(parts))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+
+def _passes(check, response) -> bool:
+    try:
+        return bool(check(response.choices[0].message.content or ""))
+    except (ValueError, TypeError, AttributeError, LookupError):
+        return False
+
+
+# Quality checks for _complete: whether a stage's output is usable as it is
+def _is_json_object(content: str) -> bool:
+    return isinstance(json.loads(content), dict)
+
+
+def _is_recipe(content: str) -> bool:
+    recipe = json.loads(content)["recipe"]
+    return bool(recipe.get("ingredients")) and bool(recipe.get("steps"))
+
+
+def _is_yes_no(content: str) -> bool:
+    return content.strip().strip(".!").lower() in ("yes", "no")
+
+
+def _is_title(content: str) -> bool:
+    return 0 < len(content.split()) <= 8
+
+
+def _is_nonempty(content: str) -> bool:
+    return bool(content.strip())
+
+
+def _embed(stage: str, input):
+    """Create embeddings for a pipeline stage, recording its latency and token usage."""
+    with span(f"llm.{stage}"):
+        response, shared = inflight.do(
+            canonical_key("embedding", {"model": EMBEDDING_MODEL, "input": input}),
+            lambda: call_upstream(EMBEDDING_MODEL, lambda: get_client().embeddings.create(model=EMBEDDING_MODEL, input=input)),
+            stage,
+        )
+    if shared:
+        return response
+    usage = getattr(response, "usage", None)
+    record_llm_usage(stage, EMBEDDING_MODEL, usage)
+    record_call(stage, EMBEDDING_MODEL, usage)
+    return response
+
+
+@traced("lib.encode_image_to_data_uri")
 def encode_image_to_data_uri(path: str) -> str:
     with open(path, "rb") as f:
         b64 = base64.b64encode(f.read()).decode("utf-8")
         return f"data:image/jpeg;base64,{b64}"
 
 
-def generate_recipe_from_fridge(
+# Structured output shared by every recipe-generating prompt
+RECIPE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "recipe_response",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "recipe": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "ingredients": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                        },
+                        "steps": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                        },
+                    },
+                    "required": ["ingredients", "steps"],
+                }
+            },
+            "required": ["recipe"],
+        },
+    },
+}
+
+
+def format_recipe_examples(examples: list[dict] | None) -> str:
+    """Few-shot block listing similar past recipes the user rated highly."""
+    if not examples:
+        return ""
+    lines = [
+        f"- {example['recipe'].get('name') or 'Untitled'}: {', '.join(example['recipe'].get('ingredients', []))}"
+        for example in examples
+    ]
+    return (
+        "\nSimilar recipes this user rated highly before (use them as a guide to their taste, do not repeat them):\n"
+        + "\n".join(lines)
+        + "\n"
+    )
+
+
+def prompt_time() -> datetime.datetime:
+    """
+    The current time for prompts, to the minute. Finer precision would make every
+    prompt unique, defeating request coalescing and upstream prompt caching.
+    """
+    return datetime.datetime.now(zoneinfo.ZoneInfo("America/New_York")).replace(second=0, microsecond=0)
+
+
+# Word pieces the way GPT tokenizers split text: letter runs, digit groups of up to three, single symbols
+_TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d{1,3}|\S")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local estimate of a text's token count for prompt budgeting, without a
+    tokenizer download. Common words are one token and longer ones are
+    split every 8 characters, which errs slightly high for English prose.
+    """
+    return sum(1 + len(piece) // 8 for piece in _TOKEN_PIECES.findall(text))
+
+
+def format_memory(memory: str | None) -> str:
+    """Prompt block with the earlier turns of the conversation (see memory.py)."""
+    if not memory:
+        return ""
+    return f"\nEarlier in this conversation (oldest first):\n{memory}\n"
+
+
+def build_recipe_from_fridge_request(
     fridge_image_path: str,
     user_input: str,
     instructions: list[str],
     preferences: list[str],
     restrictions: list[str],
     situation: list[str],
-):
-    time = datetime.datetime.now().astimezone(zoneinfo.ZoneInfo("America/New_York"))
+    examples: list[dict] | None = None,
+    memory: str | None = None,
+) -> dict:
+    """
+    Build the chat completion arguments for a fridge-image recipe, so they can be
+    sent directly or written to a batch input file.
+    """
+    time = prompt_time()
 
+    # read the image file
     data_uri = encode_image_to_data_uri(fridge_image_path)
 
-    # read the image file
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    return {
+        "model": router.route("generate_recipe_from_fridge").model,
+        "messages": [
             {
                 "role": "system",
                 "content": [
@@ -56,14 +298,14 @@ def generate_recipe_from_fridge(
                         "type": "text",
                         "text": f"""
 Fridge contents image provided above.
-
+{format_memory(memory)}
 {user_input}
 
 Instructions: {", ".join(instructions)}
 Preferences: {", ".join(preferences)}
 Restrictions: {", ".join(restrictions)}
 Situation: {", ".join(situation)}
-
+{format_recipe_examples(examples)}
 Please propose a recipe that satisfies all constraints.
 Return the recipe as JSON with ingredients and steps. Do not include numbering, bullet points, or list markers in the steps - just provide plain text instructions.
 Return JSON only.
@@ -73,33 +315,29 @@ Return JSON only.
             },
         ],
         # enforce output structure
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "recipe_response",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "recipe": {
-                            "type": "object",
-                            "properties": {
-                                "name": {"type": "string"},
-                                "ingredients": {
-                                    "type": "array",
-                                    "items": {"type": "string"},
-                                },
-                                "steps": {
-                                    "type": "array",
-                                    "items": {"type": "string"},
-                                },
-                            },
-                            "required": ["ingredients", "steps"],
-                        }
-                    },
-                    "required": ["recipe"],
-                },
-            },
-        },
+        "response_format": RECIPE_RESPONSE_FORMAT,
+    }
+
+
+@traced("lib.generate_recipe_from_fridge")
+def generate_recipe_from_fridge(
+    fridge_image_path: str,
+    user_input: str,
+    instructions: list[str],
+    preferences: list[str],
+    restrictions: list[str],
+    situation: list[str],
+    examples: list[dict] | None = None,
+    memory: str | None = None,
+    on_token=None,
+):
+    response = _complete(
+        "generate_recipe_from_fridge",
+        check=_is_recipe,
+        on_token=on_token,
+        **build_recipe_from_fridge_request(
+            fridge_image_path, user_input, instructions, preferences, restrictions, situation, examples, memory
+        ),
     )
 
     if not response.choices[0].message.content:
@@ -108,6 +346,7 @@ Return JSON only.
     return json.loads(response.choices[0].message.content)
 
 
+@traced("lib.generate_conversation_title")
 def generate_conversation_title(user_message: str) -> str:
     """
     Generate a short title (3-5 words) for a conversation based on the first message.
@@ -115,8 +354,9 @@ def generate_conversation_title(user_message: str) -> str:
     if not user_message or len(user_message.strip()) < 3:
         return "New Chat"
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _complete(
+        "generate_conversation_title",
+        check=_is_title,
         messages=[
             {
                 "role": "system",
@@ -127,7 +367,6 @@ def generate_conversation_title(user_message: str) -> str:
                 "content": user_message
             }
         ],
-        max_tokens=15,
         temperature=0,
     )
     
@@ -135,12 +374,14 @@ def generate_conversation_title(user_message: str) -> str:
     return title[:50] if title else "New Chat"
 
 
+@traced("lib.detect_recipe_request")
 def detect_recipe_request(user_message: str) -> bool:
     """
     Use LLM to detect if the user is requesting a recipe, including implied requests.
     """
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _complete(
+        "detect_recipe_request",
+        check=_is_yes_no,
         messages=[
             {
                 "role": "system",
@@ -166,7 +407,6 @@ Is this a request for a recipe or meal suggestion? Answer only 'yes' or 'no'.
                 """
             }
         ],
-        max_tokens=10,
         temperature=0,
     )
     
@@ -174,21 +414,24 @@ Is this a request for a recipe or meal suggestion? Answer only 'yes' or 'no'.
     return answer.startswith("yes")
 
 
-def generate_recipe(
+def build_recipe_request(
     user_input: str,
     instructions: list[str],
     preferences: list[str],
     restrictions: list[str],
     situation: list[str],
-):
+    examples: list[dict] | None = None,
+    memory: str | None = None,
+) -> dict:
     """
-    Generate a recipe based on user input and preferences, without requiring a fridge image.
+    Build the chat completion arguments for a text-only recipe, so they can be
+    sent directly or written to a batch input file.
     """
-    time = datetime.datetime.now().astimezone(zoneinfo.ZoneInfo("America/New_York"))
+    time = prompt_time()
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    return {
+        "model": router.route("generate_recipe").model,
+        "messages": [
             {
                 "role": "system",
                 "content": [
@@ -197,14 +440,14 @@ def generate_recipe(
             },
             {
                 "role": "user",
-                "content": f"""
+                "content": f"""{format_memory(memory)}
 {user_input}
 
 Instructions: {", ".join(instructions) if instructions else "None"}
 Preferences: {", ".join(preferences) if preferences else "None"}
 Restrictions: {", ".join(restrictions) if restrictions else "None"}
 Situation: {", ".join(situation) if situation else "None"}
-
+{format_recipe_examples(examples)}
 Please propose a recipe that satisfies all constraints based on the user's request.
 Return the recipe as JSON with ingredients and steps. Do not include numbering, bullet points, or list markers in the steps - just provide plain text instructions.
 Return JSON only.
@@ -212,33 +455,32 @@ Return JSON only.
             },
         ],
         # enforce output structure
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "recipe_response",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "recipe": {
-                            "type": "object",
-                            "properties": {
-                                "name": {"type": "string"},
-                                "ingredients": {
-                                    "type": "array",
-                                    "items": {"type": "string"},
-                                },
-                                "steps": {
-                                    "type": "array",
-                                    "items": {"type": "string"},
-                                },
-                            },
-                            "required": ["ingredients", "steps"],
-                        }
-                    },
-                    "required": ["recipe"],
-                },
-            },
-        },
+        "response_format": RECIPE_RESPONSE_FORMAT,
+    }
+
+
+@traced("lib.generate_recipe")
+def generate_recipe(
+    user_input: str,
+    instructions: list[str],
+    preferences: list[str],
+    restrictions: list[str],
+    situation: list[str],
+    examples: list[dict] | None = None,
+    memory: str | None = None,
+    on_token=None,
+):
+    """
+    Generate a recipe based on user input and preferences, without requiring a fridge image.
+    `examples` are similar past recipes (see recipe_index.RecipeLibrary.similar) used as few-shot context,
+    and `memory` is the packed earlier turns of the conversation (see memory.load_memory).
+    `on_token` streams the generated JSON as it arrives (see _complete).
+    """
+    response = _complete(
+        "generate_recipe",
+        check=_is_recipe,
+        on_token=on_token,
+        **build_recipe_request(user_input, instructions, preferences, restrictions, situation, examples, memory),
     )
 
     if not response.choices[0].message.content:
@@ -247,17 +489,20 @@ Return JSON only.
     return json.loads(response.choices[0].message.content)
 
 
+@traced("lib.parse_new_user_information")
 def parse_new_user_information(
     user_message: str,
     instructions: list[str],
     preferences: list[str],
     restrictions: list[str],
     situation: list[str],
+    memory: str | None = None,
 ):
-    time = datetime.datetime.now().astimezone(zoneinfo.ZoneInfo("America/New_York"))
+    time = prompt_time()
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _complete(
+        "parse_new_user_information",
+        check=_is_json_object,
         messages=[
             {
                 "role": "system",
@@ -265,7 +510,7 @@ def parse_new_user_information(
             },
             {
                 "role": "user",
-                "content": f"""
+                "content": f"""{format_memory(memory)}
 User message:
 {user_message}
 
@@ -278,7 +523,7 @@ Situation: {situation}
 Extract ONLY the *new* information. If nothing new was said in a category,
 return an empty list for that category.
 
-Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS}.
+Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS_TEXT}.
 
 Return JSON only.
                 """,
@@ -319,9 +564,10 @@ Return JSON only.
     if not response.choices[0].message.content:
         return None
 
-    return json.loads(response.choices[0].message.content)
+    return _tag_critical(json.loads(response.choices[0].message.content))
 
 
+@traced("lib.parse_user_profile_information")
 def parse_user_profile_information(
     ability_description: str, restrictions_description: str, goal_description: str
 ):
@@ -337,7 +583,7 @@ Restrictions description:
 Goal description:
 {goal_description}
 
-Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS}.
+Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS_TEXT}.
 
 Return JSON only, following this schema:
 - long_term_instructions: list of assistant behaviors or meta instructions
@@ -346,8 +592,9 @@ Return JSON only, following this schema:
 - long_term_situation: list of persistent contextual factors (skills, tools, environment)
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _complete(
+        "parse_user_profile_information",
+        check=_is_json_object,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_message},
@@ -390,9 +637,10 @@ Return JSON only, following this schema:
     if not response.choices[0].message.content:
         return None
 
-    return json.loads(response.choices[0].message.content)
+    return _tag_critical(json.loads(response.choices[0].message.content))
 
 
+@traced("lib.compute_long_term_delta_with_llm")
 def compute_long_term_delta_with_llm(
     new_instructions,
     new_preferences,
@@ -420,7 +668,7 @@ Preferences: {new_preferences}
 Restrictions: {new_restrictions}
 Situation: {new_situation}
 
-Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS}.
+Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS_TEXT}.
 
 Return JSON ONLY with these keys:
 - new_long_term_instructions
@@ -429,8 +677,9 @@ Return JSON ONLY with these keys:
 - new_long_term_situation
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _complete(
+        "compute_long_term_delta_with_llm",
+        check=_is_json_object,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_message},
@@ -473,24 +722,126 @@ Return JSON ONLY with these keys:
     if not response.choices[0].message.content:
         return None
 
-    return json.loads(response.choices[0].message.content)
+    return _tag_critical(json.loads(response.choices[0].message.content))
 
 
-CRITICAL_KEYWORDS = {
-    "vegan",
-    "vegetarian",
-    "pescatarian",
-    "free",
-    "intolerant",
-    "allergy",
-    "allergic",
-}
+def critical_items(result: dict) -> list[str]:
+    """The critical items among all the list values of a parse/delta stage result."""
+    return [
+        item
+        for key, items in result.items()
+        if key != "critical_items" and isinstance(items, list)
+        for item in items
+        if isinstance(item, str) and is_critical(item)
+    ]
+
+
+def _tag_critical(result: dict | None) -> dict | None:
+    if result is not None:
+        result["critical_items"] = critical_items(result)
+    return result
+
+
+@traced("lib.summarize_conversation")
+def summarize_conversation(previous_summary: str | None, turns: list[str], max_tokens: int = 250) -> str:
+    """
+    Fold older conversation turns into the running summary, so they can leave the
+    verbatim window without being forgotten.
+    """
+    response = _complete(
+        "summarize_conversation",
+        check=_is_nonempty,
+        messages=[
+            {
+                "role": "system",
+                "content": "You maintain a running summary of a cooking conversation between a user and a chef assistant. Keep what matters for later turns: what the user asked for, recipes suggested and how the user reacted, ingredients on hand, and any plans. Be terse. Return only the summary.",
+            },
+            {
+                "role": "user",
+                "content": f"""
+Current summary:
+{previous_summary or "(none yet)"}
+
+Turns to add:
+{chr(10).join(turns)}
+
+Return the updated summary in at most {max_tokens * 3 // 4} words.
+                """,
+            },
+        ],
+        max_tokens=max_tokens,
+        temperature=0,
+    )
+    return (response.choices[0].message.content or "").strip()
 
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 
+@traced("lib.embed_query")
+def embed_query(text: str) -> np.ndarray:
+    """Embed a user message once so it can drive both profile and recipe retrieval."""
+    response = _embed("embed_query", text)
+    return np.array(response.data[0].embedding, dtype=np.float32)
+
+
+@traced("lib.embed_texts")
+def embed_texts(texts: list[str], embedding_store=None, stage: str = "embed_items") -> dict[str, bytes]:
+    """
+    Quantized embeddings for `texts`, keyed by text. Texts already in
+    `embedding_store` are not re-embedded; the rest are embedded in one call
+    and written back to the store.
+    """
+    unique = list(dict.fromkeys(texts))
+    if not unique:
+        return {}
+    blobs = embedding_store.get_many(EMBEDDING_MODEL, unique) if embedding_store else {}
+    missing = [text for text in unique if text not in blobs]
+    if missing:
+        resp = _embed(stage, missing)
+        vectors = {text: d.embedding for text, d in zip(missing, resp.data)}
+        if embedding_store:
+            blobs.update(embedding_store.put_many(EMBEDDING_MODEL, vectors))
+        else:
+            blobs.update({text: quantize(vector) for text, vector in vectors.items()})
+    return blobs
+
+
+def item_relevance(
+    user_input: str,
+    items: list[str],
+    retrieval: str = "embedding",
+    embedding_store=None,
+    query_embedding=None,
+    lexical_index=None,
+) -> np.ndarray:
+    """
+    Relevance of each item to the user input: embedding similarity, BM25
+    score, or a weighted mix of the two, for `retrieval` embedding, lexical
+    or hybrid (see lexical.py). `lexical_index` is a BM25Index holding the
+    items; one is built on the spot without it.
+    """
+    if retrieval != "lexical":
+        if query_embedding is None:
+            query_embedding = embed_query(user_input)
+        # Profile items rarely change, so their embeddings come from the store when possible
+        blobs = embed_texts(items, embedding_store, stage="embed_profile_items")
+        sims = EmbeddingMatrix.from_blobs([blobs[item] for item in items]).scores(query_embedding)
+        if retrieval == "embedding":
+            return sims
+    if lexical_index is None:
+        lexical_index = BM25Index()
+        for item in dict.fromkeys(items):
+            lexical_index.add(item, item)
+    scores = lexical_index.scores(user_input)
+    lexical_sims = np.array([scores.get(item, 0.0) for item in items], dtype=np.float32)
+    if retrieval == "lexical":
+        return lexical_sims
+    return (1 - LEXICAL_WEIGHT) * sims + LEXICAL_WEIGHT * lexical_sims
+
+
+@traced("lib.update_profile_with_similarity")
 def update_profile_with_similarity(
     user_input: str,
     long_term_instructions: list[str],
@@ -498,45 +849,116 @@ def update_profile_with_similarity(
     long_term_restrictions: list[str],
     long_term_situation: list[str],
     top_k: int = 5,
+    embedding_store=None,
+    query_embedding=None,
+    critical: set[str] | None = None,
+    retrieval: str = "embedding",
+    lexical_index=None,
 ):
-    query_emb_resp = client.embeddings.create(
-        model="text-embedding-3-small", input=user_input
-    )
-    query_embedding = np.array(query_emb_resp.data[0].embedding)
-
-    def embed_items(items):
-        if not items:
-            return []
-        resp = client.embeddings.create(model="text-embedding-3-small", input=items)
-        return [np.array(d.embedding) for d in resp.data]
-
-    instructions_emb = embed_items(long_term_instructions)
-    preferences_emb = embed_items(long_term_preferences)
-    restrictions_emb = embed_items(long_term_restrictions)
-    situation_emb = embed_items(long_term_situation)
+    """
+    Select the `top_k` profile items in each category most similar to the user
+    input, plus every critical item. `critical` is the set of items already
+    flagged as critical when they were stored; without it they are matched here.
+    `retrieval` and `lexical_index` are as for item_relevance.
+    """
+    items = list(dict.fromkeys(long_term_instructions + long_term_preferences + long_term_restrictions + long_term_situation))
+    relevance = dict(zip(items, item_relevance(user_input, items, retrieval, embedding_store, query_embedding, lexical_index))) if items else {}
 
-    def select_top(items, embeddings):
+    def select_top(items):
         if not items:
             return []
-        sims = [cosine_similarity(query_embedding, emb) for emb in embeddings]
+        sims = np.array([relevance[item] for item in items])
         top_indices = np.argsort(sims)[-top_k:][::-1]
-        selected = [items[i] for i in top_indices]
+        selected = list(dict.fromkeys(items[i] for i in top_indices))
 
-        selected_set = set(selected)
-        for item in items:
-            for keyword in CRITICAL_KEYWORDS:
-                if keyword.lower() in item.lower():
-                    selected_set.add(item)
-        return list(selected_set)
+        chosen = set(selected)
+        flagged = critical if critical is not None else {item for item in items if is_critical(item)}
+        selected.extend(item for item in dict.fromkeys(items) if item in flagged and item not in chosen)
+        return selected
 
     return {
-        "instructions": select_top(long_term_instructions, instructions_emb),
-        "preferences": select_top(long_term_preferences, preferences_emb),
-        "restrictions": select_top(long_term_restrictions, restrictions_emb),
-        "situation": select_top(long_term_situation, situation_emb),
+        "instructions": select_top(long_term_instructions),
+        "preferences": select_top(long_term_preferences),
+        "restrictions": select_top(long_term_restrictions),
+        "situation": select_top(long_term_situation),
     }
 
 
+PROFILE_CONTEXT_CATEGORIES = ("instructions", "preferences", "restrictions", "situation")
+
+
+@traced("lib.select_profile_context")
+def select_profile_context(
+    user_input: str,
+    long_term_instructions: list[str],
+    long_term_preferences: list[str],
+    long_term_restrictions: list[str],
+    long_term_situation: list[str],
+    budget_tokens: int = 200,
+    min_similarity: float = 0.2,
+    embedding_store=None,
+    query_embedding=None,
+    critical: set[str] | None = None,
+    baseline_top_k: int = 5,
+    retrieval: str = "embedding",
+    lexical_index=None,
+):
+    """
+    Pack the profile items most relevant to the user input into a token budget.
+
+    Items from all categories are ranked together by similarity. Critical items
+    are always included and their tokens are reserved first. The rest go in
+    best-first while they fit, skipping any below `min_similarity`. The result
+    has the same category keys as update_profile_with_similarity, plus "tokens":
+    the estimated tokens packed, what `baseline_top_k` per category plus the
+    critical items would have used, and the difference saved. `retrieval` and
+    `lexical_index` are as for item_relevance.
+    """
+    if query_embedding is None and retrieval != "lexical":
+        query_embedding = embed_query(user_input)
+
+    lists = dict(zip(PROFILE_CONTEXT_CATEGORIES, (long_term_instructions, long_term_preferences, long_term_restrictions, long_term_situation)))
+    candidates = [(category, item) for category, items in lists.items() for item in dict.fromkeys(items)]
+    selected = {category: [] for category in PROFILE_CONTEXT_CATEGORIES}
+    if not candidates:
+        return {**selected, "tokens": {"packed": 0, "baseline": 0, "saved": 0}}
+
+    sims = item_relevance(user_input, [item for _, item in candidates], retrieval, embedding_store, query_embedding, lexical_index)
+    # Each item costs its own tokens plus the ", " joining it to the list
+    costs = [estimate_tokens(item) + 1 for _, item in candidates]
+    flagged = critical if critical is not None else {item for _, item in candidates if is_critical(item)}
+
+    chosen = set()
+    used = 0
+    # Critical items first, whatever the budget: they are never dropped
+    for index, (category, item) in enumerate(candidates):
+        if item in flagged:
+            chosen.add(index)
+            used += costs[index]
+    for index in np.argsort(-sims, kind="stable"):
+        if index in chosen or sims[index] < min_similarity:
+            continue
+        if used + costs[index] <= budget_tokens:
+            chosen.add(index)
+            used += costs[index]
+
+    # Most similar first within each category, critical ones after, as before
+    for index in sorted(chosen, key=lambda i: (candidates[i][1] in flagged, -sims[i])):
+        category, item = candidates[index]
+        selected[category].append(item)
+
+    baseline = set()
+    for category in PROFILE_CONTEXT_CATEGORIES:
+        indices = [i for i, (c, _) in enumerate(candidates) if c == category]
+        baseline.update(sorted(indices, key=lambda i: -sims[i])[:baseline_top_k])
+        baseline.update(i for i in indices if candidates[i][1] in flagged)
+    baseline_tokens = sum(costs[i] for i in baseline)
+    CONTEXT_TOKENS.inc("packed", amount=used)
+    CONTEXT_TOKENS.inc("baseline", amount=baseline_tokens)
+    return {**selected, "tokens": {"packed": used, "baseline": baseline_tokens, "saved": baseline_tokens - used}}
+
+
+@traced("lib.update_long_term_from_feedback")
 def update_long_term_from_feedback(
     made_status: str,
     rating: int,
@@ -567,12 +989,13 @@ Current long-term data:
 Task:
 Based on this feedback, update the long-term preferences, restrictions, and situation conservatively.
 Only report newly discovered instructions.
-Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS}.
+Also, if a new requirement is critical, ensure that it contains the following keywords: {CRITICAL_KEYWORDS_TEXT}.
 Return JSON with keys: long_term_instructions, long_term_preferences, long_term_restrictions, long_term_situation.
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _complete(
+        "update_long_term_from_feedback",
+        check=_is_json_object,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_message},
@@ -615,4 +1038,4 @@ Return JSON with keys: long_term_instructions, long_term_preferences, long_term_
     if not response.choices[0].message.content:
         return None
 
-    return json.loads(response.choices[0].message.content)
+    return _tag_critical(json.loads(response.choices[0].message.content))
@@ -1,33 +1,94 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Request, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional, List
 import sqlite3
 import os
+import io
 import shutil
+import threading
 import uuid
 import json
+import re
 from lib import (
     generate_recipe_from_fridge,
     generate_recipe,
     detect_recipe_request,
+    embed_query,
     generate_conversation_title,
     parse_new_user_information,
     parse_user_profile_information,
     compute_long_term_delta_with_llm,
-    update_profile_with_similarity,
+    select_profile_context,
     update_long_term_from_feedback,
 )
+from metrics import CACHE_HITS, LEXICAL_FALLBACKS, PROFILE_CONFLICTS, REGISTRY, MetricsMiddleware, span, traced
+from accounting import UsageMiddleware, set_attribution
+from critical import is_critical
+from embeddings import EmbeddingStore, quantize
+from recipe_index import RecipeLibrary
+from lexical import RETRIEVAL, ProfileLexicon
+from migrations import migrate
+from fastjson import BOOL, RAW, JSONResponse, encode_rows, raw_json_response
+from static_files import CachedFile, PrecompressedStaticFiles, file_response, safe_join
+import thumbnails
+from memory import load_memory, refresh_summary
+from speculation import Speculation, should_speculate
+from admission import AdmissionMiddleware
+from chat_socket import ChatSocket, Progress, decode_image
+import transfer
+import archive
+import db_writer
+import routing
+from db_writer import Conflict
 
-DB_PATH = "database.db"
-UPLOAD_DIR = "uploads"
+DB_PATH = os.environ.get("CHEFING_DB_PATH", "database.db")
+UPLOAD_DIR = os.environ.get("CHEFING_UPLOAD_DIR", "uploads")
 USER_ID = "demo-user"  # Single user demonstrator
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Serve a stored recipe instead of generating one when a past request is at least this similar
+# (cosine similarity, e.g. 0.95). Unset disables the cache-hit path.
+_cache_similarity = os.environ.get("CHEFING_RECIPE_CACHE_MIN_SIMILARITY")
+RECIPE_CACHE_MIN_SIMILARITY = float(_cache_similarity) if _cache_similarity else None
+# Similar highly-rated past recipes passed to generation as few-shot examples
+RECIPE_EXAMPLES = int(os.environ.get("CHEFING_RECIPE_EXAMPLES", "2"))
+RECIPE_EXAMPLE_MIN_SIMILARITY = 0.4
+RECIPE_MIN_RATING = 7.0
+# Estimated prompt tokens for profile items, and the similarity below which an item is left out
+CONTEXT_TOKENS_BUDGET = int(os.environ.get("CHEFING_CONTEXT_TOKENS", "200"))
+CONTEXT_MIN_SIMILARITY = float(os.environ.get("CHEFING_CONTEXT_MIN_SIMILARITY", "0.2"))
 
-app = FastAPI(title="Chefing API", version="1.0.0")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker before it serves requests, instead of at import time
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    init_db()
+    # Optional periodic move of idle conversations into cold storage (see archive.py)
+    archiver = asyncio.create_task(archive.run_periodically(DB_PATH, archive.IDLE_DAYS)) if archive.IDLE_DAYS else None
+    yield
+    if archiver:
+        archiver.cancel()
+    for library in _recipe_libraries.values():
+        library.save()
+    thumbnails.shutdown()
+    db_writer.close_all()
+
+
+app = FastAPI(title="Chefing API", version="1.0.0", lifespan=lifespan, default_response_class=JSONResponse)
+
+# Per-user concurrency caps and load shedding (429) for the endpoints that call the LLM.
+# Added first so it sits inside CORS and metrics, and 429s get CORS headers and are counted.
+app.add_middleware(
+    AdmissionMiddleware,
+    paths={"/api/chat", "/api/profile", "/api/feedback"},
+    user_of=lambda scope: USER_ID,
+)
 
 # Allow CORS for local frontend dev
 app.add_middleware(
@@ -38,6 +99,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms and optional per-request timing logs
+app.add_middleware(MetricsMiddleware)
+
 
 # --- Pydantic Models ---
 class ProfileRequest(BaseModel):
@@ -54,114 +118,69 @@ class FeedbackRequest(BaseModel):
 
 
 # --- DB SETUP ---
+@traced("db.connect")
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_writer.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def init_db():
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Conversations table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS conversations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        title TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    
-    # Chat history table (now linked to conversations)
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS chat (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        conversation_id INTEGER NOT NULL,
-        user_id TEXT NOT NULL,
-        message TEXT NOT NULL,
-        response TEXT NOT NULL,
-        has_image BOOLEAN DEFAULT 0,
-        image_path TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
-    )
-    """)
-    
-    # Add conversation_id column if it doesn't exist (migration)
-    try:
-        # Check if column exists
-        c.execute("PRAGMA table_info(chat)")
-        columns = [row[1] for row in c.fetchall()]
-        if 'conversation_id' not in columns:
-            c.execute("ALTER TABLE chat ADD COLUMN conversation_id INTEGER")
-            # Migrate existing messages to a default conversation
-            c.execute("""
-                INSERT INTO conversations (user_id, title, created_at, updated_at)
-                SELECT DISTINCT user_id, 'Chat 1', MIN(created_at), MAX(created_at)
-                FROM chat
-                WHERE conversation_id IS NULL
-                GROUP BY user_id
-            """)
-            c.execute("""
-                UPDATE chat 
-                SET conversation_id = (SELECT id FROM conversations WHERE user_id = chat.user_id LIMIT 1)
-                WHERE conversation_id IS NULL
-            """)
-    except sqlite3.OperationalError:
-        pass  # Column already exists or migration failed
-    
-    # User profile table (long-term data)
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS user_profile (
-        user_id TEXT PRIMARY KEY,
-        long_term_instructions TEXT DEFAULT '[]',
-        long_term_preferences TEXT DEFAULT '[]',
-        long_term_restrictions TEXT DEFAULT '[]',
-        long_term_situation TEXT DEFAULT '[]',
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    
-    # Recipe feedback table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS recipe_feedback (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        recipe_name TEXT,
-        recipe_data TEXT,
-        made_status TEXT,
-        rating INTEGER,
-        comments TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+PROFILE_CATEGORIES = (
+    "long_term_instructions",
+    "long_term_preferences",
+    "long_term_restrictions",
+    "long_term_situation",
+)
+
+
+def _write_profile_items(c, user_id: str, profile: dict, critical: Optional[set[str]] = None):
+    """
+    Replace a user's rows in profile_items. An item already stored keeps its
+    critical flag; a new one is critical if it is in `critical` (tagged by the
+    stage that produced it) or, with no tags given, if is_critical() says so.
+    """
+    c.execute("SELECT category, item, critical FROM profile_items WHERE user_id = ?", (user_id,))
+    stored = {(category, item): flag for category, item, flag in c.fetchall()}
+    c.execute("DELETE FROM profile_items WHERE user_id = ?", (user_id,))
+    rows = []
+    for category in PROFILE_CATEGORIES:
+        for position, item in enumerate(profile[category]):
+            flag = stored.get((category, item))
+            if flag is None:
+                flag = 1 if (item in critical if critical is not None else is_critical(item)) else 0
+            rows.append((user_id, category, position, item, flag))
+    c.executemany(
+        "INSERT INTO profile_items (user_id, category, position, item, critical) VALUES (?, ?, ?, ?, ?)",
+        rows,
     )
-    """)
-    
-    conn.commit()
-    conn.close()
 
 
-init_db()
+def _take_critical(result: dict) -> set[str]:
+    """Remove the "critical_items" tags a lib stage added to its result, returning them."""
+    return set(result.pop("critical_items", []))
+
+
+@traced("db.init_db")
+def init_db():
+    """Bring the database schema up to date (see migrations.py)."""
+    migrate(DB_PATH)
+    db_writer.enable_wal(DB_PATH)
+
+
+def write(fn):
+    """Run `fn(conn)` through this process's single writer (see db_writer.py); returns its result."""
+    return db_writer.write(DB_PATH, fn)
 
 
 # --- Helper Functions ---
-def get_user_profile(user_id: str = USER_ID) -> dict:
-    """Get user profile from database, return default if not exists."""
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM user_profile WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    
+def _profile_from_row(row) -> tuple[dict, int]:
     if row:
         return {
             "long_term_instructions": json.loads(row["long_term_instructions"]),
             "long_term_preferences": json.loads(row["long_term_preferences"]),
             "long_term_restrictions": json.loads(row["long_term_restrictions"]),
             "long_term_situation": json.loads(row["long_term_situation"]),
-        }
+        }, row["version"]
     else:
         # Return empty profile
         return {
@@ -169,36 +188,221 @@ def get_user_profile(user_id: str = USER_ID) -> dict:
             "long_term_preferences": [],
             "long_term_restrictions": [],
             "long_term_situation": [],
-        }
+        }, 0
 
 
-def update_user_profile(
-    user_id: str,
-    long_term_instructions: List[str],
-    long_term_preferences: List[str],
-    long_term_restrictions: List[str],
-    long_term_situation: List[str],
-):
-    """Update or create user profile in database."""
+@traced("db.get_user_profile")
+def load_user_profile(user_id: str = USER_ID) -> tuple[dict, int]:
+    """User profile and its version (0 if it doesn't exist yet, with an empty profile)."""
     conn = get_db()
     c = conn.cursor()
+    c.execute("SELECT * FROM user_profile WHERE user_id = ?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return _profile_from_row(row)
+
+
+def get_user_profile(user_id: str = USER_ID) -> dict:
+    """Get user profile from database, return default if not exists."""
+    return load_user_profile(user_id)[0]
+
+
+def _store_profile(c, user_id: str, profile: dict, expected_version: Optional[int], critical: Optional[set[str]] = None) -> int:
+    """Write the profile and its items, bumping its version; see update_user_profile."""
     c.execute(
         """
-        INSERT OR REPLACE INTO user_profile 
-        (user_id, long_term_instructions, long_term_preferences, 
-         long_term_restrictions, long_term_situation, updated_at)
-        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        INSERT INTO user_profile
+        (user_id, long_term_instructions, long_term_preferences,
+         long_term_restrictions, long_term_situation, updated_at, version)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 1)
+        ON CONFLICT (user_id) DO UPDATE SET
+            long_term_instructions = excluded.long_term_instructions,
+            long_term_preferences = excluded.long_term_preferences,
+            long_term_restrictions = excluded.long_term_restrictions,
+            long_term_situation = excluded.long_term_situation,
+            updated_at = excluded.updated_at,
+            version = user_profile.version + 1
+        WHERE ? IS NULL OR user_profile.version = ?
         """,
         (
             user_id,
-            json.dumps(long_term_instructions),
-            json.dumps(long_term_preferences),
-            json.dumps(long_term_restrictions),
-            json.dumps(long_term_situation),
+            json.dumps(profile["long_term_instructions"]),
+            json.dumps(profile["long_term_preferences"]),
+            json.dumps(profile["long_term_restrictions"]),
+            json.dumps(profile["long_term_situation"]),
+            expected_version,
+            expected_version,
         ),
     )
-    conn.commit()
+    if c.rowcount == 0:
+        raise Conflict(f"profile of {user_id} changed since version {expected_version}")
+    _write_profile_items(c, user_id, profile, critical)
+    c.execute("SELECT version FROM user_profile WHERE user_id = ?", (user_id,))
+    return c.fetchone()[0]
+
+
+@traced("db.update_user_profile")
+def update_user_profile(
+    user_id: str,
+    long_term_instructions: List[str],
+    long_term_preferences: List[str],
+    long_term_restrictions: List[str],
+    long_term_situation: List[str],
+    expected_version: Optional[int] = None,
+    critical: Optional[set[str]] = None,
+) -> int:
+    """
+    Update or create user profile in database, returning its new version.
+    With `expected_version`, only if the profile is still at that version
+    (0: doesn't exist yet); raises Conflict otherwise. `critical` tags new
+    items, see _write_profile_items.
+    """
+    profile = {
+        "long_term_instructions": long_term_instructions,
+        "long_term_preferences": long_term_preferences,
+        "long_term_restrictions": long_term_restrictions,
+        "long_term_situation": long_term_situation,
+    }
+    version = write(lambda conn: _store_profile(conn.cursor(), user_id, profile, expected_version, critical))
+    if RETRIEVAL != "embedding":
+        profile_index(user_id, profile)
+    return version
+
+
+@traced("db.merge_user_profile")
+def merge_user_profile(user_id: str, additions: dict, read_version: int, critical: Optional[set[str]] = None) -> dict:
+    """
+    Append `additions` (category -> new items) to the user's profile, skipping
+    items it already has, and return the merged profile. The caller read the
+    profile at `read_version`; if another request has changed it since, the
+    additions are applied on top of that change instead of overwriting it.
+    Runs inside the writer's transaction, so the compare-and-swap cannot fail.
+    `critical` tags the additions, see _write_profile_items.
+    """
+    def merge(conn):
+        c = conn.cursor()
+        c.execute("SELECT * FROM user_profile WHERE user_id = ?", (user_id,))
+        profile, version = _profile_from_row(c.fetchone())
+        if version != read_version:
+            PROFILE_CONFLICTS.inc()
+        merged = {
+            category: profile[category] + [item for item in additions.get(category, []) if item not in profile[category]]
+            for category in PROFILE_CATEGORIES
+        }
+        _store_profile(c, user_id, merged, version, critical)
+        return merged
+
+    merged = write(merge)
+    if RETRIEVAL != "embedding":
+        profile_index(user_id, merged)
+    return merged
+
+
+# BM25 indexes of profile items for lexical retrieval, per database and user
+profile_lexicon = ProfileLexicon()
+
+
+def profile_index(user_id: str, profile: dict):
+    """The user's profile items in a BM25 index (see lexical.py), brought in line with `profile`."""
+    return profile_lexicon.sync((DB_PATH, user_id), [item for category in PROFILE_CATEGORIES for item in profile[category]])
+
+
+@traced("db.get_critical_items")
+def get_critical_items(user_id: str = USER_ID) -> set[str]:
+    """Profile items flagged as critical, which are always included in the prompt context."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT item FROM profile_items WHERE user_id = ? AND critical = 1", (user_id,))
+    items = {row["item"] for row in c.fetchall()}
     conn.close()
+    return items
+
+
+@traced("db.save_usage_events")
+def save_usage_events(context):
+    """Store the LLM usage collected during one request and roll it up by day."""
+    rows = [
+        (
+            event.created_at,
+            context.endpoint,
+            event.stage,
+            event.model,
+            context.user_id,
+            context.conversation_id,
+            event.prompt_tokens,
+            event.completion_tokens,
+            event.cached_tokens,
+            event.cost_nano_usd,
+        )
+        for event in context.events
+    ]
+
+    def store(conn):
+        c = conn.cursor()
+        c.executemany(
+            """
+            INSERT INTO llm_usage
+            (created_at, endpoint, stage, model, user_id, conversation_id,
+             prompt_tokens, completion_tokens, cached_tokens, cost_nano_usd)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        c.executemany(
+            """
+            INSERT INTO llm_usage_daily
+            (day, user_id, endpoint, stage, model, calls,
+             prompt_tokens, completion_tokens, cached_tokens, cost_nano_usd)
+            VALUES (date(?, 'unixepoch'), ?, ?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (day, user_id, endpoint, stage, model) DO UPDATE SET
+                calls = calls + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                cached_tokens = cached_tokens + excluded.cached_tokens,
+                cost_nano_usd = cost_nano_usd + excluded.cost_nano_usd
+            """,
+            [
+                (created_at, user_id or "", endpoint or "", stage, model, prompt, completion, cached, cost)
+                for created_at, endpoint, stage, model, user_id, _, prompt, completion, cached, cost in rows
+            ],
+        )
+
+    write(store)
+
+
+_recipe_libraries: dict[str, RecipeLibrary] = {}
+_recipe_libraries_lock = threading.Lock()
+
+
+def get_recipe_library() -> RecipeLibrary:
+    """The recipe library for DB_PATH, loading its ANN index on first use."""
+    library = _recipe_libraries.get(DB_PATH)
+    if library is None:
+        with _recipe_libraries_lock:
+            # Another thread may have loaded it while this one waited
+            library = _recipe_libraries.get(DB_PATH)
+            if library is None:
+                with span("recipe_index.load"):
+                    library = _recipe_libraries[DB_PATH] = RecipeLibrary(DB_PATH, lexical=RETRIEVAL != "embedding")
+    return library
+
+
+@traced("db.save_recipe")
+def save_recipe(user_id: str, request: str, recipe: dict, query_embedding):
+    """Store a generated recipe and add it to the library index. `query_embedding` is None with lexical retrieval."""
+    write(lambda conn: conn.execute(
+        """
+        INSERT INTO recipes (user_id, name, request, recipe_data, embedding)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (user_id, recipe.get("name"), request, json.dumps(recipe), quantize(query_embedding) if query_embedding is not None else None),
+    ))
+    # Picks up this row plus any added by other workers since the last sync
+    get_recipe_library().sync()
+
+
+# LLM usage accounting; events are written after each response is sent
+app.add_middleware(UsageMiddleware, sink=save_usage_events)
 
 
 # --- API ENDPOINTS ---
@@ -206,22 +410,25 @@ def update_user_profile(
 # Define static directory path
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 
+# index.html is kept in memory (with its precompressed variants) rather than read per request
+index_html = CachedFile(os.path.join(static_dir, "index.html"), "text/html; charset=utf-8")
+
 # Root route - serve frontend if available, otherwise return API info
 @app.get("/")
-async def root():
-    if os.path.exists(static_dir):
-        index_path = os.path.join(static_dir, "index.html")
-        if os.path.exists(index_path):
-            return FileResponse(index_path)
+async def root(request: Request):
+    response = index_html.response(request.headers)
+    if response is not None:
+        return response
     return {"message": "Chefing API", "version": "1.0.0"}
 
 
 @app.post("/api/profile")
-async def create_or_update_profile(profile: ProfileRequest):
+def create_or_update_profile(profile: ProfileRequest):
     """
     Initialize or update user profile from form data.
     This parses the user's ability, restrictions, and goals into structured long-term data.
     """
+    set_attribution(user_id=USER_ID)
     try:
         # Parse profile information
         parsed = parse_user_profile_information(
@@ -240,21 +447,24 @@ async def create_or_update_profile(profile: ProfileRequest):
             parsed["long_term_preferences"],
             parsed["long_term_restrictions"],
             parsed["long_term_situation"],
+            critical=_take_critical(parsed),
         )
         
         return JSONResponse({
             "success": True,
             "profile": parsed,
         })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/profile")
 def get_profile():
-    """Get current user profile (long-term data)."""
-    profile = get_user_profile(USER_ID)
-    return JSONResponse(profile)
+    """Get current user profile (long-term data), with the version to send back with an edit."""
+    profile, version = load_user_profile(USER_ID)
+    return JSONResponse({**profile, "version": version})
 
 
 class ProfileUpdate(BaseModel):
@@ -263,21 +473,26 @@ class ProfileUpdate(BaseModel):
     long_term_preferences: List[str]
     long_term_restrictions: List[str]
     long_term_situation: List[str]
+    # The version the edit started from (GET /api/profile); without it the update is unconditional
+    version: Optional[int] = None
 
 
 @app.put("/api/profile")
 def update_profile_directly(profile_update: ProfileUpdate):
     """
     Directly update user profile with provided data.
-    This allows users to edit their profile manually.
+    This allows users to edit their profile manually. With a `version`, the
+    update is refused with 409 if the profile has changed since that version
+    was read, instead of overwriting what chat or feedback learned meanwhile.
     """
     try:
-        update_user_profile(
+        version = update_user_profile(
             USER_ID,
             profile_update.long_term_instructions,
             profile_update.long_term_preferences,
             profile_update.long_term_restrictions,
             profile_update.long_term_situation,
+            expected_version=profile_update.version,
         )
         
         return JSONResponse({
@@ -287,134 +502,235 @@ def update_profile_directly(profile_update: ProfileUpdate):
                 "long_term_preferences": profile_update.long_term_preferences,
                 "long_term_restrictions": profile_update.long_term_restrictions,
                 "long_term_situation": profile_update.long_term_situation,
+                "version": version,
             }
         })
+    except Conflict:
+        raise HTTPException(status_code=409, detail="Profile changed since it was read; reload it and try again")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/chat")
-async def chat(
-    user_message: str = Form(...),
-    fridge_image: Optional[UploadFile] = File(None),
-    conversation_id: Optional[str] = Form(None),
-):
+def save_fridge_image(source, ext: str) -> str:
+    """Store an uploaded fridge photo (a file object) and start making its thumbnails."""
+    image_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{ext or '.jpg'}")
+    with open(image_path, "wb") as f:
+        shutil.copyfileobj(source, f)
+    # Thumbnails for the history view, made while the recipe is generated
+    thumbnails.submit(image_path)
+    return image_path
+
+
+def run_chat_turn(
+    user_message: str,
+    conversation_id: Optional[str],
+    image_path: Optional[str],
+    defer,
+    progress: Progress = Progress(),
+) -> tuple[dict, int]:
     """
-    Main chat endpoint. Handles recipe generation and information parsing.
+    One chat turn, shared by POST /api/chat and /ws/chat: returns the response body
+    and the conversation id. `defer(fn, *args)` schedules work for after the reply,
+    and `progress` hears about each stage as it finishes (see chat_socket.py).
+    """
+    # Get current user profile, and its version for merging updates into it
+    profile, profile_version = load_user_profile(USER_ID)
     
-    - If fridge_image is provided: generates a recipe based on fridge contents
-    - If no image but recipe requested: generates a recipe based on preferences
-    - Otherwise: parses new information from user message
+    # Summary and recent turns of the conversation, within a fixed token budget;
+    # an archived conversation is moved back into the chat table first
+    try:
+        if conversation_id:
+            archive.restore_if_archived(DB_PATH, int(conversation_id))
+        memory = load_memory(DB_PATH, int(conversation_id), USER_ID) if conversation_id else ""
+    except ValueError:
+        memory = ""
     
-    Automatically retrieves relevant long-term data using embeddings.
-    Updates long-term profile if new persistent information is detected.
-    Creates a new conversation if conversation_id is not provided.
-    """
+    # Embed the message once for both profile and recipe retrieval (lexical retrieval needs no embedding)
+    retrieval = RETRIEVAL
+    query_embedding = None
+    if retrieval != "lexical":
+        try:
+            query_embedding = embed_query(user_message)
+        except Exception:
+            if retrieval != "hybrid":
+                raise
+            # Rank by shared words alone rather than fail the request
+            LEXICAL_FALLBACKS.inc()
+            retrieval = "lexical"
+    
+    # Pack the most relevant profile items (and every critical one) into the context budget
+    relevant_context = select_profile_context(
+        user_message,
+        profile["long_term_instructions"],
+        profile["long_term_preferences"],
+        profile["long_term_restrictions"],
+        profile["long_term_situation"],
+        budget_tokens=CONTEXT_TOKENS_BUDGET,
+        min_similarity=CONTEXT_MIN_SIMILARITY,
+        embedding_store=EmbeddingStore(DB_PATH),
+        query_embedding=query_embedding,
+        critical=get_critical_items(USER_ID),
+        retrieval=retrieval,
+        lexical_index=profile_index(USER_ID, profile) if retrieval != "embedding" else None,
+    )
+    progress.emit(
+        "context",
+        retrieval=retrieval,
+        items={category: len(relevant_context[category]) for category in ("instructions", "preferences", "restrictions", "situation")},
+        tokens=relevant_context["tokens"]["packed"],
+    )
+    progress.check()
+    
+    # Similar past recipes the user liked, as a cache hit or as few-shot examples
+    def find_similar_recipes():
+        library = get_recipe_library()
+        if RECIPE_CACHE_MIN_SIMILARITY is not None and not image_path and query_embedding is not None:
+            hits = library.similar(query_embedding, USER_ID, k=1, min_rating=RECIPE_MIN_RATING, min_similarity=RECIPE_CACHE_MIN_SIMILARITY)
+            if hits:
+                return hits[0], []
+        if RECIPE_EXAMPLES:
+            return None, library.similar(
+                query_embedding,
+                USER_ID,
+                k=RECIPE_EXAMPLES,
+                min_rating=RECIPE_MIN_RATING,
+                min_similarity=RECIPE_EXAMPLE_MIN_SIMILARITY,
+                query_text=user_message,
+                retrieval=retrieval,
+            )
+        return None, []
+    
+    examples = []
+    cached = None
+    looked_up = False
+    # Optionally start generating the recipe while intent detection runs (see speculation.py)
+    speculation = None
+    if not image_path and should_speculate(user_message):
+        cached, examples = find_similar_recipes()
+        looked_up = True
+        if not cached:
+            speculation = Speculation(
+                generate_recipe,
+                user_message,
+                relevant_context["instructions"],
+                relevant_context["preferences"],
+                relevant_context["restrictions"],
+                relevant_context["situation"],
+                examples,
+                memory,
+            )
+    
+    # Check if user is requesting a recipe (using LLM to detect implied requests)
     try:
-        # Get current user profile
-        profile = get_user_profile(USER_ID)
+        is_recipe_request = detect_recipe_request(user_message)
+        progress.emit("intent", recipe=is_recipe_request)
+        progress.check()
+    except Exception:
+        if speculation:
+            speculation.discard()
+        raise
+    if speculation and not is_recipe_request:
+        speculation.discard()
+        speculation = None
+    
+    if (image_path or is_recipe_request) and not looked_up:
+        cached, examples = find_similar_recipes()
+    
+    # Process based on whether image is provided or recipe is requested
+    if cached:
+        CACHE_HITS.inc("recipe_library")
+        progress.emit("generation", source="cache")
+        response_data = {"recipe": cached["recipe"], "library_recipe_id": cached["id"]}
+    elif image_path:
+        # Generate recipe from fridge
+        progress.emit("generation", source="model")
+        result = generate_recipe_from_fridge(
+            image_path,
+            user_message,
+            relevant_context["instructions"],
+            relevant_context["preferences"],
+            relevant_context["restrictions"],
+            relevant_context["situation"],
+            examples,
+            memory,
+            on_token=progress.on_token,
+        )
+        
+        if not result:
+            raise HTTPException(status_code=500, detail="Failed to generate recipe")
         
-        # Retrieve relevant context using embeddings
-        relevant_context = update_profile_with_similarity(
+        response_data = result
+        defer(save_recipe, USER_ID, user_message, result.get("recipe", result), query_embedding)
+    elif is_recipe_request:
+        # Generate recipe without image, unless it was already started speculatively
+        progress.emit("generation", source="speculation" if speculation else "model")
+        result = speculation.result(on_token=progress.on_token) if speculation else generate_recipe(
             user_message,
+            relevant_context["instructions"],
+            relevant_context["preferences"],
+            relevant_context["restrictions"],
+            relevant_context["situation"],
+            examples,
+            memory,
+            on_token=progress.on_token,
+        )
+        
+        if not result:
+            raise HTTPException(status_code=500, detail="Failed to generate recipe")
+        
+        response_data = result
+        defer(save_recipe, USER_ID, user_message, result.get("recipe", result), query_embedding)
+    else:
+        # Parse new information from user message
+        parsed = parse_new_user_information(
+            user_message,
+            relevant_context["instructions"],
+            relevant_context["preferences"],
+            relevant_context["restrictions"],
+            relevant_context["situation"],
+            memory,
+        )
+        
+        if not parsed:
+            raise HTTPException(status_code=500, detail="Failed to parse user information")
+        _take_critical(parsed)
+        
+        # Determine which new info should be long-term
+        delta = compute_long_term_delta_with_llm(
+            parsed["new_instructions"],
+            parsed["new_preferences"],
+            parsed["new_restrictions"],
+            parsed["new_situation"],
             profile["long_term_instructions"],
             profile["long_term_preferences"],
             profile["long_term_restrictions"],
             profile["long_term_situation"],
-            top_k=5,
         )
+        progress.check()
         
-        # Save image if provided
-        image_path = None
-        if fridge_image:
-            ext = os.path.splitext(fridge_image.filename)[-1] or ".jpg"
-            image_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{ext}")
-            with open(image_path, "wb") as f:
-                shutil.copyfileobj(fridge_image.file, f)
-        
-        # Check if user is requesting a recipe (using LLM to detect implied requests)
-        is_recipe_request = detect_recipe_request(user_message)
-        
-        # Process based on whether image is provided or recipe is requested
-        if image_path:
-            # Generate recipe from fridge
-            result = generate_recipe_from_fridge(
-                image_path,
-                user_message,
-                relevant_context["instructions"],
-                relevant_context["preferences"],
-                relevant_context["restrictions"],
-                relevant_context["situation"],
-            )
-            
-            if not result:
-                raise HTTPException(status_code=500, detail="Failed to generate recipe")
-            
-            response_data = result
-        elif is_recipe_request:
-            # Generate recipe without image
-            result = generate_recipe(
-                user_message,
-                relevant_context["instructions"],
-                relevant_context["preferences"],
-                relevant_context["restrictions"],
-                relevant_context["situation"],
-            )
-            
-            if not result:
-                raise HTTPException(status_code=500, detail="Failed to generate recipe")
-            
-            response_data = result
-        else:
-            # Parse new information from user message
-            parsed = parse_new_user_information(
-                user_message,
-                relevant_context["instructions"],
-                relevant_context["preferences"],
-                relevant_context["restrictions"],
-                relevant_context["situation"],
-            )
-            
-            if not parsed:
-                raise HTTPException(status_code=500, detail="Failed to parse user information")
-            
-            # Determine which new info should be long-term
-            delta = compute_long_term_delta_with_llm(
-                parsed["new_instructions"],
-                parsed["new_preferences"],
-                parsed["new_restrictions"],
-                parsed["new_situation"],
-                profile["long_term_instructions"],
-                profile["long_term_preferences"],
-                profile["long_term_restrictions"],
-                profile["long_term_situation"],
+        if delta:
+            critical = _take_critical(delta)
+            # Update long-term profile, on top of any change made since it was read
+            merge_user_profile(
+                USER_ID,
+                {category: delta.get(f"new_{category}", []) for category in PROFILE_CATEGORIES},
+                profile_version,
+                critical,
             )
-            
-            if delta:
-                # Update long-term profile
-                new_instructions = profile["long_term_instructions"] + delta.get("new_long_term_instructions", [])
-                new_preferences = profile["long_term_preferences"] + delta.get("new_long_term_preferences", [])
-                new_restrictions = profile["long_term_restrictions"] + delta.get("new_long_term_restrictions", [])
-                new_situation = profile["long_term_situation"] + delta.get("new_long_term_situation", [])
-                
-                update_user_profile(
-                    USER_ID,
-                    new_instructions,
-                    new_preferences,
-                    new_restrictions,
-                    new_situation,
-                )
-            
-            response_data = {
-                "parsed_info": parsed,
-                "long_term_updates": delta if delta else {},
-            }
-        
-        # Get or create conversation
-        conn = get_db()
-        c = conn.cursor()
+        progress.emit("profile", updates=delta if delta else {})
         
-        conv_id = None
+        response_data = {
+            "parsed_info": parsed,
+            "long_term_updates": delta if delta else {},
+        }
+    
+    # Get or create conversation
+    conn = get_db()
+    c = conn.cursor()
+
+    conv_id = None
+    needs_title = False
+    with span("db.resolve_conversation"):
         if conversation_id:
             try:
                 conv_id = int(conversation_id)
@@ -424,10 +740,34 @@ async def chat(
                     raise HTTPException(status_code=404, detail="Conversation not found")
             except (ValueError, TypeError):
                 conv_id = None
-        
-        if not conv_id:
-            # Create new conversation with LLM-generated title
-            title = generate_conversation_title(user_message)
+
+        if conv_id:
+            # Check if this is the first message and title needs to be generated
+            c.execute(
+                "SELECT title, (SELECT COUNT(*) FROM chat WHERE conversation_id = ?) as msg_count FROM conversations WHERE id = ?",
+                (conv_id, conv_id)
+            )
+            row = c.fetchone()
+            needs_title = bool(row and row[1] == 0 and (not row[0] or row[0] == "New Chat"))
+        else:
+            # New conversation - always gets an LLM-generated title
+            needs_title = True
+    conn.close()
+
+    # Title generation happens outside the DB spans so they only time SQLite
+    title = generate_conversation_title(user_message) if needs_title else None
+    if title:
+        progress.emit("title", title=title)
+    # Last chance to cancel: once stored, the turn is part of the conversation
+    progress.check()
+
+    def store_turn(conn):
+        c = conn.cursor()
+        turn_conv_id = conv_id
+        if turn_conv_id:
+            # In case the archive job took the conversation since it was restored above
+            archive.restore(conn, turn_conv_id)
+        if not turn_conv_id:
             c.execute(
                 """
                 INSERT INTO conversations (user_id, title, updated_at)
@@ -435,28 +775,20 @@ async def chat(
                 """,
                 (USER_ID, title),
             )
-            conv_id = c.lastrowid
-        
-        # Check if this is the first message and title needs to be generated
-        c.execute(
-            "SELECT title, (SELECT COUNT(*) FROM chat WHERE conversation_id = ?) as msg_count FROM conversations WHERE id = ?",
-            (conv_id, conv_id)
-        )
-        row = c.fetchone()
-        if row and row[1] == 0 and (not row[0] or row[0] == "New Chat"):
-            # First message - generate a proper title
-            new_title = generate_conversation_title(user_message)
+            turn_conv_id = c.lastrowid
+        elif title:
+            # First message - store the generated title
             c.execute(
                 "UPDATE conversations SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (new_title, conv_id)
+                (title, turn_conv_id)
             )
         else:
             # Just update the timestamp
             c.execute(
                 "UPDATE conversations SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (conv_id,)
+                (turn_conv_id,)
             )
-        
+
         # Store chat message in database
         c.execute(
             """
@@ -464,7 +796,7 @@ async def chat(
             VALUES (?, ?, ?, ?, ?, ?)
             """,
             (
-                conv_id,
+                turn_conv_id,
                 USER_ID,
                 user_message,
                 json.dumps(response_data),
@@ -472,9 +804,44 @@ async def chat(
                 image_path,
             ),
         )
-        conn.commit()
-        conn.close()
-        
+        return turn_conv_id
+
+    with span("db.store_chat_turn"):
+        conv_id = write(store_turn)
+    set_attribution(conversation_id=conv_id)
+    # Fold turns leaving the memory window into the summary, after the reply is sent
+    defer(refresh_summary, DB_PATH, conv_id)
+    return response_data, conv_id
+
+
+@app.post("/api/chat")
+def chat(
+    background_tasks: BackgroundTasks,
+    user_message: str = Form(...),
+    fridge_image: Optional[UploadFile] = File(None),
+    conversation_id: Optional[str] = Form(None),
+):
+    """
+    Main chat endpoint. Handles recipe generation and information parsing.
+    
+    - If fridge_image is provided: generates a recipe based on fridge contents
+    - If no image but recipe requested: generates a recipe based on preferences
+    - Otherwise: parses new information from user message
+    
+    Automatically retrieves relevant long-term data by embedding similarity,
+    BM25 or both (CHEFING_RETRIEVAL, see lexical.py).
+    Similar highly-rated past recipes are used as examples, or returned directly
+    when CHEFING_RECIPE_CACHE_MIN_SIMILARITY is set and a close enough one exists.
+    Updates long-term profile if new persistent information is detected.
+    Creates a new conversation if conversation_id is not provided.
+    /ws/chat runs the same turn over a WebSocket, with progress events.
+    """
+    set_attribution(user_id=USER_ID)
+    try:
+        image_path = None
+        if fridge_image:
+            image_path = save_fridge_image(fridge_image.file, os.path.splitext(fridge_image.filename)[-1])
+        response_data, _ = run_chat_turn(user_message, conversation_id, image_path, background_tasks.add_task)
         return JSONResponse(response_data)
         
     except HTTPException:
@@ -483,15 +850,41 @@ async def chat(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def run_socket_turn(turn) -> dict:
+    """One message on /ws/chat (see chat_socket.py), through the same pipeline as POST /api/chat."""
+    message = turn.message
+    set_attribution(user_id=USER_ID)
+    image_path = None
+    if message.get("image"):
+        content, ext = decode_image(message["image"])
+        image_path = save_fridge_image(io.BytesIO(content), ext)
+    conversation_id = message.get("conversation_id")
+    response_data, conv_id = run_chat_turn(
+        message["text"],
+        str(conversation_id) if conversation_id else None,
+        image_path,
+        turn.defer,
+        turn,
+    )
+    return {"conversation_id": conv_id, "response": response_data}
+
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """Chat turns over one connection, with an event per pipeline stage; see chat_socket.py."""
+    await ChatSocket(websocket, run_socket_turn, USER_ID, save_usage_events).serve()
+
+
 @app.post("/api/feedback")
-async def submit_feedback(feedback: FeedbackRequest):
+def submit_feedback(feedback: FeedbackRequest):
     """
     Submit feedback on a recipe. This updates the long-term profile
     based on user feedback (rating, comments, made status).
     """
+    set_attribution(user_id=USER_ID)
     try:
-        # Get current profile
-        profile = get_user_profile(USER_ID)
+        # Get current profile, and its version for merging updates into it
+        profile, profile_version = load_user_profile(USER_ID)
         
         # Update long-term data from feedback
         # Note: function expects 'requirements' parameter but we use 'comments'
@@ -509,41 +902,43 @@ async def submit_feedback(feedback: FeedbackRequest):
         if not updated:
             raise HTTPException(status_code=500, detail="Failed to process feedback")
         
-        # Merge updates with existing profile
-        new_instructions = profile["long_term_instructions"] + updated.get("long_term_instructions", [])
-        new_preferences = profile["long_term_preferences"] + updated.get("long_term_preferences", [])
-        new_restrictions = profile["long_term_restrictions"] + updated.get("long_term_restrictions", [])
-        new_situation = profile["long_term_situation"] + updated.get("long_term_situation", [])
-        
-        # Update database
-        update_user_profile(
+        # Merge updates with the profile, on top of any change made since it was read
+        merge_user_profile(
             USER_ID,
-            new_instructions,
-            new_preferences,
-            new_restrictions,
-            new_situation,
+            {category: updated.get(category, []) for category in PROFILE_CATEGORIES},
+            profile_version,
+            _take_critical(updated),
         )
         
         # Store feedback in database
-        conn = get_db()
-        c = conn.cursor()
-        c.execute(
-            """
-            INSERT INTO recipe_feedback 
-            (user_id, recipe_name, recipe_data, made_status, rating, comments)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (
-                USER_ID,
-                feedback.recipe.get("name", ""),
-                json.dumps(feedback.recipe),
-                feedback.made_status,
-                feedback.rating,
-                feedback.comments,
-            ),
-        )
-        conn.commit()
-        conn.close()
+        def store_feedback(conn):
+            c = conn.cursor()
+            c.execute(
+                """
+                INSERT INTO recipe_feedback 
+                (user_id, recipe_name, recipe_data, made_status, rating, comments)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    USER_ID,
+                    feedback.recipe.get("name", ""),
+                    json.dumps(feedback.recipe),
+                    feedback.made_status,
+                    feedback.rating,
+                    feedback.comments,
+                ),
+            )
+            # Credit the rating to the most recent library recipe with this name
+            c.execute(
+                """
+                UPDATE recipes SET rating_sum = rating_sum + ?, rating_count = rating_count + 1
+                WHERE id = (SELECT MAX(id) FROM recipes WHERE user_id = ? AND name = ?)
+                """,
+                (feedback.rating, USER_ID, feedback.recipe.get("name", "")),
+            )
+
+        with span("db.insert_feedback"):
+            write(store_feedback)
         
         return JSONResponse({
             "success": True,
@@ -564,17 +959,21 @@ def get_conversations():
     """
     conn = get_db()
     c = conn.cursor()
-    c.execute(
-        """
-        SELECT id, title, created_at, updated_at,
-               (SELECT COUNT(*) FROM chat WHERE conversation_id = conversations.id) as message_count
-        FROM conversations 
-        WHERE user_id = ? 
-        ORDER BY updated_at DESC
-        """,
-        (USER_ID,),
-    )
-    rows = c.fetchall()
+    with span("db.list_conversations"):
+        c.execute(
+            """
+            SELECT id, title, created_at, updated_at,
+                   COALESCE(
+                       (SELECT messages FROM chat_archive WHERE conversation_id = conversations.id),
+                       (SELECT COUNT(*) FROM chat WHERE conversation_id = conversations.id)
+                   ) as message_count
+            FROM conversations 
+            WHERE user_id = ? 
+            ORDER BY updated_at DESC
+            """,
+            (USER_ID,),
+        )
+        rows = c.fetchall()
     conn.close()
     
     conversations = []
@@ -595,18 +994,14 @@ def create_conversation():
     """
     Create a new conversation.
     """
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(
-        """
-        INSERT INTO conversations (user_id, title, updated_at)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-        """,
-        (USER_ID, "New Chat"),
-    )
-    conversation_id = c.lastrowid
-    conn.commit()
-    conn.close()
+    with span("db.create_conversation"):
+        conversation_id = write(lambda conn: conn.execute(
+            """
+            INSERT INTO conversations (user_id, title, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            """,
+            (USER_ID, "New Chat"),
+        ).lastrowid)
     
     return JSONResponse({
         "id": conversation_id,
@@ -617,80 +1012,106 @@ def create_conversation():
     })
 
 
+def image_url_suffix(image_size: str) -> str:
+    """Query string appended to stored image paths so history links to the requested rendition."""
+    if image_size == thumbnails.ORIGINAL:
+        return ""
+    if image_size not in thumbnails.RENDITIONS:
+        sizes = ", ".join([*thumbnails.RENDITIONS, thumbnails.ORIGINAL])
+        raise HTTPException(status_code=400, detail=f"image_size must be one of: {sizes}")
+    return f"?size={image_size}"
+
+
+# Output keys for the columns selected by the message endpoints, in SELECT order
+CHAT_MESSAGE_FIELDS = {
+    "id": None,
+    "message": None,
+    "response": RAW,
+    "has_image": BOOL,
+    "image_path": None,
+    "created_at": None,
+}
+
+
 @app.get("/api/conversations/{conversation_id}/messages")
-def get_conversation_messages(conversation_id: int, limit: int = 100):
+def get_conversation_messages(conversation_id: int, limit: int = 100, image_size: str = "thumb"):
     """
     Get messages for a specific conversation.
     Returns messages in chronological order (oldest first).
+    image_path links to the thumbnail unless image_size asks for another rendition.
     """
+    suffix = image_url_suffix(image_size)
     conn = get_db()
     c = conn.cursor()
-    
-    # Verify conversation exists and belongs to user
-    c.execute("SELECT id FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, USER_ID))
-    if not c.fetchone():
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    c.execute(
-        """
-        SELECT id, message, response, has_image, image_path, created_at
-        FROM chat 
-        WHERE conversation_id = ? AND user_id = ?
-        ORDER BY created_at ASC 
-        LIMIT ?
-        """,
-        (conversation_id, USER_ID, limit),
-    )
-    rows = c.fetchall()
+
+    with span("db.get_conversation_messages"):
+        # Verify conversation exists and belongs to user
+        c.execute("SELECT id FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, USER_ID))
+        if not c.fetchone():
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        archived = archive.load(conn, conversation_id)
+        if archived is None:
+            c.execute(
+                """
+                SELECT id, message, response, has_image, image_path || ?, created_at
+                FROM chat 
+                WHERE conversation_id = ? AND user_id = ?
+                ORDER BY created_at ASC 
+                LIMIT ?
+                """,
+                (suffix, conversation_id, USER_ID, limit),
+            )
+            rows = c.fetchall()
     conn.close()
+    if archived is not None:
+        # Decompressed from cold storage, in the same shape and order as the query above
+        archived.sort(key=lambda row: row[5])
+        rows = [
+            (message_id, message, response, has_image, image_path and image_path + suffix, created_at)
+            for message_id, message, response, has_image, image_path, created_at in (archived[:limit] if limit >= 0 else archived)
+        ]
     
-    messages = []
-    for row in rows:
-        messages.append({
-            "id": row["id"],
-            "message": row["message"],
-            "response": json.loads(row["response"]),
-            "has_image": bool(row["has_image"]),
-            "image_path": row["image_path"],
-            "created_at": row["created_at"],
-        })
-    
-    return JSONResponse(messages)
+    # Stored responses are already JSON, so they are spliced into the body as-is
+    return raw_json_response(encode_rows(rows, CHAT_MESSAGE_FIELDS))
 
 
 @app.get("/api/history")
-def get_history(limit: int = 50):
+def get_history(limit: int = 50, image_size: str = "thumb"):
     """
     Get chat history for the user (deprecated - use /api/conversations/{id}/messages instead).
     Returns messages in reverse chronological order (newest first).
+    image_path links to the thumbnail unless image_size asks for another rendition.
     """
+    suffix = image_url_suffix(image_size)
     conn = get_db()
     c = conn.cursor()
-    c.execute(
-        """
-        SELECT id, message, response, has_image, image_path, created_at
-        FROM chat 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT ?
-        """,
-        (USER_ID, limit),
-    )
-    rows = c.fetchall()
+    with span("db.get_history"):
+        c.execute(
+            """
+            SELECT id, message, response, has_image, image_path || ?, created_at
+            FROM chat 
+            WHERE user_id = ? 
+            ORDER BY created_at DESC 
+            LIMIT ?
+            """,
+            (suffix, USER_ID, limit),
+        )
+        rows = c.fetchall()
     conn.close()
     
-    history = []
-    for row in rows:
-        history.append({
-            "id": row["id"],
-            "message": row["message"],
-            "response": json.loads(row["response"]),
-            "has_image": bool(row["has_image"]),
-            "image_path": row["image_path"],
-            "created_at": row["created_at"],
-        })
-    
-    return JSONResponse(history)
+    return raw_json_response(encode_rows(rows, CHAT_MESSAGE_FIELDS))
+
+
+FEEDBACK_FIELDS = {
+    "id": None,
+    "recipe_name": None,
+    "recipe": RAW,
+    "made_status": None,
+    "rating": None,
+    "comments": None,
+    "created_at": None,
+}
 
 
 @app.get("/api/feedback/history")
@@ -698,32 +1119,339 @@ def get_feedback_history(limit: int = 20):
     """Get feedback history for the user."""
     conn = get_db()
     c = conn.cursor()
-    c.execute(
-        """
-        SELECT id, recipe_name, recipe_data, made_status, rating, comments, created_at
-        FROM recipe_feedback 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT ?
-        """,
-        (USER_ID, limit),
-    )
-    rows = c.fetchall()
+    with span("db.get_feedback_history"):
+        c.execute(
+            """
+            SELECT id, recipe_name, recipe_data, made_status, rating, comments, created_at
+            FROM recipe_feedback 
+            WHERE user_id = ? 
+            ORDER BY created_at DESC 
+            LIMIT ?
+            """,
+            (USER_ID, limit),
+        )
+        rows = c.fetchall()
     conn.close()
     
-    feedback = []
+    return raw_json_response(encode_rows(rows, FEEDBACK_FIELDS))
+
+
+FEEDBACK_STATS_MAX_DAYS = 366
+FEEDBACK_STATS_MAX_TOP = 50
+
+
+def _feedback_summary(row) -> dict:
+    return {
+        "feedback": row["feedback"],
+        "made": row["made"],
+        "made_rate": round(row["made"] / row["feedback"], 3) if row["feedback"] else None,
+        "average_rating": round(row["rating_sum"] / row["rated"], 2) if row["rated"] else None,
+    }
+
+
+@app.get("/api/feedback/stats")
+def get_feedback_stats(days: int = 30, top: int = 5, recipe: Optional[str] = None):
+    """
+    Feedback analytics for the user: totals with made rate and average rating, the
+    `top` best-rated recipes, feedback per day over the last `days` days, and one
+    recipe's numbers when `recipe` names it. Read from the feedback_stats_* tables
+    that triggers keep up to date (see migrations.py), so the cost doesn't grow
+    with the feedback history.
+    """
+    if not 1 <= days <= FEEDBACK_STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {FEEDBACK_STATS_MAX_DAYS}")
+    if not 1 <= top <= FEEDBACK_STATS_MAX_TOP:
+        raise HTTPException(status_code=400, detail=f"top must be between 1 and {FEEDBACK_STATS_MAX_TOP}")
+
+    conn = get_db()
+    c = conn.cursor()
+    with span("db.get_feedback_stats"):
+        c.execute("SELECT * FROM feedback_stats_user WHERE user_id = ?", (USER_ID,))
+        totals = c.fetchone()
+        # Walks idx_feedback_stats_recipe_top, so only `top` rows are read
+        c.execute(
+            """
+            SELECT * FROM feedback_stats_recipe
+            WHERE user_id = ?
+            ORDER BY rating_sum * 1.0 / rated DESC, feedback DESC
+            LIMIT ?
+            """,
+            (USER_ID, top),
+        )
+        top_rows = c.fetchall()
+        c.execute(
+            "SELECT * FROM feedback_stats_daily WHERE user_id = ? AND day >= date('now', ?) ORDER BY day",
+            (USER_ID, f"-{days - 1} days"),
+        )
+        trend_rows = c.fetchall()
+        recipe_row = None
+        if recipe is not None:
+            c.execute("SELECT * FROM feedback_stats_recipe WHERE user_id = ? AND recipe_name = ?", (USER_ID, recipe))
+            recipe_row = c.fetchone()
+    conn.close()
+
+    stats = {
+        "totals": {
+            **_feedback_summary(totals or {"feedback": 0, "made": 0, "rated": 0, "rating_sum": 0}),
+            "first_at": totals["first_at"] if totals else None,
+            "last_at": totals["last_at"] if totals else None,
+        },
+        "top_recipes": [
+            {"recipe_name": row["recipe_name"], **_feedback_summary(row), "last_at": row["last_at"]}
+            for row in top_rows
+        ],
+        "trend": [{"day": row["day"], **_feedback_summary(row)} for row in trend_rows],
+    }
+    if recipe is not None:
+        stats["recipe"] = (
+            {"recipe_name": recipe, **_feedback_summary(recipe_row), "first_at": recipe_row["first_at"], "last_at": recipe_row["last_at"]}
+            if recipe_row else None
+        )
+    return JSONResponse(stats)
+
+
+SEARCH_SCOPES = ("all", "chat", "feedback")
+SEARCH_SNIPPET_TOKENS = 12
+# Matches are counted up to this many per source; beyond it "total" is a lower bound
+SEARCH_COUNT_LIMIT = 1000
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query matching every word, the last one as a prefix
+    so results keep up while typing. Quoting each word stops FTS5 syntax in user
+    input (quotes, AND/OR/NOT, column filters) from being interpreted.
+    """
+    terms = [f'"{word}"' for word in re.findall(r"\w+", text)]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Per search table: BM25 column weights (recipe names count most), the source table
+# it indexes, and the details returned with each hit
+SEARCH_SOURCES = {
+    "chat": {
+        "fts": "chat_fts",
+        "weights": "1.0, 4.0, 2.0, 0.5",
+        "table": "chat",
+        "details": """
+            SELECT chat.conversation_id AS conversation_id, conversations.title AS conversation_title,
+                   json_extract(chat.response, '$.recipe.name') AS recipe_name, chat.created_at AS created_at
+            FROM chat LEFT JOIN conversations ON conversations.id = chat.conversation_id
+            WHERE chat.id = ?
+        """,
+    },
+    "feedback": {
+        "fts": "feedback_fts",
+        "weights": "4.0, 1.0",
+        "table": "recipe_feedback",
+        "details": """
+            SELECT NULL AS conversation_id, NULL AS conversation_title,
+                   recipe_name, created_at
+            FROM recipe_feedback WHERE id = ?
+        """,
+    },
+}
+
+
+@app.get("/api/search")
+def search(q: str, scope: str = "all", limit: int = 20, offset: int = 0):
+    """
+    Full-text search over chat messages, recipes in chat responses and feedback.
+    Results are ranked by BM25, with recipe names weighted highest, and each has a
+    snippet with the matched words wrapped in <mark> tags.
+    """
+    if scope not in SEARCH_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of {', '.join(SEARCH_SCOPES)}")
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    match = fts_query(q)
+    if not match:
+        return JSONResponse({"query": q, "total": 0, "total_is_exact": True, "limit": limit, "offset": offset, "results": []})
+
+    sources = list(SEARCH_SOURCES) if scope == "all" else [scope]
+    ranked, counts, params = [], [], []
+    for source in sources:
+        fts, weights, table = SEARCH_SOURCES[source]["fts"], SEARCH_SOURCES[source]["weights"], SEARCH_SOURCES[source]["table"]
+        ranked.append(f"""
+            SELECT '{source}' AS type, {fts}.rowid AS id, bm25({fts}, {weights}) AS score
+            FROM {fts} JOIN {table} ON {table}.id = {fts}.rowid
+            WHERE {fts} MATCH ? AND {table}.user_id = ?
+        """)
+        counts.append(f"""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM {fts} JOIN {table} ON {table}.id = {fts}.rowid
+                WHERE {fts} MATCH ? AND {table}.user_id = ? LIMIT {SEARCH_COUNT_LIMIT}
+            )
+        """)
+        params += [match, USER_ID]
+
+    conn = get_db()
+    c = conn.cursor()
+    with span("db.search"):
+        # Rank first and build snippets only for the page: snippet() is far more
+        # expensive than bm25() and would otherwise run for every match
+        c.execute(
+            f"SELECT * FROM ({' UNION ALL '.join(ranked)}) ORDER BY score LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        )
+        page = c.fetchall()
+        c.execute(f"SELECT {', '.join(f'({count})' for count in counts)}", params)
+        source_counts = c.fetchone()
+        total = sum(source_counts)
+        total_is_exact = all(count < SEARCH_COUNT_LIMIT for count in source_counts)
+
+        results = []
+        for row in page:
+            source = SEARCH_SOURCES[row["type"]]
+            c.execute(
+                f"""
+                SELECT snippet({source['fts']}, -1, '<mark>', '</mark>', '…', {SEARCH_SNIPPET_TOKENS})
+                FROM {source['fts']} WHERE {source['fts']} MATCH ? AND rowid = ?
+                """,
+                (match, row["id"]),
+            )
+            snippet = c.fetchone()[0]
+            c.execute(source["details"], (row["id"],))
+            details = c.fetchone()
+            results.append({
+                "type": row["type"],
+                "id": row["id"],
+                "conversation_id": details["conversation_id"],
+                "conversation_title": details["conversation_title"],
+                "recipe_name": details["recipe_name"],
+                "snippet": snippet,
+                # bm25() is lower-is-better; flip it so higher means more relevant
+                "score": round(-row["score"], 4),
+                "created_at": details["created_at"],
+            })
+    conn.close()
+
+    return JSONResponse({
+        "query": q,
+        "total": total,
+        "total_is_exact": total_is_exact,
+        "limit": limit,
+        "offset": offset,
+        "results": results,
+    })
+
+
+USAGE_GROUPS = {
+    "endpoint": "endpoint",
+    "stage": "stage",
+    "model": "model",
+    "user": "user_id",
+    "day": "day",
+}
+
+
+@app.get("/api/usage")
+def get_usage(group_by: str = "stage", days: int = 30, conversation_id: Optional[int] = None):
+    """
+    Get LLM token usage and cost for the user.
+    Totals are grouped by endpoint, stage, model, user or day from the daily rollup,
+    or broken down by stage for a single conversation when conversation_id is given.
+    """
+    if group_by not in USAGE_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(USAGE_GROUPS)}")
+    column = USAGE_GROUPS[group_by]
+
+    conn = get_db()
+    c = conn.cursor()
+    with span("db.get_usage"):
+        if conversation_id is not None:
+            c.execute(
+                """
+                SELECT stage AS key, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                       SUM(completion_tokens) AS completion_tokens, SUM(cached_tokens) AS cached_tokens,
+                       SUM(cost_nano_usd) AS cost_nano_usd
+                FROM llm_usage
+                WHERE conversation_id = ? AND user_id = ?
+                GROUP BY stage
+                ORDER BY cost_nano_usd DESC
+                """,
+                (conversation_id, USER_ID),
+            )
+        else:
+            # The user grouping spans all users; every other grouping is scoped to the current user
+            user_filter = "" if group_by == "user" else "AND user_id = ?"
+            params = (f"-{days} days",) if group_by == "user" else (f"-{days} days", USER_ID)
+            c.execute(
+                f"""
+                SELECT {column} AS key, SUM(calls) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                       SUM(completion_tokens) AS completion_tokens, SUM(cached_tokens) AS cached_tokens,
+                       SUM(cost_nano_usd) AS cost_nano_usd
+                FROM llm_usage_daily
+                WHERE day >= date('now', ?) {user_filter}
+                GROUP BY {column}
+                ORDER BY {"key" if group_by == "day" else "cost_nano_usd DESC"}
+                """,
+                params,
+            )
+        rows = c.fetchall()
+    conn.close()
+
+    groups = []
+    totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    total_nano_usd = 0
     for row in rows:
-        feedback.append({
-            "id": row["id"],
-            "recipe_name": row["recipe_name"],
-            "recipe": json.loads(row["recipe_data"]),
-            "made_status": row["made_status"],
-            "rating": row["rating"],
-            "comments": row["comments"],
-            "created_at": row["created_at"],
+        groups.append({
+            group_by if conversation_id is None else "stage": row["key"],
+            "calls": row["calls"],
+            "prompt_tokens": row["prompt_tokens"],
+            "completion_tokens": row["completion_tokens"],
+            "cached_tokens": row["cached_tokens"],
+            "cost_usd": row["cost_nano_usd"] / 1_000_000_000,
         })
-    
-    return JSONResponse(feedback)
+        for key in ("calls", "prompt_tokens", "completion_tokens", "cached_tokens"):
+            totals[key] += row[key]
+        total_nano_usd += row["cost_nano_usd"]
+    # Summed exactly in nano-dollars, converted only for display
+    totals["cost_usd"] = total_nano_usd / 1_000_000_000
+
+    return JSONResponse({"group_by": group_by if conversation_id is None else "stage", "totals": totals, "groups": groups})
+
+
+@app.get("/api/routes")
+def get_routes():
+    """
+    The model routing table, with each stage's recent p95 latency and quality-check
+    results per model, and whether it is currently on its fallback model.
+    """
+    return JSONResponse(routing.router.stats())
+
+
+@app.get("/api/export")
+def export_data():
+    """
+    Download the user's profile, conversations, messages and feedback as NDJSON
+    (see transfer.py), streamed in chunks from a consistent snapshot.
+    """
+    return StreamingResponse(
+        transfer.export_lines(DB_PATH, USER_ID),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="chefing-export.ndjson"'},
+    )
+
+
+@app.post("/api/import")
+async def import_data(request: Request):
+    """
+    Add the records of an /api/export download (the request body) to this
+    database, in large batched transactions. Conversations get new ids. If a
+    record is invalid, the import stops with 400 and the batches before it
+    stay imported.
+    """
+    importer = transfer.Importer(DB_PATH, USER_ID, lambda c, user_id, profile: _store_profile(c, user_id, profile, None))
+    try:
+        async for batch in transfer.read_stream_lines(request.stream()):
+            # Parsing and the write both block, so they run off the event loop
+            await run_in_threadpool(importer.write, batch)
+    except transfer.ImportFailed as e:
+        raise HTTPException(status_code=400, detail={"error": str(e), "imported": importer.counts})
+    return JSONResponse({"success": True, "imported": importer.counts})
 
 
 @app.post("/api/reset")
@@ -733,17 +1461,19 @@ def reset_demo():
     This will delete all chat history, user profile, and feedback data.
     """
     try:
-        conn = get_db()
-        c = conn.cursor()
+        def clear(conn):
+            c = conn.cursor()
+            # Clear all tables (CASCADE will handle chat messages)
+            c.execute("DELETE FROM conversations")
+            c.execute("DELETE FROM chat")
+            c.execute("DELETE FROM chat_archive")
+            c.execute("DELETE FROM user_profile")
+            c.execute("DELETE FROM profile_items")
+            c.execute("DELETE FROM recipe_feedback")
+            c.execute("DELETE FROM recipes")
         
-        # Clear all tables (CASCADE will handle chat messages)
-        c.execute("DELETE FROM conversations")
-        c.execute("DELETE FROM chat")
-        c.execute("DELETE FROM user_profile")
-        c.execute("DELETE FROM recipe_feedback")
-        
-        conn.commit()
-        conn.close()
+        write(clear)
+        get_recipe_library().clear()
         
         return JSONResponse({
             "success": True,
@@ -753,34 +1483,51 @@ def reset_demo():
         raise HTTPException(status_code=500, detail=f"Failed to reset demo: {str(e)}")
 
 
+@app.get("/metrics")
+def get_metrics():
+    """Expose stage latencies, errors, token counts and cache hits in Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # Serve uploaded images
 @app.get("/uploads/{filename:path}")
-async def serve_upload(filename: str):
-    """Serve uploaded fridge images."""
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if os.path.exists(file_path) and os.path.isfile(file_path):
-        return FileResponse(file_path)
-    raise HTTPException(status_code=404, detail="File not found")
+async def serve_upload(filename: str, request: Request, size: Optional[str] = None):
+    """
+    Serve uploaded fridge images, answering 304 when the client's ETag still matches.
+    `size` (thumb or medium) serves a downscaled rendition, or the original until it exists.
+    """
+    if size is not None and size != thumbnails.ORIGINAL and size not in thumbnails.RENDITIONS:
+        raise HTTPException(status_code=400, detail="Unknown image size")
+    file_path = safe_join(UPLOAD_DIR, filename)
+    if file_path:
+        file_path = thumbnails.resolve(file_path, size)
+    response = file_response(file_path, request.headers) if file_path else None
+    if response is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return response
 
 
 # Serve static files from the static directory (static_dir already defined above)
 if os.path.exists(static_dir):
     # Mount static assets (JS, CSS, images, etc.) - this must be before the catch-all route
-    app.mount("/assets", StaticFiles(directory=os.path.join(static_dir, "assets")), name="assets")
+    # Hashed file names, so served as immutable, precompressed when a .br/.gz variant exists
+    app.mount("/assets", PrecompressedStaticFiles(directory=os.path.join(static_dir, "assets")), name="assets")
     
     # Serve static files like vite.svg
+    vite_svg = CachedFile(os.path.join(static_dir, "vite.svg"), "image/svg+xml")
+
     @app.get("/vite.svg")
-    async def serve_vite_svg():
-        svg_path = os.path.join(static_dir, "vite.svg")
-        if os.path.exists(svg_path):
-            return FileResponse(svg_path)
+    async def serve_vite_svg(request: Request):
+        response = vite_svg.response(request.headers)
+        if response is not None:
+            return response
         raise HTTPException(status_code=404)
     
     # Serve index.html for all non-API routes (SPA routing)
     # This must be the LAST route to catch all unmatched paths
     # FastAPI matches routes in order, so more specific routes above will match first
     @app.get("/{full_path:path}")
-    async def serve_spa(full_path: str):
+    async def serve_spa(full_path: str, request: Request):
         # Explicitly exclude API routes, uploads, assets, and vite.svg
         # These should have been handled by more specific routes above
         if (full_path.startswith("api/") or 
@@ -791,7 +1538,7 @@ if os.path.exists(static_dir):
             raise HTTPException(status_code=404, detail="Not found")
         
         # Serve index.html for SPA routing (any other path)
-        index_path = os.path.join(static_dir, "index.html")
-        if os.path.exists(index_path):
-            return FileResponse(index_path)
+        response = index_html.response(request.headers)
+        if response is not None:
+            return response
         raise HTTPException(status_code=404, detail="Frontend not built")
@@ -0,0 +1,146 @@
+"""
+Rolling conversation memory.
+
+Each prompt gets the conversation's running summary plus its most recent
+turns verbatim, packed newest-first into a fixed token budget, so prompt
+size stays flat however long a conversation gets. Turns that fall out of
+the verbatim window are folded into the summary (stored on
+`conversations.summary`) a few at a time by a background task after the
+reply is sent. The summary therefore grows incrementally and never
+re-reads the whole conversation.
+"""
+
+import json
+import os
+import sqlite3
+
+import db_writer
+from lib import estimate_tokens, summarize_conversation
+from metrics import span
+
+# Most recent turns kept verbatim
+MEMORY_TURNS = int(os.environ.get("CHEFING_MEMORY_TURNS", "6"))
+# Prompt tokens for summary plus turns together; 0 disables memory
+MEMORY_TOKENS = int(os.environ.get("CHEFING_MEMORY_TOKENS", "800"))
+# Length the summarizer is asked to stay within
+SUMMARY_TOKENS = 250
+# Evicted turns are summarized in groups, so long conversations cost one summary call per few turns
+SUMMARY_BATCH = 4
+# Most turns folded by one refresh, so an old or imported conversation catches up a few batches per turn
+SUMMARY_FOLD = SUMMARY_BATCH * 4
+# Longer messages are cut in the memory block; the full text stays in chat history
+TURN_MAX_CHARS = 600
+TURN_MAX_INGREDIENTS = 12
+
+
+def _clip(text: str, limit: int = TURN_MAX_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def format_turn(message: str, response: str) -> str:
+    """One stored chat turn as compact prompt text."""
+    try:
+        data = json.loads(response)
+    except (TypeError, ValueError):
+        data = {}
+    recipe = data.get("recipe") if isinstance(data, dict) else None
+    if isinstance(recipe, dict):
+        ingredients = ", ".join(recipe.get("ingredients", [])[:TURN_MAX_INGREDIENTS])
+        reply = f"Suggested {recipe.get('name') or 'a recipe'} ({ingredients})"
+    elif isinstance(data, dict) and isinstance(data.get("parsed_info"), dict):
+        noted = [
+            item
+            for key, items in data["parsed_info"].items()
+            if key.startswith("new_") and isinstance(items, list)
+            for item in items
+        ]
+        reply = "Noted: " + "; ".join(noted) if noted else "Acknowledged"
+    else:
+        reply = "Acknowledged"
+    return f"User: {_clip(message)}\nAssistant: {_clip(reply)}"
+
+
+def pack(summary: str | None, turns: list[str], budget: int) -> str:
+    """
+    The summary, then as many of the newest `turns` (given oldest first) as fit
+    in `budget` tokens, in conversation order. Older turns are dropped first.
+    """
+    parts, used = [], 0
+    if summary:
+        block = f"Summary of earlier turns: {summary}"
+        cost = estimate_tokens(block)
+        if cost <= budget:
+            parts.append(block)
+            used = cost
+    kept = []
+    for turn in reversed(turns):
+        cost = estimate_tokens(turn)
+        if used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    return "\n".join(parts + kept[::-1])
+
+
+def load_memory(db_path: str, conversation_id: int | None, user_id: str, budget: int = MEMORY_TOKENS) -> str:
+    """Packed memory for the next turn of a conversation, or "" for a new one."""
+    if not conversation_id or budget <= 0:
+        return ""
+    with span("db.load_memory"):
+        conn = sqlite3.connect(db_path)
+        c = conn.cursor()
+        c.execute(
+            "SELECT summary, summary_through FROM conversations WHERE id = ? AND user_id = ?",
+            (conversation_id, user_id),
+        )
+        row = c.fetchone()
+        if not row:
+            conn.close()
+            return ""
+        summary, summary_through = row
+        # Everything not yet in the summary: the window plus at most one batch awaiting summarization
+        c.execute(
+            "SELECT message, response FROM chat WHERE conversation_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (conversation_id, summary_through, MEMORY_TURNS + SUMMARY_BATCH),
+        )
+        turns = [format_turn(message, response) for message, response in reversed(c.fetchall())]
+        conn.close()
+    return pack(summary, turns, budget)
+
+
+def refresh_summary(db_path: str, conversation_id: int) -> bool:
+    """
+    Fold the oldest turns that have left the verbatim window (at most SUMMARY_FOLD) into
+    the conversation's summary, once at least SUMMARY_BATCH of them have built up.
+    Returns whether it was updated.
+    """
+    if MEMORY_TOKENS <= 0:
+        # Memory is off: nothing would read the summary
+        return False
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT summary, summary_through FROM conversations WHERE id = ?", (conversation_id,))
+    row = c.fetchone()
+    if not row:
+        conn.close()
+        return False
+    summary, summary_through = row
+    # Turns before the oldest one still in the verbatim window
+    c.execute(
+        "SELECT id, message, response FROM chat WHERE conversation_id = ? AND id > ? AND id NOT IN "
+        "(SELECT id FROM chat WHERE conversation_id = ? ORDER BY id DESC LIMIT ?) ORDER BY id LIMIT ?",
+        (conversation_id, summary_through, conversation_id, MEMORY_TURNS, SUMMARY_FOLD),
+    )
+    evicted = c.fetchall()
+    conn.close()
+    if len(evicted) < SUMMARY_BATCH:
+        return False
+
+    summary = summarize_conversation(summary, [format_turn(message, response) for _, message, response in evicted], SUMMARY_TOKENS)
+
+    # Only if no concurrent refresh got there first
+    return db_writer.write(db_path, lambda conn: conn.execute(
+        "UPDATE conversations SET summary = ?, summary_through = ? WHERE id = ? AND summary_through = ?",
+        (summary, evicted[-1][0], conversation_id, summary_through),
+    ).rowcount == 1)
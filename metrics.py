@@ -0,0 +1,341 @@
+"""
+Lightweight tracing and Prometheus metrics for the Chefing backend.
+
+Spans time a named stage (an LLM call, a DB helper, ...) and feed a latency
+histogram and an error counter. When a request is being timed, each span is
+also appended to that request's timing record so a structured per-request
+log line can be emitted at the end. Everything is in-process and lock-guarded;
+a span costs two perf_counter calls and a dictionary update.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+TIMING_LOG_ENABLED = os.environ.get("CHEFING_TIMING_LOG", "").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+timing_logger = logging.getLogger("chefing.timing")
+
+# Per-request list of (span name, seconds, error) tuples, set by the middleware
+_request_spans: contextvars.ContextVar[list | None] = contextvars.ContextVar("request_spans", default=None)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing value per label combination."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """Value per label combination that can go up and down."""
+
+    type_name = "gauge"
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """Cumulative bucketed distribution per label combination."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(e[0]), e[1], e[2])) for labels, e in self._values.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.register(
+    Histogram("chefing_stage_latency_seconds", "Latency of traced pipeline stages.", ("stage",))
+)
+STAGE_ERRORS = REGISTRY.register(
+    Counter("chefing_stage_errors_total", "Traced stages that raised an exception.", ("stage",))
+)
+LLM_TOKENS = REGISTRY.register(
+    Counter("chefing_llm_tokens_total", "Tokens reported by the upstream API.", ("stage", "model", "kind"))
+)
+CACHE_HITS = REGISTRY.register(
+    Counter("chefing_cache_hits_total", "Cache hits, by cache.", ("cache",))
+)
+CONTEXT_TOKENS = REGISTRY.register(
+    Counter(
+        "chefing_context_tokens_total",
+        "Estimated profile context tokens: packed into prompts, and what top-5 per category would have used.",
+        ("kind",),
+    )
+)
+SPECULATIONS = REGISTRY.register(
+    Counter("chefing_speculations_total", "Speculative recipe generations, by policy and outcome (used, wasted).", ("policy", "outcome"))
+)
+SPECULATION_WASTED_TOKENS = REGISTRY.register(
+    Counter("chefing_speculation_wasted_tokens_total", "Tokens spent on speculative generations that were thrown away.", ("kind",))
+)
+SPECULATION_SAVED_SECONDS = REGISTRY.register(
+    Counter("chefing_speculation_saved_seconds_total", "Latency saved by generating while intent detection ran.")
+)
+SINGLEFLIGHT_CALLS = REGISTRY.register(
+    Counter(
+        "chefing_singleflight_calls_total",
+        "Upstream calls by coalescing role: leader (made the call), follower (shared a leader's result), retried (leader was cancelled).",
+        ("stage", "role"),
+    )
+)
+ADMISSION_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("chefing_admission_queue_depth", "Requests or upstream calls waiting for a slot, by limiter.", ("limiter",))
+)
+ADMISSION_IN_FLIGHT = REGISTRY.register(
+    Gauge("chefing_admission_in_flight", "Requests or upstream calls holding a slot, by limiter.", ("limiter",))
+)
+ADMISSION_WAIT = REGISTRY.register(
+    Histogram("chefing_admission_wait_seconds", "Time spent waiting for a slot, by limiter and outcome (admitted, shed).", ("limiter", "outcome"))
+)
+ADMISSION_SHED = REGISTRY.register(
+    Counter("chefing_admission_shed_total", "Requests turned away with 429, by limiter and reason (queue_full, deadline).", ("limiter", "reason"))
+)
+DB_WRITE_BATCH = REGISTRY.register(
+    Histogram("chefing_db_write_batch_size", "Writes committed together in one transaction.", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+)
+DB_WRITE_LATENCY = REGISTRY.register(
+    Histogram("chefing_db_write_seconds", "Time from submitting a write to its commit, by outcome (ok, error).", ("outcome",))
+)
+PROFILE_CONFLICTS = REGISTRY.register(
+    Counter("chefing_profile_conflicts_total", "Profile merges applied on top of a profile that changed since it was read (rebased in the write, never retried).")
+)
+ARCHIVED_CONVERSATIONS = REGISTRY.register(
+    Counter("chefing_archive_conversations_total", "Conversations moved to or from cold storage, by action (archived, restored).", ("action",))
+)
+LEXICAL_FALLBACKS = REGISTRY.register(
+    Counter("chefing_retrieval_lexical_fallbacks_total", "Hybrid retrievals that fell back to BM25 alone because embedding the message failed.")
+)
+ROUTE_LATENCY = REGISTRY.register(
+    Histogram("chefing_route_latency_seconds", "Upstream latency of completion calls, by stage and the model they were routed to.", ("stage", "model"))
+)
+ROUTE_QUALITY = REGISTRY.register(
+    Counter("chefing_route_quality_checks_total", "Quality checks of completion outputs, by stage, model and result (pass, fail).", ("stage", "model", "result"))
+)
+ROUTE_FALLBACKS = REGISTRY.register(
+    Counter("chefing_route_fallbacks_total", "Completion calls sent to a stage's fallback model because its primary was over its latency SLO.", ("stage", "model"))
+)
+WS_CONNECTIONS = REGISTRY.register(
+    Gauge("chefing_ws_connections", "Open /ws/chat connections.")
+)
+WS_TURN_LATENCY = REGISTRY.register(
+    Histogram("chefing_ws_turn_seconds", "Time from a /ws/chat turn leaving its queue to its done, cancelled or error event, by result.", ("result",))
+)
+WS_MERGED_TOKENS = REGISTRY.register(
+    Counter("chefing_ws_merged_token_events_total", "Token events merged into the one before them because the client was behind.")
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram("chefing_http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status"))
+)
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a block of code as the stage `name`."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(name, value=elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed, error))
+
+
+def traced(name: str):
+    """Decorator form of `span` for plain functions."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def token_counts(usage) -> tuple[int, int, int]:
+    """Prompt, completion and cached prompt tokens from an API `usage` object."""
+    if usage is None:
+        return 0, 0, 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    return prompt_tokens, completion_tokens, cached_tokens
+
+
+def record_llm_usage(stage: str, model: str, usage):
+    """Count the prompt, completion and cached tokens reported for one API call."""
+    if usage is None:
+        return
+    prompt_tokens, completion_tokens, cached_tokens = token_counts(usage)
+
+    LLM_TOKENS.inc(stage, model, "prompt", amount=prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.inc(stage, model, "completion", amount=completion_tokens)
+    if cached_tokens:
+        LLM_TOKENS.inc(stage, model, "cached", amount=cached_tokens)
+        CACHE_HITS.inc("prompt")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records HTTP latency per route template and, when
+    CHEFING_TIMING_LOG is set, logs one JSON line of span timings per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        if TIMING_LOG_ENABLED and not timing_logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            timing_logger.addHandler(handler)
+            timing_logger.setLevel(logging.INFO)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        spans = [] if TIMING_LOG_ENABLED else None
+        token = _request_spans.set(spans)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_spans.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(scope["method"], route_path, str(status), value=elapsed)
+            if spans is not None:
+                timing_logger.info(
+                    json.dumps(
+                        {
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "route": route_path,
+                            "status": status,
+                            "total_ms": round(elapsed * 1000, 3),
+                            "spans": [
+                                {"stage": name, "ms": round(seconds * 1000, 3), **({"error": True} if err else {})}
+                                for name, seconds, err in spans
+                            ],
+                        }
+                    )
+                )
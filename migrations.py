@@ -0,0 +1,486 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in SQLite's `PRAGMA user_version`. `migrate()`
+takes the database write lock with BEGIN IMMEDIATE, re-reads the version,
+applies every migration above it and bumps the version in the same
+transaction. Several workers starting at once therefore run each migration
+exactly once, and the rest only wait for the lock. An up-to-date database
+costs a single PRAGMA read.
+
+Migrations are append-only: add a new function to MIGRATIONS rather than
+editing an existing one. Databases created before versioning (version 0
+with some or all tables present) are handled by the IF NOT EXISTS guards
+and existence checks in the early migrations.
+"""
+
+import json
+import sqlite3
+
+from critical import is_critical
+
+# Long enough for another worker to finish applying migrations on a large database
+LOCK_TIMEOUT_SECONDS = 60
+
+
+def _table_exists(c, name: str) -> bool:
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,))
+    return c.fetchone() is not None
+
+
+def _base_tables(c):
+    # Conversations table
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        title TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Chat history table (now linked to conversations)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS chat (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        message TEXT NOT NULL,
+        response TEXT NOT NULL,
+        has_image BOOLEAN DEFAULT 0,
+        image_path TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+    )
+    """)
+
+    # Chat tables from before conversations existed: move their messages into a default conversation
+    c.execute("PRAGMA table_info(chat)")
+    if "conversation_id" not in [row[1] for row in c.fetchall()]:
+        c.execute("ALTER TABLE chat ADD COLUMN conversation_id INTEGER")
+        c.execute("""
+            INSERT INTO conversations (user_id, title, created_at, updated_at)
+            SELECT DISTINCT user_id, 'Chat 1', MIN(created_at), MAX(created_at)
+            FROM chat
+            WHERE conversation_id IS NULL
+            GROUP BY user_id
+        """)
+        c.execute("""
+            UPDATE chat
+            SET conversation_id = (SELECT id FROM conversations WHERE user_id = chat.user_id LIMIT 1)
+            WHERE conversation_id IS NULL
+        """)
+
+    # User profile table (long-term data)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS user_profile (
+        user_id TEXT PRIMARY KEY,
+        long_term_instructions TEXT DEFAULT '[]',
+        long_term_preferences TEXT DEFAULT '[]',
+        long_term_restrictions TEXT DEFAULT '[]',
+        long_term_situation TEXT DEFAULT '[]',
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Recipe feedback table
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS recipe_feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        recipe_name TEXT,
+        recipe_data TEXT,
+        made_status TEXT,
+        rating INTEGER,
+        comments TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def _embedding_cache(c):
+    # Quantized embedding cache (see embeddings.py for the blob format)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS embeddings (
+        model TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (model, text_hash)
+    )
+    """)
+
+
+def _llm_usage(c):
+    # LLM token usage, one row per upstream call
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY,
+        created_at INTEGER NOT NULL,
+        endpoint TEXT,
+        stage TEXT NOT NULL,
+        model TEXT NOT NULL,
+        user_id TEXT,
+        conversation_id INTEGER,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        cached_tokens INTEGER NOT NULL,
+        cost_micro_usd INTEGER NOT NULL
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_conversation ON llm_usage(conversation_id)")
+
+    # Daily usage rollup, maintained on every insert into llm_usage
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS llm_usage_daily (
+        day TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        model TEXT NOT NULL,
+        calls INTEGER NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        cached_tokens INTEGER NOT NULL,
+        cost_micro_usd INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id, endpoint, stage, model)
+    ) WITHOUT ROWID
+    """)
+
+
+def _recipe_library(c):
+    # Generated recipes, with the quantized embedding of the request that produced them
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS recipes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        name TEXT,
+        request TEXT NOT NULL,
+        recipe_data TEXT NOT NULL,
+        embedding BLOB,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        rating_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_recipes_user_name ON recipes(user_id, name)")
+
+
+# Recipe fields pulled out of a chat row's JSON response for the chat_fts columns
+CHAT_FTS_RECIPE_COLUMNS = """
+    json_extract({row}.response, '$.recipe.name'),
+    (SELECT group_concat(value, ', ') FROM json_each({row}.response, '$.recipe.ingredients')),
+    (SELECT group_concat(value, ' ') FROM json_each({row}.response, '$.recipe.steps'))
+"""
+
+
+def _full_text_search(c):
+    # Full-text search over chat messages, the recipes inside chat responses and feedback,
+    # kept in sync with the source tables by triggers. rowid is the source row's id.
+    chat_fts_existed = _table_exists(c, "chat_fts")
+    feedback_fts_existed = _table_exists(c, "feedback_fts")
+    c.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(
+        message, recipe_name, ingredients, steps,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """)
+    c.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS feedback_fts USING fts5(
+        recipe_name, comments,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS chat_fts_insert AFTER INSERT ON chat BEGIN
+        INSERT INTO chat_fts (rowid, message, recipe_name, ingredients, steps)
+        VALUES (new.id, new.message, {CHAT_FTS_RECIPE_COLUMNS.format(row="new")});
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_fts_delete AFTER DELETE ON chat BEGIN
+        DELETE FROM chat_fts WHERE rowid = old.id;
+    END
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS chat_fts_update AFTER UPDATE OF message, response ON chat BEGIN
+        DELETE FROM chat_fts WHERE rowid = old.id;
+        INSERT INTO chat_fts (rowid, message, recipe_name, ingredients, steps)
+        VALUES (new.id, new.message, {CHAT_FTS_RECIPE_COLUMNS.format(row="new")});
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS feedback_fts_insert AFTER INSERT ON recipe_feedback BEGIN
+        INSERT INTO feedback_fts (rowid, recipe_name, comments) VALUES (new.id, new.recipe_name, new.comments);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS feedback_fts_delete AFTER DELETE ON recipe_feedback BEGIN
+        DELETE FROM feedback_fts WHERE rowid = old.id;
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS feedback_fts_update AFTER UPDATE OF recipe_name, comments ON recipe_feedback BEGIN
+        DELETE FROM feedback_fts WHERE rowid = old.id;
+        INSERT INTO feedback_fts (rowid, recipe_name, comments) VALUES (new.id, new.recipe_name, new.comments);
+    END
+    """)
+    # Index rows written before the search tables existed
+    if not chat_fts_existed:
+        c.execute(f"""
+        INSERT INTO chat_fts (rowid, message, recipe_name, ingredients, steps)
+        SELECT chat.id, chat.message, {CHAT_FTS_RECIPE_COLUMNS.format(row="chat")} FROM chat
+        """)
+    if not feedback_fts_existed:
+        c.execute("INSERT INTO feedback_fts (rowid, recipe_name, comments) SELECT id, recipe_name, comments FROM recipe_feedback")
+
+
+def _profile_items(c):
+    # Profile items one row each, with critical-ness computed once when they are written
+    existed = _table_exists(c, "profile_items")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS profile_items (
+        user_id TEXT NOT NULL,
+        category TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        critical INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, category, position)
+    ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_profile_items_critical ON profile_items(user_id, critical)")
+    if existed:
+        return
+    categories = ("long_term_instructions", "long_term_preferences", "long_term_restrictions", "long_term_situation")
+    c.execute(f"SELECT user_id, {', '.join(categories)} FROM user_profile")
+    rows = [
+        (row[0], category, position, item, 1 if is_critical(item) else 0)
+        for row in c.fetchall()
+        for category, items in zip(categories, row[1:])
+        for position, item in enumerate(json.loads(items or "[]"))
+    ]
+    c.executemany(
+        "INSERT INTO profile_items (user_id, category, position, item, critical) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def _conversation_memory(c):
+    # Running summary of the turns that have left a conversation's verbatim memory window;
+    # summary_through is the id of the last chat row folded into it
+    c.execute("PRAGMA table_info(conversations)")
+    columns = [row[1] for row in c.fetchall()]
+    if "summary" not in columns:
+        c.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+    if "summary_through" not in columns:
+        c.execute("ALTER TABLE conversations ADD COLUMN summary_through INTEGER NOT NULL DEFAULT 0")
+    # Memory reads a conversation's latest turns on every chat request
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_conversation ON chat(conversation_id, id)")
+
+
+def _profile_version(c):
+    # Bumped on every profile write; merges compare-and-swap on it so concurrent ones don't lose updates
+    c.execute("PRAGMA table_info(user_profile)")
+    if "version" not in [row[1] for row in c.fetchall()]:
+        c.execute("ALTER TABLE user_profile ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def _chat_archive(c):
+    # Idle conversations' messages, one compressed blob per conversation (see archive.py)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS chat_archive (
+        conversation_id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        messages INTEGER NOT NULL,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+    )
+    """)
+    # The archive job looks for the longest-idle conversations
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at)")
+
+
+# Whether a feedback row says the recipe was made: a made_status of "made", in any case
+FEEDBACK_MADE = "lower(trim(coalesce({row}.made_status, ''))) = 'made'"
+FEEDBACK_STATS_COLUMNS = "feedback, made, rated, rating_sum"
+FEEDBACK_STATS_TABLES = {
+    # table: (key columns, key values of a feedback row); a row with a NULL key value is left
+    # out of that table, e.g. of the daily one when SQLite can't read its created_at
+    "feedback_stats_recipe": (("user_id", "recipe_name"), ("{row}.user_id", "coalesce({row}.recipe_name, '')")),
+    "feedback_stats_user": (("user_id",), ("{row}.user_id",)),
+    "feedback_stats_daily": (("user_id", "day"), ("{row}.user_id", "date({row}.created_at)")),
+}
+
+
+def _feedback_stats_add(row: str, skip_null_keys: bool = True) -> str:
+    """
+    Statements adding feedback row `row` (new) to every feedback_stats_* table.
+    Without `skip_null_keys` (the triggers as _feedback_stats first created them),
+    a NULL key value fails the insert.
+    """
+    statements = []
+    for table, (keys, values) in FEEDBACK_STATS_TABLES.items():
+        key_values = [value.format(row=row) for value in values]
+        where = " AND ".join(f"{value} IS NOT NULL" for value in key_values) if skip_null_keys else "true"
+        statements.append(f"""
+        INSERT INTO {table} ({", ".join(keys)}, {FEEDBACK_STATS_COLUMNS}, first_at, last_at)
+        SELECT {", ".join(key_values)}, 1, {FEEDBACK_MADE.format(row=row)}, {row}.rating IS NOT NULL, coalesce({row}.rating, 0),
+               {row}.created_at, {row}.created_at
+        WHERE {where}
+        ON CONFLICT ({", ".join(keys)}) DO UPDATE SET
+            feedback = feedback + 1,
+            made = made + excluded.made,
+            rated = rated + excluded.rated,
+            rating_sum = rating_sum + excluded.rating_sum,
+            first_at = min(first_at, excluded.first_at),
+            last_at = max(last_at, excluded.last_at);
+        """)
+    return "".join(statements)
+
+
+def _feedback_stats_remove(row: str) -> str:
+    """Statements taking feedback row `row` (old) back out; first_at and last_at stay as they were."""
+    statements = []
+    for table, (keys, values) in FEEDBACK_STATS_TABLES.items():
+        match = " AND ".join(f"{key} = {value.format(row=row)}" for key, value in zip(keys, values))
+        statements.append(f"""
+        UPDATE {table} SET
+            feedback = feedback - 1,
+            made = made - ({FEEDBACK_MADE.format(row=row)}),
+            rated = rated - ({row}.rating IS NOT NULL),
+            rating_sum = rating_sum - coalesce({row}.rating, 0)
+        WHERE {match};
+        DELETE FROM {table} WHERE {match} AND feedback <= 0;
+        """)
+    return "".join(statements)
+
+
+def _feedback_stats(c):
+    # Feedback counts, made counts and rating sums per recipe name, per user and per user and day,
+    # kept up to date by triggers so /api/feedback/stats never aggregates recipe_feedback itself
+    for table, (keys, _) in FEEDBACK_STATS_TABLES.items():
+        key_columns = "".join(f"{key} TEXT NOT NULL, " for key in keys)
+        c.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {key_columns}
+            feedback INTEGER NOT NULL,
+            made INTEGER NOT NULL,
+            rated INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL,
+            first_at TIMESTAMP,
+            last_at TIMESTAMP,
+            PRIMARY KEY ({", ".join(keys)})
+        ) WITHOUT ROWID
+        """)
+    # A user's best-rated recipes, read in index order
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_feedback_stats_recipe_top
+    ON feedback_stats_recipe(user_id, rating_sum * 1.0 / rated DESC, feedback DESC)
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_stats_insert AFTER INSERT ON recipe_feedback BEGIN
+        {_feedback_stats_add("new", skip_null_keys=False)}
+    END
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_stats_delete AFTER DELETE ON recipe_feedback BEGIN
+        {_feedback_stats_remove("old")}
+    END
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_stats_update
+    AFTER UPDATE OF user_id, recipe_name, made_status, rating, created_at ON recipe_feedback BEGIN
+        {_feedback_stats_remove("old")}
+        {_feedback_stats_add("new", skip_null_keys=False)}
+    END
+    """)
+    # Count the feedback given before the triggers existed. Rows with a NULL key value are
+    # skipped: a database with one never got past this migration, so this changes no migrated one
+    for table, (keys, values) in FEEDBACK_STATS_TABLES.items():
+        key_values = [value.format(row="f") for value in values]
+        c.execute(f"""
+        INSERT OR REPLACE INTO {table} ({", ".join(keys)}, {FEEDBACK_STATS_COLUMNS}, first_at, last_at)
+        SELECT {", ".join(key_values)}, COUNT(*),
+               SUM({FEEDBACK_MADE.format(row="f")}),
+               COUNT(f.rating), coalesce(SUM(f.rating), 0), MIN(f.created_at), MAX(f.created_at)
+        FROM recipe_feedback f
+        WHERE {" AND ".join(f"{value} IS NOT NULL" for value in key_values)}
+        GROUP BY {", ".join(key_values)}
+        """)
+
+
+def _usage_cost_nano(c):
+    # Costs in billionths of a dollar: a short embedding call costs well under a micro-dollar
+    for table in ("llm_usage", "llm_usage_daily"):
+        c.execute(f"PRAGMA table_info({table})")
+        if "cost_micro_usd" in [row[1] for row in c.fetchall()]:
+            c.execute(f"ALTER TABLE {table} RENAME COLUMN cost_micro_usd TO cost_nano_usd")
+            c.execute(f"UPDATE {table} SET cost_nano_usd = cost_nano_usd * 1000")
+
+
+def _feedback_stats_null_keys(c):
+    # Feedback whose created_at SQLite can't read has no day: leave it out of the daily stats
+    # instead of failing the insert (or the update that gives a row such a created_at)
+    c.execute("DROP TRIGGER IF EXISTS feedback_stats_insert")
+    c.execute(f"""
+    CREATE TRIGGER feedback_stats_insert AFTER INSERT ON recipe_feedback BEGIN
+        {_feedback_stats_add("new")}
+    END
+    """)
+    c.execute("DROP TRIGGER IF EXISTS feedback_stats_update")
+    c.execute(f"""
+    CREATE TRIGGER feedback_stats_update
+    AFTER UPDATE OF user_id, recipe_name, made_status, rating, created_at ON recipe_feedback BEGIN
+        {_feedback_stats_remove("old")}
+        {_feedback_stats_add("new")}
+    END
+    """)
+
+
+# Append only; a database at version N has had the first N applied
+MIGRATIONS = [
+    _base_tables,
+    _embedding_cache,
+    _llm_usage,
+    _recipe_library,
+    _full_text_search,
+    _profile_items,
+    _conversation_memory,
+    _profile_version,
+    _chat_archive,
+    _feedback_stats,
+    _usage_cost_nano,
+    _feedback_stats_null_keys,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str) -> int:
+    """Apply any pending migrations to the database at `db_path`. Returns how many were applied."""
+    conn = sqlite3.connect(db_path, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+    try:
+        if schema_version(conn) >= SCHEMA_VERSION:
+            return 0
+        # Lets archive.py give freed pages back; only takes effect before the first table exists
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have migrated while we waited for the lock
+            version = schema_version(conn)
+            for migration in MIGRATIONS[version:]:
+                migration(c)
+            c.execute(f"PRAGMA user_version = {max(version, SCHEMA_VERSION)}")
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return max(0, SCHEMA_VERSION - version)
+    finally:
+        conn.close()
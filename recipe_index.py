@@ -0,0 +1,460 @@
+"""
+Recipe library and approximate nearest-neighbour search over past recipes.
+
+Every generated recipe is stored in the `recipes` table together with a
+quantized embedding of the request that produced it. IVFIndex keeps those
+embeddings in memory as an inverted-file index: k-means centroids partition
+the vectors into lists, and a query only scans the `nprobe` lists whose
+centroids are closest to it. Until there are enough recipes to train
+centroids, the index is a single flat list.
+
+New recipes are appended to their nearest list immediately. When the index
+has grown to twice the size it was trained on, it is retrained in a
+background thread and swapped in. The index is saved to an .npz file; on
+startup it is loaded and then caught up with any recipes inserted since it
+was saved, so it never has to be rebuilt from scratch.
+
+With lexical retrieval on (lexical.py), the library also keeps a BM25
+index of each recipe's name, ingredients and the request it answered. It
+lives in memory only (roughly 1 KB per recipe): it is built from the
+recipes table on startup and grows with sync() like the ANN index.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+
+from embeddings import EmbeddingMatrix, load
+from lexical import LEXICAL_WEIGHT, BM25Index
+from metrics import span
+
+# Below this many vectors the index stays flat (exact search)
+TRAIN_MIN = 2048
+# k-means is trained on at most this many vectors
+TRAIN_SAMPLE = 16384
+KMEANS_ITERATIONS = 10
+DEFAULT_NPROBE = 4
+ASSIGN_BLOCK_ROWS = 4096
+# A filtered search sees this many times the candidates an unfiltered one does, since the
+# ones passing the filter are spread over more lists than the nearest vectors are
+FILTER_OVERPROBE = 4
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def _nearest_centroids(codes: np.ndarray, scales: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(codes), dtype=np.int64)
+    for start in range(0, len(codes), ASSIGN_BLOCK_ROWS):
+        stop = start + ASSIGN_BLOCK_ROWS
+        block = codes[start:stop].astype(np.float32) * scales[start:stop, None]
+        assignments[start:stop] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(codes: np.ndarray, scales: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on (a sample of) the quantized vectors."""
+    rng = np.random.default_rng(seed)
+    if len(codes) > TRAIN_SAMPLE:
+        sample = rng.choice(len(codes), TRAIN_SAMPLE, replace=False)
+        codes, scales = codes[sample], scales[sample]
+    vectors = codes.astype(np.float32) * scales[:, None]
+
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms == 0, 1.0, norms)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file index over int8-quantized, unit-norm embeddings."""
+
+    def __init__(self, nprobe: int = DEFAULT_NPROBE):
+        self.nprobe = nprobe
+        self.centroids: np.ndarray | None = None
+        self.trained_size = 0
+        self.last_id = 0
+        # Per list: consolidated arrays plus chunks appended since the last search
+        self._ids: list[np.ndarray] = [np.zeros(0, dtype=np.int64)]
+        self._codes: list[np.ndarray | None] = [None]
+        self._scales: list[np.ndarray] = [np.zeros(0, dtype=np.float32)]
+        self._pending: list[list] = [[]]
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(ids) for ids in self._ids) + sum(
+                len(chunk[0]) for pending in self._pending for chunk in pending
+            )
+
+    def _consolidate(self, list_no: int):
+        pending = self._pending[list_no]
+        if not pending:
+            return
+        parts = [(self._ids[list_no], self._codes[list_no], self._scales[list_no])] if self._codes[list_no] is not None else []
+        parts.extend(pending)
+        self._ids[list_no] = np.concatenate([p[0] for p in parts])
+        self._codes[list_no] = np.concatenate([p[1] for p in parts])
+        self._scales[list_no] = np.concatenate([p[2] for p in parts])
+        self._pending[list_no] = []
+
+    def add(self, ids, matrix: EmbeddingMatrix):
+        """Append quantized vectors to the lists of their nearest centroids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock:
+            if self.centroids is None:
+                self._pending[0].append((ids, matrix.codes, matrix.scales))
+            else:
+                assignments = _nearest_centroids(matrix.codes, matrix.scales, self.centroids)
+                for list_no in np.unique(assignments):
+                    mask = assignments == list_no
+                    self._pending[list_no].append((ids[mask], matrix.codes[mask], matrix.scales[mask]))
+            self.last_id = max(self.last_id, int(ids.max()))
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All ids, codes and scales currently held, as flat arrays."""
+        with self._lock:
+            for list_no in range(len(self._ids)):
+                self._consolidate(list_no)
+            present = [i for i, codes in enumerate(self._codes) if codes is not None and len(codes)]
+            if not present:
+                return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.int8), np.zeros(0, dtype=np.float32)
+            return (
+                np.concatenate([self._ids[i] for i in present]),
+                np.concatenate([self._codes[i] for i in present]),
+                np.concatenate([self._scales[i] for i in present]),
+            )
+
+    def needs_training(self) -> bool:
+        size = len(self)
+        if self.centroids is None:
+            return size >= TRAIN_MIN
+        return size >= 2 * self.trained_size
+
+    def train(self):
+        """Retrain centroids on everything in the index and redistribute the lists."""
+        ids, codes, scales = self.snapshot()
+        if len(ids) < TRAIN_MIN:
+            return
+        nlist = int(min(4096, max(16, 4 * np.sqrt(len(ids)))))
+        centroids = train_centroids(codes, scales, nlist)
+        assignments = _nearest_centroids(codes, scales, centroids)
+
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        new_ids, new_codes, new_scales = [], [], []
+        for list_no in range(nlist):
+            rows = order[bounds[list_no]:bounds[list_no + 1]]
+            new_ids.append(ids[rows])
+            new_codes.append(codes[rows])
+            new_scales.append(scales[rows])
+
+        with self._lock:
+            # Carry over anything added while training ran
+            current_ids, current_codes, current_scales = self.snapshot()
+            late = ~np.isin(current_ids, ids)
+            self.centroids = centroids
+            self.trained_size = len(ids)
+            self._ids, self._codes, self._scales = new_ids, new_codes, new_scales
+            self._pending = [[] for _ in range(nlist)]
+            if late.any():
+                self.add(current_ids[late], EmbeddingMatrix(current_codes[late], current_scales[late]))
+
+    def _scan(self, lists, query: np.ndarray, allowed: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+        """Ids and scores of the vectors in `lists`, only those in `allowed` if given."""
+        for list_no in lists:
+            self._consolidate(list_no)
+        lists = [list_no for list_no in lists if self._codes[list_no] is not None and len(self._codes[list_no])]
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids = np.concatenate([self._ids[list_no] for list_no in lists])
+        scales = np.concatenate([self._scales[list_no] for list_no in lists])
+        keep = np.isin(ids, allowed) if allowed is not None else None
+
+        # Widen every scanned list into one float32 block so scoring is a single matmul
+        block = np.empty((len(ids) if keep is None else int(keep.sum()), len(query)), dtype=np.float32)
+        position = offset = 0
+        for list_no in lists:
+            codes = self._codes[list_no]
+            if keep is not None:
+                codes = codes[keep[offset:offset + len(codes)]]
+                offset += len(self._codes[list_no])
+            np.copyto(block[position:position + len(codes)], codes, casting="unsafe")
+            position += len(codes)
+        if keep is not None:
+            ids, scales = ids[keep], scales[keep]
+        return ids, (block @ query) * scales
+
+    def search(self, query, k: int = 10, allowed=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Ids and cosine similarities of the (approximately) k nearest vectors, best first.
+        With `allowed` (ids), only those vectors are candidates. The probe is
+        widened by how selective that is (a filter passing 1% of vectors probes
+        100 times as many lists, times FILTER_OVERPROBE), and further until k of
+        them have been found.
+        """
+        query = _normalize(query)
+        if allowed is not None:
+            allowed = np.asarray(allowed, dtype=np.int64)
+        with self._lock:
+            if self.centroids is None:
+                order, nprobe = [0], 1
+            else:
+                order = np.argsort(self.centroids @ query)[::-1]
+                nprobe = self.nprobe
+                if allowed is not None:
+                    nprobe = int(np.ceil(nprobe * FILTER_OVERPROBE * len(self) / max(len(allowed), 1)))
+                nprobe = min(nprobe, len(order))
+            found_ids, found_scores = [], []
+            scanned = 0
+            while True:
+                ids, scores = self._scan(order[scanned:nprobe], query, allowed)
+                found_ids.append(ids)
+                found_scores.append(scores)
+                scanned = nprobe
+                if allowed is None or sum(map(len, found_ids)) >= k or scanned >= len(order):
+                    break
+                nprobe = min(2 * nprobe, len(order))
+
+        ids, scores = np.concatenate(found_ids), np.concatenate(found_scores)
+        if len(scores) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return ids[top], scores[top]
+
+    def save(self, path: str):
+        with self._lock:
+            for list_no in range(len(self._ids)):
+                self._consolidate(list_no)
+            dim = next((codes.shape[1] for codes in self._codes if codes is not None), 0)
+            codes = [c if c is not None else np.zeros((0, dim), dtype=np.int8) for c in self._codes]
+            centroids = self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32)
+            # A temporary file of its own, so workers saving at the same time don't write into each other's
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp.npz", dir=os.path.dirname(path) or ".")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    ids=np.concatenate(self._ids),
+                    codes=np.concatenate(codes) if dim else np.zeros((0, 0), dtype=np.int8),
+                    scales=np.concatenate(self._scales),
+                    list_sizes=np.array([len(ids) for ids in self._ids], dtype=np.int64),
+                    centroids=centroids,
+                    meta=np.array([self.trained_size, self.last_id, self.nprobe], dtype=np.int64),
+                )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            trained_size, last_id, nprobe = (int(v) for v in data["meta"])
+            ids, codes, scales = data["ids"], data["codes"], data["scales"]
+            list_sizes, centroids = data["list_sizes"], data["centroids"]
+
+        index = cls(nprobe=nprobe)
+        # Lists are stored back to back, so loading needs no re-assignment
+        bounds = np.concatenate([[0], np.cumsum(list_sizes)])
+        index._ids = [ids[bounds[i]:bounds[i + 1]] for i in range(len(list_sizes))]
+        index._codes = [codes[bounds[i]:bounds[i + 1]] if list_sizes[i] else None for i in range(len(list_sizes))]
+        index._scales = [scales[bounds[i]:bounds[i + 1]] for i in range(len(list_sizes))]
+        index._pending = [[] for _ in range(len(list_sizes))]
+        if centroids.size:
+            index.centroids = centroids
+            index.trained_size = trained_size
+        index.last_id = last_id
+        return index
+
+
+class RecipeLibrary:
+    """The recipes table plus its in-memory ANN index, and a BM25 index with `lexical`."""
+
+    SAVE_EVERY = 100
+
+    def __init__(self, db_path: str, index_path: str | None = None, lexical: bool = False):
+        self.db_path = db_path
+        self.index_path = index_path or db_path + ".recipes.npz"
+        self.index = IVFIndex.load(self.index_path) if os.path.exists(self.index_path) else IVFIndex()
+        self.lexical = BM25Index() if lexical else None
+        self._lexical_last_id = 0
+        self._unsaved = 0
+        self._training = threading.Lock()
+        # Serializes syncs and adds: each reads last_id and appends what is past it
+        self._lock = threading.RLock()
+        self.sync()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def sync(self):
+        """Add recipes inserted since the index was last saved (or by other workers)."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT id, embedding FROM recipes WHERE id > ? AND embedding IS NOT NULL ORDER BY id",
+                    (self.index.last_id,),
+                ).fetchall()
+            finally:
+                conn.close()
+            if rows:
+                self.index.add([row["id"] for row in rows], EmbeddingMatrix.from_blobs([row["embedding"] for row in rows]))
+                self._after_add(len(rows))
+            if self.lexical is not None:
+                self._sync_lexical()
+
+    def _sync_lexical(self):
+        # Recipes saved without an embedding (lexical retrieval) are indexed here too
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, name, request, recipe_data FROM recipes WHERE id > ? ORDER BY id",
+                (self._lexical_last_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            ingredients = json.loads(row["recipe_data"]).get("ingredients") or []
+            self.lexical.add(row["id"], " ".join([row["name"] or "", row["request"] or "", *map(str, ingredients)]))
+            self._lexical_last_id = row["id"]
+
+    def add(self, recipe_id: int, blob: bytes):
+        codes, scale = load(blob)
+        with self._lock:
+            self.index.add([recipe_id], EmbeddingMatrix(codes[None, :], np.array([scale], dtype=np.float32)))
+            self._after_add(1)
+
+    def _after_add(self, count: int):
+        self._unsaved += count
+        if self.index.needs_training() and self._training.acquire(blocking=False):
+            threading.Thread(target=self._train_in_background, daemon=True).start()
+        elif self._unsaved >= self.SAVE_EVERY:
+            self.save()
+
+    def _train_in_background(self):
+        try:
+            with span("recipe_index.train"):
+                self.index.train()
+            self.save()
+        finally:
+            self._training.release()
+
+    def save(self):
+        with self._lock:
+            self.index.save(self.index_path)
+            self._unsaved = 0
+
+    def clear(self):
+        """Drop every indexed recipe (after the recipes table has been emptied)."""
+        with self._lock:
+            self.index = IVFIndex(nprobe=self.index.nprobe)
+            if self.lexical is not None:
+                self.lexical = BM25Index()
+                self._lexical_last_id = 0
+            self.save()
+
+    def similar(
+        self,
+        query_embedding,
+        user_id: str,
+        k: int = 3,
+        min_rating: float = 7.0,
+        min_similarity: float = 0.0,
+        query_text: str | None = None,
+        retrieval: str = "embedding",
+    ) -> list[dict]:
+        """
+        Past recipes for `user_id` that are similar to the query and rated at
+        least `min_rating` on average. `retrieval` (see lexical.py) ranks by
+        embedding similarity, by BM25 on `query_text` (`query_embedding` may
+        then be None), or by both, mixed as in lib.item_relevance.
+        """
+        # The user's well-rated recipes are the only candidates, so ranking happens among them
+        # rather than among everyone's nearest recipes
+        conn = self._connect()
+        try:
+            eligible = [row[0] for row in conn.execute(
+                "SELECT id FROM recipes WHERE user_id = ? AND rating_count > 0 AND rating_sum >= ? * rating_count",
+                (user_id, min_rating),
+            )]
+        finally:
+            conn.close()
+        if not eligible:
+            return []
+
+        cosine, lexical = {}, {}
+        if retrieval != "lexical":
+            with span("recipe_index.search"):
+                ids, scores = self.index.search(query_embedding, k * 10, allowed=eligible)
+            cosine = {int(i): float(s) for i, s in zip(ids, scores)}
+            if retrieval == "embedding":
+                cosine = {i: s for i, s in cosine.items() if s >= min_similarity}
+        if retrieval != "embedding" and self.lexical is not None and query_text:
+            with span("recipe_index.lexical_search"):
+                lexical = dict(self.lexical.top(query_text, k * 10, allowed=set(eligible)))
+        candidates = cosine.keys() | lexical.keys()
+        if not candidates:
+            return []
+
+        conn = self._connect()
+        try:
+            placeholders = ",".join("?" * len(candidates))
+            rows = conn.execute(
+                f"""
+                SELECT id, name, recipe_data, rating_sum, rating_count, embedding
+                FROM recipes
+                WHERE id IN ({placeholders}) AND user_id = ?
+                  AND rating_count > 0 AND rating_sum >= ? * rating_count
+                """,
+                (*candidates, user_id, min_rating),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        results = []
+        for row in rows:
+            if retrieval == "embedding":
+                similarity = cosine[row["id"]]
+            elif retrieval == "lexical":
+                similarity = lexical[row["id"]]
+            else:
+                similarity = (1 - LEXICAL_WEIGHT) * self._cosine(row, cosine, query_embedding) + LEXICAL_WEIGHT * lexical.get(row["id"], 0.0)
+            if similarity < min_similarity:
+                continue
+            results.append({
+                "id": row["id"],
+                "name": row["name"],
+                "recipe": json.loads(row["recipe_data"]),
+                "similarity": similarity,
+                "rating": row["rating_sum"] / row["rating_count"],
+            })
+        results.sort(key=lambda r: r["similarity"], reverse=True)
+        return results[:k]
+
+    @staticmethod
+    def _cosine(row, cosine: dict, query_embedding) -> float:
+        """The ANN score if the search found the recipe, otherwise computed from its stored embedding."""
+        if row["id"] in cosine:
+            return cosine[row["id"]]
+        if row["embedding"] is None:
+            return 0.0
+        return float(EmbeddingMatrix.from_blobs([row["embedding"]]).scores(query_embedding)[0])
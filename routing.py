@@ -0,0 +1,178 @@
+"""
+Per-stage model routing with latency SLOs.
+
+Every completion stage in lib.py runs on the route ROUTES gives it: a model,
+a default max_tokens (used when the call doesn't set its own), a request
+timeout in seconds, and optionally a latency SLO with a fallback model.
+While a stage's p95 upstream latency over the last WINDOW_SECONDS is above
+its SLO (once there are at least MIN_SAMPLES calls to go by), its calls go
+to the fallback model instead. One call in PROBE_EVERY still goes to the
+primary, so its p95 keeps being measured and the stage switches back once
+it recovers. Failed calls count at the time they took, so a run of
+timeouts triggers the fallback too.
+
+Each call's upstream latency and the result of the stage's quality check
+(does the output parse, is a yes/no answer yes or no, ...) are recorded
+per stage and model: in /metrics as chefing_route_latency_seconds and
+chefing_route_quality_checks_total, and in /api/routes together with the
+current table. That is the evidence for moving a stage to a smaller model
+for good.
+
+Set CHEFING_ROUTES to a JSON file to change routes, e.g.
+    {"detect_recipe_request": {"model": "gpt-4o-mini"},
+     "generate_recipe": {"slo_ms": 8000, "fallback": "gpt-4o-mini"}}
+Stages and fields left out keep their defaults; "slo_ms": null turns a
+stage's fallback off, and a "default" entry routes stages not listed.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import ROUTE_FALLBACKS, ROUTE_LATENCY, ROUTE_QUALITY
+
+WINDOW_SECONDS = float(os.environ.get("CHEFING_ROUTE_WINDOW_SECONDS", "300"))
+MIN_SAMPLES = 20
+PROBE_EVERY = 20
+# Latency samples kept per stage and model, however busy the window
+MAX_SAMPLES = 1000
+
+
+class Route:
+    __slots__ = ("model", "max_tokens", "timeout", "slo_ms", "fallback")
+
+    def __init__(self, model: str, max_tokens: int | None = None, timeout: float = 60.0, slo_ms: float | None = None, fallback: str | None = None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.slo_ms = slo_ms
+        self.fallback = fallback
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+DEFAULT_ROUTES = {
+    # Recipes are the product: no fallback to a weaker model unless configured
+    "generate_recipe": Route("gpt-4o", timeout=60.0),
+    "generate_recipe_from_fridge": Route("gpt-4o", timeout=60.0),
+    "detect_recipe_request": Route("gpt-4o", max_tokens=10, timeout=10.0, slo_ms=1500, fallback="gpt-4o-mini"),
+    "generate_conversation_title": Route("gpt-4o", max_tokens=15, timeout=10.0, slo_ms=2000, fallback="gpt-4o-mini"),
+    "parse_new_user_information": Route("gpt-4o", timeout=30.0, slo_ms=5000, fallback="gpt-4o-mini"),
+    "parse_user_profile_information": Route("gpt-4o", timeout=30.0, slo_ms=8000, fallback="gpt-4o-mini"),
+    "compute_long_term_delta_with_llm": Route("gpt-4o", timeout=30.0, slo_ms=8000, fallback="gpt-4o-mini"),
+    "update_long_term_from_feedback": Route("gpt-4o", timeout=30.0, slo_ms=8000, fallback="gpt-4o-mini"),
+    "summarize_conversation": Route("gpt-4o", timeout=30.0, slo_ms=8000, fallback="gpt-4o-mini"),
+}
+
+
+def load_routes(path: str | None = None) -> dict[str, Route]:
+    """DEFAULT_ROUTES with the overrides in the JSON file at `path` applied."""
+    routes = dict(DEFAULT_ROUTES)
+    if not path:
+        return routes
+    with open(path) as f:
+        overrides = json.load(f)
+    for stage, fields in overrides.items():
+        unknown = set(fields) - set(Route.__slots__)
+        if unknown:
+            raise ValueError(f"{path}: unknown route fields for {stage}: {', '.join(sorted(unknown))}")
+        base = routes.get(stage) or Route(fields.get("model", "gpt-4o"))
+        routes[stage] = Route(**{**base.as_dict(), **fields})
+    return routes
+
+
+ROUTES = load_routes(os.environ.get("CHEFING_ROUTES"))
+
+
+def _p95(values) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class Router:
+    """Chooses each call's model and keeps the recent latency and quality of every (stage, model)."""
+
+    def __init__(self, routes: dict[str, Route]):
+        self.routes = routes
+        self._lock = threading.Lock()
+        # (stage, model) -> deque of (monotonic time, seconds), and quality checks passed/failed
+        self._latencies: dict[tuple[str, str], deque] = {}
+        self._quality: dict[tuple[str, str], list[int]] = {}
+        self._calls: dict[str, int] = {}
+
+    def route(self, stage: str) -> Route:
+        return self.routes.get(stage) or self.routes.get("default") or Route("gpt-4o")
+
+    def p95_ms(self, stage: str, model: str) -> float | None:
+        """p95 latency of the stage on the model over the window, or None with too few calls."""
+        with self._lock:
+            samples = self._window(stage, model)
+            if len(samples) < MIN_SAMPLES:
+                return None
+            return _p95(seconds for _, seconds in samples) * 1000
+
+    def _window(self, stage: str, model: str) -> deque:
+        samples = self._latencies.setdefault((stage, model), deque(maxlen=MAX_SAMPLES))
+        cutoff = time.monotonic() - WINDOW_SECONDS
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return samples
+
+    def choose(self, stage: str) -> tuple[str, Route]:
+        """The model for the stage's next call, and its route."""
+        route = self.route(stage)
+        if route.slo_ms is None or not route.fallback:
+            return route.model, route
+        p95 = self.p95_ms(stage, route.model)
+        if p95 is None or p95 <= route.slo_ms:
+            return route.model, route
+        with self._lock:
+            calls = self._calls[stage] = self._calls.get(stage, 0) + 1
+        if calls % PROBE_EVERY == 0:
+            return route.model, route
+        ROUTE_FALLBACKS.inc(stage, route.fallback)
+        return route.fallback, route
+
+    def record_latency(self, stage: str, model: str, seconds: float):
+        ROUTE_LATENCY.observe(stage, model, value=seconds)
+        with self._lock:
+            self._window(stage, model).append((time.monotonic(), seconds))
+
+    def record_quality(self, stage: str, model: str, passed: bool):
+        ROUTE_QUALITY.inc(stage, model, "pass" if passed else "fail")
+        with self._lock:
+            counts = self._quality.setdefault((stage, model), [0, 0])
+            counts[0 if passed else 1] += 1
+
+    def stats(self) -> dict:
+        """The routing table plus recent p95 and quality-check totals per stage and model."""
+        with self._lock:
+            keys = set(self._latencies) | set(self._quality)
+            observed = {}
+            for stage, model in sorted(keys):
+                samples = self._window(stage, model)
+                passed, failed = self._quality.get((stage, model), (0, 0))
+                observed.setdefault(stage, {})[model] = {
+                    "calls": len(samples),
+                    "p95_ms": round(_p95(s for _, s in samples) * 1000, 1) if samples else None,
+                    "quality_passed": passed,
+                    "quality_failed": failed,
+                    "quality_pass_rate": round(passed / (passed + failed), 3) if passed + failed else None,
+                }
+        stages = {}
+        for stage in sorted(set(self.routes) | set(observed)):
+            route = self.route(stage)
+            p95 = (observed.get(stage, {}).get(route.model) or {}).get("p95_ms")
+            stages[stage] = {
+                "route": route.as_dict(),
+                "degraded": bool(route.slo_ms and route.fallback and p95 is not None and p95 > route.slo_ms
+                                 and observed[stage][route.model]["calls"] >= MIN_SAMPLES),
+                "models": observed.get(stage, {}),
+            }
+        return {"window_seconds": WINDOW_SECONDS, "stages": stages}
+
+
+router = Router(ROUTES)
@@ -0,0 +1,85 @@
+"""
+Request coalescing for upstream LLM calls.
+
+Double-clicks, frontend retries, several open tabs and different users asking
+the same thing all produce identical completion or embedding requests. While
+one such request is in flight, identical ones wait for its result instead of
+making their own upstream call. Requests are identical when their canonical
+key matches: a hash of the model, messages, response schema and other
+arguments, in sorted-key JSON.
+
+The first caller (the leader) makes the call; callers arriving while it runs
+(followers) share its result, or its exception if the upstream call failed.
+If the leader is cancelled or interrupted instead (any BaseException that is
+not an Exception, such as a disconnect cancelling its task), the call does not
+count as failed: waiting followers retry, and one of them becomes the new
+leader. Nothing is cached once the call returns.
+"""
+
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+
+from metrics import SINGLEFLIGHT_CALLS
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+def canonical_key(kind: str, arguments: dict) -> str:
+    """Stable hash of an upstream request's arguments."""
+    payload = json.dumps(arguments, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{kind}\n{payload}".encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key: str, fn, stage: str = "") -> tuple[object, bool]:
+        """
+        Run `fn()` unless an identical call is already in flight, in which case
+        wait for that one. Returns (result, shared): shared is True for followers,
+        whose result was produced (and paid for) by another caller.
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+
+            if leader:
+                SINGLEFLIGHT_CALLS.inc(stage, "leader")
+                try:
+                    result = fn()
+                except Exception as e:
+                    future.set_exception(e)
+                    raise
+                except BaseException:
+                    # Cancelled, not failed: let a follower make the call instead
+                    future.set_exception(_LeaderCancelled())
+                    raise
+                else:
+                    future.set_result(result)
+                    return result, False
+                finally:
+                    with self._lock:
+                        if self._calls.get(key) is future:
+                            del self._calls[key]
+
+            try:
+                result = future.result()
+            except _LeaderCancelled:
+                SINGLEFLIGHT_CALLS.inc(stage, "retried")
+                continue
+            SINGLEFLIGHT_CALLS.inc(stage, "follower")
+            return result, True
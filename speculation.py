@@ -0,0 +1,154 @@
+"""
+Speculative recipe generation.
+
+On the text path the chat endpoint asks the LLM whether a message is a
+recipe request and only then generates the recipe: two gpt-4o round trips
+back to back. With speculation, generation starts on a worker thread at the
+same time as the intent check. Its result is used if the message is a recipe
+request and thrown away otherwise.
+
+CHEFING_SPECULATIVE picks the policy:
+- never (default): no speculation.
+- heuristic: speculate only when the message looks like a food request.
+- always: speculate on every text message.
+
+The generation is streamed. A discarded one that has not started yet is
+cancelled; one already sent upstream is aborted at its next token, which
+closes the stream, and the tokens it had streamed are counted as wasted
+(prompt tokens are only reported at the end of a stream, so an aborted
+generation's are not). Once used, the tokens streamed so far are passed on
+to the request's own on_token, and the rest as they arrive, so a /ws/chat
+turn cancelled while waiting stops the generation too.
+Compare chefing_speculation_wasted_tokens_total with
+chefing_speculation_saved_seconds_total to tune the policy.
+"""
+
+import contextvars
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from accounting import separate_usage
+from lib import estimate_tokens
+from metrics import SPECULATION_SAVED_SECONDS, SPECULATION_WASTED_TOKENS, SPECULATIONS
+
+POLICIES = ("never", "heuristic", "always")
+POLICY = os.environ.get("CHEFING_SPECULATIVE", "never").lower()
+if POLICY not in POLICIES:
+    raise ValueError(f"CHEFING_SPECULATIVE must be one of {', '.join(POLICIES)}, not {POLICY!r}")
+
+# Words that make a recipe request likely enough to be worth speculating on
+RECIPE_HINTS = re.compile(
+    r"\b(?:recipes?|cook\w*|make|making|bake|hungry|starving|dinner|lunch|breakfast|brunch|supper|meals?|snacks?|"
+    r"dessert|eat|food|dish|suggest\w*|ideas?|what should i|tonight)\b",
+    re.IGNORECASE,
+)
+WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="speculation")
+        return _executor
+
+
+def should_speculate(message: str, policy: str = POLICY) -> bool:
+    """Whether `policy` calls for speculating on this message."""
+    if policy == "always":
+        return True
+    if policy == "heuristic":
+        return RECIPE_HINTS.search(message) is not None
+    return False
+
+
+class SpeculationDiscarded(Exception):
+    """Raised from a discarded generation's token callback, which aborts its stream."""
+
+
+class Speculation:
+    """A generation started ahead of the decision whether it is needed. `fn` must take `on_token`."""
+
+    def __init__(self, fn, *args, policy: str = POLICY, **kwargs):
+        self.policy = policy
+        self.started = time.perf_counter()
+        self.finished = None
+        self.usage = None
+        # Completion tokens streamed so far, estimated, for when the call is aborted before reporting usage
+        self.streamed_tokens = 0
+        self._tokens = []
+        self._forward = None
+        self._discarded = False
+        self._lock = threading.Lock()
+        kwargs["on_token"] = self._on_token
+        # Copied so spans, metrics and usage attribution see the request's context
+        context = contextvars.copy_context()
+        self._future = _get_executor().submit(context.run, self._run, fn, args, kwargs)
+
+    def _on_token(self, text: str):
+        with self._lock:
+            if self._discarded:
+                raise SpeculationDiscarded()
+            self.streamed_tokens += estimate_tokens(text)
+            if self._forward is None:
+                self._tokens.append(text)
+                return
+        self._forward(text)
+
+    def _run(self, fn, args, kwargs):
+        with separate_usage() as usage:
+            self.usage = usage
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.finished = time.perf_counter()
+
+    def result(self, on_token=None):
+        """
+        Wait for and return the generation, which turned out to be needed.
+        `on_token` gets the tokens streamed so far, then the rest as they arrive.
+        """
+        decided = time.perf_counter()
+        if on_token is not None:
+            try:
+                with self._lock:
+                    # Under the lock so no token overtakes the ones before it
+                    if self._tokens:
+                        on_token("".join(self._tokens))
+                    self._tokens = []
+                    self._forward = on_token
+            except BaseException:
+                self.discard()
+                raise
+        result = self._future.result()
+        # Run in sequence this would have taken decision time + generation time;
+        # overlapped it took the longer of the two
+        saved = min(decided - self.started, self.finished - self.started)
+        SPECULATIONS.inc(self.policy, "used")
+        SPECULATION_SAVED_SECONDS.inc(amount=saved)
+        return result
+
+    def discard(self):
+        """The generation is not needed: cancel it, or abort it and count its tokens as wasted."""
+        SPECULATIONS.inc(self.policy, "wasted")
+        with self._lock:
+            self._discarded = True
+            self._tokens = []
+        if self._future.cancel():
+            return
+        self._future.add_done_callback(self._record_waste)
+
+    def _record_waste(self, future):
+        if self.usage is not None and self.usage.events:
+            # It finished before the abort took effect: the usage it reported
+            for event in self.usage.events:
+                SPECULATION_WASTED_TOKENS.inc("prompt", amount=event.prompt_tokens)
+                SPECULATION_WASTED_TOKENS.inc("completion", amount=event.completion_tokens)
+            return
+        SPECULATION_WASTED_TOKENS.inc("completion", amount=self.streamed_tokens)
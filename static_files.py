@@ -0,0 +1,232 @@
+"""
+Static file serving for the built frontend and uploads.
+
+Vite writes content-hashed asset names (index-DG63AMkx.js), so those are
+served with a year-long immutable Cache-Control: a new build means new URLs.
+After a build, `python -m static_files static` writes .br/.gz siblings for
+every compressible file, and the variant the client accepts is sent as-is
+with no compression work per request. index.html is read once, kept in
+memory and revalidated by ETag; uploads are served from disk with ETag
+revalidation.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional; only gzip variants are written without it
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Cache, but check the ETag before every reuse
+REVALIDATE = "no-cache"
+
+# Vite's default [name]-[hash].[ext] file names; the hash is 8 URL-safe base64 characters
+HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+# Content-Encoding and file suffix of each precompressed variant, most preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+COMPRESSIBLE_EXTENSIONS = (".html", ".js", ".mjs", ".css", ".svg", ".json", ".txt", ".map", ".webmanifest")
+# Below this, the compressed body saves less than the Content-Encoding header costs
+MIN_COMPRESS_BYTES = 512
+
+
+def accepted_encodings(accept_encoding: str | None) -> set[str]:
+    """Content codings the client accepts, from an Accept-Encoding header (q=0 means refused)."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def _accepts(accepted: set[str], encoding: str) -> bool:
+    return encoding in accepted or "*" in accepted
+
+
+def is_not_modified(etag: str, request_headers: Headers) -> bool:
+    """Whether the request's If-None-Match already names `etag`."""
+    if_none_match = request_headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that sends a .br or .gz sibling of the requested file when the
+    client accepts that encoding, and marks content-hashed files immutable.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Full path -> [(encoding, variant path, stat)], found once per file
+        self._variants: dict[str, list] = {}
+
+    def _find_variants(self, full_path: str) -> list:
+        variants = self._variants.get(full_path)
+        if variants is None:
+            variants = []
+            for encoding, suffix in ENCODINGS:
+                try:
+                    variants.append((encoding, full_path + suffix, os.stat(full_path + suffix)))
+                except OSError:
+                    pass
+            self._variants[full_path] = variants
+        return variants
+
+    def file_response(self, full_path, stat_result, scope, status_code=200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        headers = {"Vary": "Accept-Encoding"}
+        if HASHED_NAME.search(full_path):
+            headers["Cache-Control"] = IMMUTABLE
+
+        accepted = accepted_encodings(request_headers.get("accept-encoding"))
+        for encoding, variant_path, variant_stat in self._find_variants(full_path):
+            if _accepts(accepted, encoding):
+                full_path, stat_result = variant_path, variant_stat
+                headers["Content-Encoding"] = encoding
+                break
+
+        # The ETag comes from the file actually sent, so each encoding gets its own
+        response = FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result, media_type=media_type, headers=headers
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class CachedFile:
+    """
+    A small file (index.html) read once, along with its precompressed
+    variants, and served from memory. Restart the app to pick up a new build.
+    """
+
+    def __init__(self, path: str, media_type: str, cache_control: str = REVALIDATE):
+        self.path = path
+        self.media_type = media_type
+        self.cache_control = cache_control
+        # Encoding (None for identity) -> (body, etag); None until loaded
+        self._bodies: dict[str | None, tuple[bytes, str]] | None = None
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return False
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        bodies = {None: (body, f'"{digest}"')}
+        for encoding, suffix in ENCODINGS:
+            try:
+                with open(self.path + suffix, "rb") as f:
+                    bodies[encoding] = (f.read(), f'"{digest}-{encoding}"')
+            except OSError:
+                pass
+        self._bodies = bodies
+        return True
+
+    def response(self, request_headers: Headers) -> Response | None:
+        """The file as a response for this request, or None if it does not exist."""
+        if self._bodies is None and not self._load():
+            return None
+        accepted = accepted_encodings(request_headers.get("accept-encoding"))
+        encoding = next((e for e, _ in ENCODINGS if e in self._bodies and _accepts(accepted, e)), None)
+        body, etag = self._bodies[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        if is_not_modified(etag, request_headers):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+def safe_join(directory: str, path: str) -> str | None:
+    """`path` under `directory`, or None if it would escape it."""
+    root = os.path.realpath(directory)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        return None
+    return full_path
+
+
+def file_response(path: str, request_headers: Headers, cache_control: str = REVALIDATE) -> Response | None:
+    """A file from disk with ETag revalidation, or None if it is not a regular file."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    response = FileResponse(path, stat_result=stat_result, headers={"Cache-Control": cache_control})
+    if is_not_modified(response.headers["etag"], request_headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+
+def compress_directory(directory: str) -> list[tuple[str, int, dict[str, int]]]:
+    """
+    Write .gz (and .br, when brotli is installed) next to every compressible
+    file under `directory`, keeping only variants smaller than the original.
+    Returns (path, original size, {encoding: compressed size}) per file.
+    """
+    results = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                data = f.read()
+            sizes = {}
+            if len(data) >= MIN_COMPRESS_BYTES:
+                # mtime=0 so rebuilding identical input gives identical bytes (and ETags)
+                compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    compressed["br"] = brotli.compress(data, quality=11)
+                for encoding, suffix in ENCODINGS:
+                    body = compressed.get(encoding)
+                    if body is not None and len(body) < len(data):
+                        with open(path + suffix, "wb") as f:
+                            f.write(body)
+                        sizes[encoding] = len(body)
+            # Drop variants from an earlier build that no longer apply
+            for encoding, suffix in ENCODINGS:
+                if encoding not in sizes and os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            results.append((path, len(data), sizes))
+    return results
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else "static"
+    for path, size, sizes in compress_directory(directory):
+        variants = ", ".join(f"{encoding} {compressed}" for encoding, compressed in sizes.items()) or "skipped"
+        print(f"{path}: {size} -> {variants}")
+    if brotli is None:
+        print("brotli is not installed; wrote gzip variants only")
@@ -0,0 +1,110 @@
+"""
+Downscaled renditions of uploaded fridge images.
+
+Each upload gets a "thumb" and a "medium" JPEG next to the original
+(uploads/<id>.thumb.jpg, uploads/<id>.medium.jpg), written by a small
+background thread pool so the upload request does not wait for them.
+Until a rendition exists, or when an image is already smaller than it,
+the original is served in its place.
+
+Renditions are made with Pillow, a project dependency. In an install
+without it no renditions are made and every size resolves to the original.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # not installed; originals are served for every size
+    Image = None
+
+# Longest edge in pixels. The chat UI shows images at up to 320 CSS pixels, so
+# "thumb" covers that on 2x displays.
+RENDITIONS = {"thumb": 640, "medium": 1280}
+ORIGINAL = "original"
+JPEG_QUALITY = 80
+# Resizing is mostly native code that releases the GIL, so threads are enough
+WORKERS = 2
+
+logger = logging.getLogger("chefing.thumbnails")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_path(path: str, size: str) -> str:
+    """Where the `size` rendition of the image at `path` is stored."""
+    return f"{os.path.splitext(path)[0]}.{size}.jpg"
+
+
+def resolve(path: str, size: str | None) -> str:
+    """The rendition of `path` to serve for `size`, falling back to the original."""
+    if size in RENDITIONS:
+        candidate = rendition_path(path, size)
+        if os.path.isfile(candidate):
+            return candidate
+    return path
+
+
+def make_renditions(path: str) -> dict[str, str]:
+    """Write every rendition smaller than the original. Returns size -> path of those written."""
+    if Image is None:
+        return {}
+    written = {}
+    with Image.open(path) as image:
+        # Let the JPEG decoder scale down while decoding, which is far cheaper than a full decode
+        largest = max(RENDITIONS.values())
+        image.draft("RGB", (largest, largest))
+        # Phone photos carry their rotation in EXIF, which is dropped on re-encode
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # Largest first, so each smaller rendition is scaled from the previous one
+        for size, edge in sorted(RENDITIONS.items(), key=lambda item: -item[1]):
+            if max(image.size) <= edge:
+                continue
+            image = image.copy()
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            target = rendition_path(path, size)
+            # Write then rename, so a half-written file is never served
+            partial = target + ".partial"
+            image.save(partial, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(partial, target)
+            written[size] = target
+    return written
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="thumbnails")
+        return _executor
+
+
+def submit(path: str):
+    """Make the renditions of `path` in the background. Returns the future, or None without Pillow."""
+    if Image is None:
+        return None
+    return _get_executor().submit(_make_renditions_logged, path)
+
+
+def _make_renditions_logged(path: str) -> dict[str, str]:
+    try:
+        return make_renditions(path)
+    except Exception:
+        # A bad or unsupported image only loses its renditions; the original is still served
+        logger.exception("Could not make renditions of %s", path)
+        return {}
+
+
+def shutdown(wait: bool = True):
+    """Stop the worker pool, by default after finishing queued images."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
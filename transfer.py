@@ -0,0 +1,359 @@
+"""
+Export and import of a user's data as NDJSON.
+
+An export is one JSON object per line, each with a "type":
+
+    {"type": "export", "format": 1, "user_id": ..., "exported_at": ...}
+    {"type": "profile", "long_term_instructions": [...], ...}
+    {"type": "conversation", "id": ..., "title": ..., ...}   every conversation
+    {"type": "message", "id": ..., "conversation_id": ..., ...}   every chat message
+    {"type": "feedback", "id": ..., "recipe_name": ..., ...}   every feedback row
+
+export_lines() reads everything in one read transaction, so the export is a
+consistent snapshot, and walks each table with a cursor EXPORT_FETCH rows at
+a time. Messages of archived conversations (archive.py) follow the others.
+Stored JSON (chat responses, recipes) is copied into the output verbatim. Memory stays constant however many rows there are.
+
+Importer adds an export's records to a database in IMPORT_BATCH-record
+transactions through the single writer (db_writer.py). Conversations get
+new ids, and their messages follow them. A batch that fails rolls back on
+its own, and the batches before it stay imported. Uploaded images and the
+recipe library are not part of an export.
+
+Also usable without the server:
+    python -m transfer export database.db > backup.ndjson
+    python -m transfer import database.db backup.ndjson
+"""
+
+import json
+import sys
+import time
+
+import archive
+import db_writer
+from fastjson import BOOL, RAW, dumps, loads, row_encoder
+
+FORMAT = 1
+# Rows fetched from a cursor at a time, and bytes of NDJSON per response chunk
+EXPORT_FETCH = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Records per import transaction
+IMPORT_BATCH = 5000
+
+PROFILE_CATEGORIES = (
+    "long_term_instructions",
+    "long_term_preferences",
+    "long_term_restrictions",
+    "long_term_situation",
+)
+
+# Per record type: the query reading it (user_id is the only parameter) and how each column is encoded
+EXPORT_TABLES = {
+    "profile": (
+        f"SELECT {', '.join(PROFILE_CATEGORIES)}, updated_at FROM user_profile WHERE user_id = ?",
+        {**{category: RAW for category in PROFILE_CATEGORIES}, "updated_at": None},
+    ),
+    "conversation": (
+        """
+        SELECT id, title, summary, summary_through, created_at, updated_at
+        FROM conversations WHERE user_id = ? ORDER BY id
+        """,
+        {"id": None, "title": None, "summary": None, "summary_through": None, "created_at": None, "updated_at": None},
+    ),
+    "message": (
+        """
+        SELECT id, conversation_id, message, response, has_image, image_path, created_at
+        FROM chat WHERE user_id = ? ORDER BY conversation_id, id
+        """,
+        {
+            "id": None,
+            "conversation_id": None,
+            "message": None,
+            "response": RAW,
+            "has_image": BOOL,
+            "image_path": None,
+            "created_at": None,
+        },
+    ),
+    "feedback": (
+        """
+        SELECT id, recipe_name, recipe_data, made_status, rating, comments, created_at
+        FROM recipe_feedback WHERE user_id = ? ORDER BY id
+        """,
+        {
+            "id": None,
+            "recipe_name": None,
+            "recipe": RAW,
+            "made_status": None,
+            "rating": None,
+            "comments": None,
+            "created_at": None,
+        },
+    ),
+}
+
+
+class ImportFailed(ValueError):
+    """A record could not be imported; `line` is its 1-based line number."""
+
+    def __init__(self, line: int, reason: str):
+        super().__init__(f"line {line}: {reason}")
+        self.line = line
+
+
+def export_lines(db_path: str, user_id: str):
+    """Yield the user's data as NDJSON, in chunks of about EXPORT_CHUNK_BYTES."""
+    # Iterated from whichever threadpool thread serves the next chunk
+    conn = db_writer.connect(db_path, isolation_level=None, check_same_thread=False)
+    try:
+        conn.execute("BEGIN")
+        header = {"type": "export", "format": FORMAT, "user_id": user_id, "exported_at": int(time.time())}
+        chunk = [dumps(header) + b"\n"]
+        size = len(chunk[0])
+        for record_type, (query, fields) in EXPORT_TABLES.items():
+            encode_row = row_encoder(fields, {"type": record_type})
+            for rows in _row_batches(conn, record_type, query, user_id):
+                for row in rows:
+                    line = encode_row(row) + b"\n"
+                    chunk.append(line)
+                    size += len(line)
+                if size >= EXPORT_CHUNK_BYTES:
+                    yield b"".join(chunk)
+                    chunk, size = [], 0
+        if chunk:
+            yield b"".join(chunk)
+    finally:
+        conn.close()
+
+
+def _row_batches(conn, record_type: str, query: str, user_id: str):
+    cursor = conn.execute(query, (user_id,))
+    while rows := cursor.fetchmany(EXPORT_FETCH):
+        yield rows
+    if record_type == "message":
+        # Then archived conversations' messages, decompressed one conversation at a time
+        archived = conn.execute("SELECT conversation_id FROM chat_archive WHERE user_id = ? ORDER BY conversation_id", (user_id,))
+        for (conversation_id,) in archived.fetchall():
+            yield [(message_id, conversation_id, *rest) for message_id, *rest in archive.load(conn, conversation_id)]
+
+
+def _parse(number: int, line: bytes) -> dict:
+    try:
+        record = loads(line)
+    except ValueError as e:
+        raise ImportFailed(number, f"not JSON ({e})")
+    if not isinstance(record, dict) or record.get("type") not in ("export", *EXPORT_TABLES):
+        raise ImportFailed(number, "not an export record")
+    if record["type"] == "export" and record.get("format") != FORMAT:
+        raise ImportFailed(number, f"unsupported export format {record.get('format')!r}")
+    return record
+
+
+def _text(record: dict, key: str, number: int):
+    value = record.get(key)
+    if value is not None and not isinstance(value, str):
+        raise ImportFailed(number, f"{key} must be a string")
+    return value
+
+
+def _timestamp(c, record: dict, key: str, number: int):
+    value = _text(record, key, number)
+    # Whatever SQLite's date functions can read, as the feedback stats are kept by date(created_at)
+    if value is not None and c.execute("SELECT date(?)", (value,)).fetchone()[0] is None:
+        raise ImportFailed(number, f"{key} is not a timestamp")
+    return value
+
+
+def _rating(record: dict, number: int):
+    value = record.get("rating")
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+        raise ImportFailed(number, "rating must be an integer")
+    return value
+
+
+def _json(record: dict, key: str, number: int) -> str:
+    if key not in record:
+        raise ImportFailed(number, f"missing {key}")
+    return dumps(record[key]).decode("utf-8")
+
+
+class Importer:
+    """
+    Imports one export into `db_path` for `user_id`. Feed it the export's
+    lines in order with write(); `counts` says how many of each record type
+    were added. `store_profile(c, user_id, profile)` replaces the profile.
+    """
+
+    def __init__(self, db_path: str, user_id: str, store_profile):
+        self.db_path = db_path
+        self.user_id = user_id
+        self.store_profile = store_profile
+        self.counts = {record_type: 0 for record_type in EXPORT_TABLES}
+        # Exported conversation id -> new id, and the message ids summaries run up to
+        self._conversations: dict[int, int] = {}
+        self._summary_through: dict[int, int] = {}
+
+    def write(self, lines: list[tuple[int, bytes]]):
+        """Import (line number, line) pairs in one transaction. Raises ImportFailed."""
+        records = [(number, _parse(number, line)) for number, line in lines if line.strip()]
+        if records:
+            db_writer.write(self.db_path, lambda conn: self._insert(conn.cursor(), records))
+
+    def _insert(self, c, records: list[tuple[int, dict]]):
+        # Conversations added by this batch, kept apart until it has all gone through
+        added = {}
+        counts = dict.fromkeys(self.counts, 0)
+        messages, feedback = [], []
+        for number, record in records:
+            record_type = record["type"]
+            if record_type == "profile":
+                profile = {}
+                for category in PROFILE_CATEGORIES:
+                    items = record.get(category, [])
+                    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+                        raise ImportFailed(number, f"{category} must be a list of strings")
+                    profile[category] = items
+                self.store_profile(c, self.user_id, profile)
+            elif record_type == "conversation":
+                c.execute(
+                    """
+                    INSERT INTO conversations (user_id, title, summary, created_at, updated_at)
+                    VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+                    """,
+                    (
+                        self.user_id,
+                        _text(record, "title", number),
+                        _text(record, "summary", number),
+                        _timestamp(c, record, "created_at", number),
+                        _timestamp(c, record, "updated_at", number),
+                    ),
+                )
+                added[record.get("id")] = c.lastrowid
+                if record.get("summary_through"):
+                    self._summary_through[c.lastrowid] = record["summary_through"]
+            elif record_type == "message":
+                exported_id = record.get("conversation_id")
+                conversation_id = added.get(exported_id, self._conversations.get(exported_id))
+                if conversation_id is None:
+                    raise ImportFailed(number, "message of a conversation not in the export")
+                messages.append((
+                    record.get("id"),
+                    (
+                        conversation_id,
+                        self.user_id,
+                        _text(record, "message", number) or "",
+                        _json(record, "response", number),
+                        1 if record.get("has_image") else 0,
+                        _text(record, "image_path", number),
+                        _timestamp(c, record, "created_at", number),
+                    ),
+                ))
+            elif record_type == "feedback":
+                feedback.append((
+                    self.user_id,
+                    _text(record, "recipe_name", number),
+                    _json(record, "recipe", number),
+                    _text(record, "made_status", number),
+                    _rating(record, number),
+                    _text(record, "comments", number),
+                    _timestamp(c, record, "created_at", number),
+                ))
+            if record_type in counts:
+                counts[record_type] += 1
+
+        summaries = self._insert_messages(c, messages)
+        if feedback:
+            c.executemany(
+                """
+                INSERT INTO recipe_feedback
+                (user_id, recipe_name, recipe_data, made_status, rating, comments, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                """,
+                feedback,
+            )
+        for conversation_id, message_id in summaries:
+            c.execute("UPDATE conversations SET summary_through = ? WHERE id = ?", (message_id, conversation_id))
+
+        # Only once the transaction's inserts have all gone through
+        self._conversations.update(added)
+        for summarized in summaries:
+            del self._summary_through[summarized[0]]
+        for record_type, count in counts.items():
+            self.counts[record_type] += count
+
+    def _insert_messages(self, c, messages) -> list[tuple[int, int]]:
+        """Insert chat rows; returns (conversation id, new message id) for summaries that run up to one."""
+        summaries = []
+        plain = []
+        for old_id, row in messages:
+            if old_id is not None and self._summary_through.get(row[0]) == old_id:
+                # The summary's last message needs its new id, so it is inserted on its own
+                c.executemany(CHAT_INSERT, plain)
+                plain = []
+                c.execute(CHAT_INSERT, row)
+                summaries.append((row[0], c.lastrowid))
+            else:
+                plain.append(row)
+        c.executemany(CHAT_INSERT, plain)
+        return summaries
+
+
+CHAT_INSERT = """
+    INSERT INTO chat (conversation_id, user_id, message, response, has_image, image_path, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+"""
+
+
+def read_lines(f):
+    """(line number, line) pairs of a binary file, in IMPORT_BATCH-sized lists."""
+    batch = []
+    for number, line in enumerate(f, 1):
+        batch.append((number, line))
+        if len(batch) >= IMPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def read_stream_lines(chunks):
+    """Like read_lines, for an async iterator of byte chunks (a request body)."""
+    batch = []
+    pending = b""
+    number = 0
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            number += 1
+            batch.append((number, line))
+            if len(batch) >= IMPORT_BATCH:
+                yield batch
+                batch = []
+    if pending:
+        batch.append((number + 1, pending))
+    if batch:
+        yield batch
+
+
+if __name__ == "__main__":
+    import migrations
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("export", "import"):
+        sys.exit("usage: python -m transfer export DB [USER_ID] > FILE | python -m transfer import DB FILE [USER_ID]")
+    command, db_path = sys.argv[1], sys.argv[2]
+    if command == "export":
+        user_id = sys.argv[3] if len(sys.argv) > 3 else "demo-user"
+        for chunk in export_lines(db_path, user_id):
+            sys.stdout.buffer.write(chunk)
+    else:
+        import main
+
+        migrations.migrate(db_path)
+        user_id = sys.argv[4] if len(sys.argv) > 4 else "demo-user"
+        importer = Importer(db_path, user_id, lambda c, user, profile: main._store_profile(c, user, profile, None))
+        with open(sys.argv[3], "rb") as f:
+            for batch in read_lines(f):
+                importer.write(batch)
+        db_writer.close_all()
+        print(json.dumps(importer.counts), file=sys.stderr)